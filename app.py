@@ -5,11 +5,23 @@ from flask import (Flask,
                    request,
                    render_template,
                    flash,
-                   abort)  # g, escape
+                   abort,
+                   Response,
+                   stream_with_context,
+                   stream_template,
+                   jsonify,
+                   get_flashed_messages,
+                   has_request_context,
+                   g)  # escape
 from werkzeug.security import (generate_password_hash,
                                check_password_hash)
 from flask_bootstrap import Bootstrap
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import (CSRFProtect,
+                             generate_csrf)
+from flask_wtf.file import (FileField,
+                            FileRequired,
+                            FileAllowed)
 from wtforms.fields import (StringField,
                             PasswordField,
                             TextAreaField,
@@ -26,17 +38,67 @@ from wtforms.validators import (DataRequired,
                                 EqualTo,
                                 Optional)  # Length, NumberRange
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc
+from sqlalchemy import (func,
+                        or_,
+                        and_,
+                        bindparam,
+                        select,
+                        tuple_,
+                        literal,
+                        event,
+                        MetaData,
+                        Table,
+                        Column,
+                        Index)
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload
 from datetime import timedelta
 from datetime import datetime
-from calendar import monthrange
+from datetime import date
+from datetime import timezone
+from email.message import EmailMessage
+from itertools import groupby
+from itsdangerous import (URLSafeSerializer,
+                          BadSignature)
+from recurrence import (RuleCache,
+                        next_occurrence_date)
+from page_cache import make_page_cache
+from mailer import SmtpPool
+import task_import
+import occur_export
+import click
+import hashlib
+import io
+import json
+import os
+import threading
+import time
 
 
 app = Flask(__name__)
-app.config.from_object('config.DevConfig')
+app.config.from_object(os.environ.get('TODO_CONFIG', 'config.DevConfig'))
 bootstrap = Bootstrap(app)
+csrf = CSRFProtect(app)
 db = SQLAlchemy(app)
 SESSION_EXPIRATION=14400
+OCCUR_HORIZON_DAYS = app.config.get('OCCUR_HORIZON_DAYS', 60)   # Days of occurences materialized ahead of today
+OCCUR_FILL_INTERVAL = app.config.get('OCCUR_FILL_INTERVAL')      # Seconds between two in-process fills, None: off
+OCCUR_VIRTUAL = app.config.get('OCCUR_VIRTUAL', False)           # Pending occurences computed instead of stored
+OCCUR_VIRTUAL_DAYS = app.config.get('OCCUR_VIRTUAL_DAYS', 7)     # Days of pending occurences shown ahead of today
+OCCURS_PAGE_SIZE = app.config.get('OCCURS_PAGE_SIZE', 200)        # Occurences per page of list_all_occurs
+EXPORT_CHUNK = app.config.get('EXPORT_CHUNK', 1000)               # Rows fetched and written at a time by the export
+EXPORT_ROW_GROUP = app.config.get('EXPORT_ROW_GROUP', 50000)      # Rows per row group of the Parquet export
+API_PAGE_SIZE = app.config.get('API_PAGE_SIZE', 100)              # Rows per page of the JSON API, ?limit= up to 10x
+PICKER_SIZE = app.config.get('PICKER_SIZE', 50)                  # Candidates of sel_asgn, sel_ttag and their search
+QUERY_BUDGETS = app.config.get('QUERY_BUDGETS', {                 # (queries, ms of SQL) allowed per endpoint
+    'upd_task': (4, None), 'sel_asgn': (2, None), 'sel_ttag': (2, None), 'list_all_occurs': (2, None),
+    'list_tasks_for_me': (3, None), 'list_tasks_for_all': (3, None), 'list_tasks_by_tag': (4, None)})
+QUERY_BUDGET_STRICT = app.config.get('QUERY_BUDGET_STRICT', False)  # Over budget: an error instead of a warning
+QUERY_STATS_FOOTER = app.config.get('QUERY_STATS_FOOTER', app.debug)  # Query statistics at the bottom of the pages
+rule_cache = RuleCache(app.config.get('SCHED_RULE_CACHE_SIZE', 1024))
+page_cache = make_page_cache(app.config.get('PAGE_CACHE', 'memory'),       # Rendered list pages: 'memory',
+                             app.config.get('PAGE_CACHE_SIZE', 500))       # 'sqlite:<file>' or None
+CSRF_MARK = b'{{csrf_token}}'                                              # Token of the session in the cached pages
 
 
 dow = ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']
@@ -45,6 +107,7 @@ dow_choices = [('6', 'Dimanche'), ('0', 'Lundi'), ('1', 'Mardi'), ('2', 'Mercred
 sched_types = {'O': 'Unique', 'd': 'Quotidienne', 'w': 'Hebdomadaire', 'm': 'Mensuelle',
                'D': 'À chaque x jours', 'W': 'À chaque x semaines', 'M': 'À chaque x mois'}
 task_status = {'T': 'À Faire', 'D': 'Faite', 'C': 'Annulée', 'S': 'Sautée'}
+catch_up_policies = {'S': 'Sauter tout', 'C': 'Annuler tout', 'L': 'Garder la dernière'}
 
 
 # Database Model
@@ -99,6 +162,7 @@ class TaskList(db.Model):
 
 class Task(db.Model):
     __tablename__ = 'ttask'
+    __table_args__ = (db.Index('ttask_x1', 'list_id'),)
     task_id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
     list_id = db.Column(db.Integer(), db.ForeignKey('ttask_list.list_id'))
     task_name = db.Column(db.String(50), nullable=False, unique=True)
@@ -107,9 +171,10 @@ class Task(db.Model):
     audit_crt_ts = db.Column(db.DateTime(), nullable=False)
     audit_upd_user = db.Column(db.Integer(), nullable=True)
     audit_upd_ts = db.Column(db.DateTime(), nullable=True)
-    tags = db.relationship('TaskTag', cascade="all,delete", backref='ttask', lazy='dynamic')
-    schedules = db.relationship('TaskSched', cascade="all,delete", backref='ttask', lazy='dynamic')
-    assignees = db.relationship('Assignment', cascade="all,delete", backref='ttask', lazy='dynamic')
+    # Plain collections, so they can be eager loaded (see db_task_for_editor)
+    tags = db.relationship('TaskTag', cascade="all,delete", backref='ttask')
+    schedules = db.relationship('TaskSched', cascade="all,delete", backref='ttask', order_by='TaskSched.sched_id')
+    assignees = db.relationship('Assignment', cascade="all,delete", backref='ttask')
     occurences = db.relationship('TaskOccurence', cascade="all,delete", backref='ttask', lazy='dynamic')
 
     def __init__(self, list_id, task_name, task_desc, audit_crt_user, audit_crt_ts):
@@ -125,6 +190,7 @@ class Task(db.Model):
 
 class TaskSched(db.Model):
     __tablename__ = 'ttask_sched'
+    __table_args__ = (db.Index('ttask_sched_x1', 'task_id'),)
     sched_id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
     task_id = db.Column(db.Integer(), db.ForeignKey('ttask.task_id'))
     sched_type = db.Column(db.String(1), nullable=False)       # O:one, d:daily, w:weekly, m:monthly, D,W,M every x
@@ -159,6 +225,9 @@ class TaskSched(db.Model):
 
 class TaskOccurence(db.Model):
     __tablename__ = 'ttask_occur'
+    __table_args__ = (db.Index('ttask_occur_x1', 'status', 'sched_dt'),
+                      db.Index('ttask_occur_x2', 'sched_id', 'sched_dt'),
+                      db.Index('ttask_occur_x3', 'task_id'))
     occur_id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
     task_id = db.Column(db.Integer(), db.ForeignKey('ttask.task_id'))
     sched_id = db.Column(db.Integer(), db.ForeignKey('ttask_sched.sched_id'))
@@ -179,11 +248,10 @@ class TaskOccurence(db.Model):
 
 
 class Assignment(db.Model):
-    # TODO: Unique on user_id, task_id
     __tablename__ = 'tassignment'
-    # __table_args__ = (
-    #     db.UniqueConstraint('user_id', 'task_id', name='x1')
-    #     )
+    # A unique index rather than a constraint: SQLite can't add a constraint to an existing table
+    __table_args__ = (db.Index('tassignment_u1', 'user_id', 'task_id', unique=True),
+                      db.Index('tassignment_x1', 'task_id'))
     asgn_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('tapp_user.user_id'))
     task_id = db.Column(db.Integer, db.ForeignKey('ttask.task_id'))
@@ -217,6 +285,7 @@ class Tag(db.Model):
 
 class TaskTag(db.Model):
     __tablename__ = 'ttask_tag'
+    __table_args__ = (db.Index('ttask_tag_x1', 'tag_id'),)
     task_id = db.Column(db.Integer(), db.ForeignKey('ttask.task_id'), primary_key=True)
     tag_id = db.Column(db.Integer(), db.ForeignKey('ttag.tag_id'), primary_key=True)
 
@@ -228,6 +297,59 @@ class TaskTag(db.Model):
         return '<task_tag: {}.{}'.format(self.task_id, self.tag_id)
 
 
+# Read model of the open work: one row per occurence with a status To_Do and per assignee of its task, with the
+# columns shown by the lists of tasks. It's rebuilt for the schedules or tasks changed by the db_* functions
+# (see sync_open_work()), so the lists read it with one range scan instead of joining five tables.
+class OpenWork(db.Model):
+    __tablename__ = 'topen_work'
+    __table_args__ = (db.Index('topen_work_x1', 'user_id', 'sched_dt'),
+                      db.Index('topen_work_x2', 'sched_dt'),
+                      db.Index('topen_work_x3', 'task_id'),
+                      db.Index('topen_work_x4', 'sched_id'))
+    work_id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
+    occur_id = db.Column(db.Integer(), nullable=False)
+    user_id = db.Column(db.Integer(), nullable=False)
+    first_name = db.Column(db.String(30), nullable=False)
+    task_id = db.Column(db.Integer(), nullable=False)
+    task_name = db.Column(db.String(50), nullable=False)
+    sched_id = db.Column(db.Integer(), nullable=False)
+    sched_type = db.Column(db.String(1), nullable=False)
+    sched_int = db.Column(db.SmallInteger(), nullable=True)
+    sched_dow = db.Column(db.SmallInteger(), nullable=True)
+    sched_dom = db.Column(db.SmallInteger(), nullable=True)
+    sched_dt = db.Column(db.Date, nullable=False)
+
+    def __repr__(self):
+        return '<open_work: {}:{}'.format(self.occur_id, self.user_id)
+
+
+# Migrations applied to the database, see schema_migrations
+class SchemaVersion(db.Model):
+    __tablename__ = 'tschema_version'
+    version = db.Column(db.Integer(), primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_ts = db.Column(db.DateTime(), nullable=False)
+
+    def __init__(self, version, description, applied_ts):
+        self.version = version
+        self.description = description
+        self.applied_ts = applied_ts
+
+    def __repr__(self):
+        return '<schema_version: {}'.format(self.version)
+
+
+# One counter per kind of data ('occur', 'task', 'sched', 'tasklist', 'tag', 'ttag', 'user'), incremented in the
+# transaction of every change: a cheap version stamp for the ETags of the API and the keys of the page cache.
+class DataVersion(db.Model):
+    __tablename__ = 'tdata_version'
+    entity = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer(), nullable=False, default=0)
+
+    def __repr__(self):
+        return '<data_version: {}:{}'.format(self.entity, self.version)
+
+
 # Classes pour définir les formulaires WTF
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -460,9 +582,69 @@ class UpdSchedEveryXMonthsForm(FlaskForm):
     submit = SubmitField('Modifier')
 
 
+# Formulaire de l'import de tâches
+class ImportTasksForm(FlaskForm):
+    import_file = FileField('Fichier CSV ou JSON',
+                            validators=[FileRequired(message='Le fichier est requis.'),
+                                        FileAllowed(['csv', 'json'], message='Le fichier doit être .csv ou .json.')])
+    submit = SubmitField('Importer')
+
+
 # The following functions are views
 # ----------------------------------------------------------------------------------------------------------------------
 
+# Statistics of the SQL statements of each request: count, total time and slowest statement, kept in g.query_stats.
+# They are sent in the Server-Timing header, shown at the bottom of the pages with QUERY_STATS_FOOTER and compared
+# with the budget of the endpoint (QUERY_BUDGETS). The statements of a streamed body are run after the header is sent:
+# only the footer counts them.
+@event.listens_for(Engine, 'before_cursor_execute')
+def query_stats_start(conn, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def query_stats_end(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or 'query_stats' not in g:
+        return
+    elapsed = time.perf_counter() - context.query_start_time
+    stats = g.query_stats
+    stats['count'] += 1
+    stats['time'] += elapsed
+    if elapsed >= stats['slowest_time']:
+        stats['slowest_time'] = elapsed
+        stats['slowest'] = statement
+
+
+@app.before_request
+def query_stats_init():
+    g.query_stats = {'count': 0, 'time': 0.0, 'slowest_time': 0.0, 'slowest': None}
+
+
+@app.after_request
+def query_stats_report(response):
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(stats['time'] * 1000,
+                                                                                  stats['count']))
+    if stats['slowest'] is not None:
+        response.headers.add('Server-Timing', 'db-slowest;dur={:.2f}'.format(stats['slowest_time'] * 1000))
+    max_queries, max_ms = QUERY_BUDGETS.get(request.endpoint, (None, None))
+    if (max_queries is not None and stats['count'] > max_queries) or \
+            (max_ms is not None and stats['time'] * 1000 > max_ms):
+        message = 'Query budget of {} exceeded: {} queries, {:.1f} ms (budget: {} queries, {} ms), slowest: {}'\
+            .format(request.endpoint, stats['count'], stats['time'] * 1000, max_queries, max_ms, stats['slowest'])
+        if QUERY_BUDGET_STRICT:
+            raise RuntimeError(message)
+        app.logger.warning(message)
+    return response
+
+
+@app.context_processor
+def query_stats_context():
+    return {'query_stats_footer': QUERY_STATS_FOOTER, 'query_stats': lambda: g.get('query_stats')}
+
+
 # Custom error pages
 @app.errorhandler(404)
 def page_not_found(e):
@@ -646,16 +828,20 @@ def del_user(user_id):
 def list_tasklists():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        tasklists = TaskList.query.order_by(TaskList.list_name).all()
-        for tasklist in tasklists:
-            u = db_user_by_id(tasklist.audit_crt_user)
-            tasklist.audit_crt_user_name = u.user_name()
-        return render_template('list_tasklists.html', tasklists=tasklists)
-    except Exception as e:
-        flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
-        abort(500)
+
+    def page():
+        try:
+            tasklists = TaskList.query.order_by(TaskList.list_name).all()
+            names = user_names(tasklist.audit_crt_user for tasklist in tasklists)
+            for tasklist in tasklists:
+                tasklist.audit_crt_user_name = names.get(tasklist.audit_crt_user, 'N/A')
+            return render_template('list_tasklists.html', tasklists=tasklists)
+        except Exception as e:
+            flash("Quelque chose n'a pas fonctionné.")
+            app.logger.error('Error: ' + str(e))
+            abort(500)
+
+    return cached_page(('tasklist', 'user'), page)
 
 
 @app.route('/show_tasklist/<int:list_id>')
@@ -665,11 +851,10 @@ def show_tasklist(list_id):
     try:
         tasklist = TaskList.query.get(list_id)
         if tasklist:
-            u = db_user_by_id(tasklist.audit_crt_user)
-            tasklist.audit_crt_user_name = u.user_name()
+            names = user_names([tasklist.audit_crt_user, tasklist.audit_upd_user])
+            tasklist.audit_crt_user_name = names.get(tasklist.audit_crt_user, 'N/A')
             if tasklist.audit_upd_user:
-                u = db_user_by_id(tasklist.audit_upd_user)
-                tasklist.audit_upd_user_name = u.user_name()
+                tasklist.audit_upd_user_name = names.get(tasklist.audit_upd_user, 'N/A')
             tasks = Task.query.filter_by(list_id=list_id) \
                 .order_by(Task.task_name).all()
             return render_template("show_tasklist.html", tasklist=tasklist, tasks=tasks)
@@ -775,16 +960,13 @@ def list_tasks_for_me():
         user_id = session.get('user_id', None)
         if user_id:
             user = AppUser.query.get(user_id)
-            tasks = AppUser.query.join(Assignment, AppUser.user_id == Assignment.user_id)\
-                .join(Task, Assignment.task_id == Task.task_id)\
-                .join(TaskSched, Task.task_id == TaskSched.task_id)\
-                .join(TaskOccurence, TaskSched.sched_id == TaskOccurence.sched_id)\
-                .filter(AppUser.user_id == user_id, TaskOccurence.status == 'T')\
-                .add_columns(Task.task_id, Task.task_name,
-                             TaskSched.sched_type, TaskSched.sched_int, TaskSched.sched_dow, TaskSched.sched_dom,
-                             TaskOccurence.sched_dt, TaskOccurence.occur_id)\
-                .order_by(TaskOccurence.sched_dt)
-            return render_template('list_tasks_for_me.html', user=user, tasks=tasks, sched_types=sched_types, dow=dow)
+            tasks = open_work_query(user_id=user_id)
+            if OCCUR_VIRTUAL:
+                scheds = assigned_sched_query(user_id=user_id)
+                tasks = merge_virtual_occurs(tasks, scheds)
+            ical_url = url_for('ical_user', user_id=user_id, key=ical_key('u', user_id), _external=True)
+            return render_template('list_tasks_for_me.html', user=user, tasks=tasks, sched_types=sched_types, dow=dow,
+                                   catch_up_policies=catch_up_policies, ical_url=ical_url)
         else:
             flash("Quelque chose n'a pas fonctionné.")
             abort(500)
@@ -799,108 +981,95 @@ def list_tasks_for_me():
 def list_tasks_for_all():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        tasks = AppUser.query.join(Assignment, AppUser.user_id == Assignment.user_id)\
-            .join(Task, Assignment.task_id == Task.task_id)\
-            .join(TaskSched, Task.task_id == TaskSched.task_id)\
-            .join(TaskOccurence, TaskSched.sched_id == TaskOccurence.sched_id)\
-            .filter(TaskOccurence.status == 'T')\
-            .add_columns(AppUser.first_name,
-                         Task.task_id, Task.task_name,
-                         TaskSched.sched_type, TaskSched.sched_int, TaskSched.sched_dow, TaskSched.sched_dom,
-                         TaskOccurence.sched_dt, TaskOccurence.occur_id)\
-            .order_by(TaskOccurence.sched_dt, Task.task_name, TaskSched.sched_id, AppUser.first_name)
-        return render_template('list_tasks_for_all.html', tasks=tasks, sched_types=sched_types, dow=dow)
-    except Exception as e:
-        flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
-        abort(500)
+
+    def page():
+        try:
+            tasks = open_work_query()
+            if OCCUR_VIRTUAL:
+                scheds = assigned_sched_query()
+                tasks = merge_virtual_occurs(tasks, scheds)
+            return render_template('list_tasks_for_all.html', tasks=tasks, sched_types=sched_types, dow=dow)
+        except Exception as e:
+            flash("Quelque chose n'a pas fonctionné.")
+            app.logger.error('Error: ' + str(e))
+            abort(500)
+
+    return cached_page(('occur',), page)
 
 
 @app.route('/list_tasks_not_assigned')
 def list_tasks_not_assigned():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        tasks = Task.query.join(TaskList, Task.list_id == TaskList.list_id)\
-            .add_columns(TaskList.list_name, Task.task_id, Task.task_name)\
-            .order_by(TaskList.list_name, Task.task_name)
-        l_tasks = []
-        for task in tasks:
-            assignee = Assignment.query.filter_by(task_id=task.task_id).first()
-            if assignee is None:
-                l_tasks.append(task)
-        return render_template('list_tasks_not_assigned.html', tasks=l_tasks)
-    except Exception as e:
+    tasks = db_task_health(has_assignee=False)
+    if tasks is None:
         flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
         abort(500)
+    return render_template('list_tasks_not_assigned.html', tasks=tasks)
 
 
 @app.route('/list_tasks_no_sched')
 def list_tasks_no_sched():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        tasks = Task.query.join(TaskList, Task.list_id == TaskList.list_id)\
-            .add_columns(TaskList.list_name, Task.task_id, Task.task_name)\
-            .order_by(TaskList.list_name, Task.task_name)
-        l_tasks = []
-        for task in tasks:
-            sched = TaskSched.query.filter_by(task_id=task.task_id).first()
-            if sched is None:
-                l_tasks.append(task)
-        return render_template('list_tasks_no_sched.html', tasks=l_tasks)
-    except Exception as e:
+    tasks = db_task_health(has_sched=False)
+    if tasks is None:
         flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
         abort(500)
+    return render_template('list_tasks_no_sched.html', tasks=tasks)
 
 
 @app.route('/list_tasks_inactive')
 def list_tasks_inactive():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        tasks = Task.query.join(TaskList, Task.list_id == TaskList.list_id)\
-            .add_columns(TaskList.list_name, Task.task_id, Task.task_name)\
-            .order_by(TaskList.list_name, Task.task_name)
-        l_tasks = []
-        for task in tasks:
-            inactive = True
-            occ = TaskOccurence.query.filter_by(task_id=task.task_id, status='T').first()
-            if occ is None:
-                l_tasks.append(task)
-        return render_template('list_tasks_inactive.html', tasks=l_tasks)
-    except Exception as e:
+    tasks = db_task_health(has_open_occur=False)
+    if tasks is None:
         flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
         abort(500)
+    return render_template('list_tasks_inactive.html', tasks=tasks)
 
 
-@app.route('/list_tasks_by_tag/<int:tag_id>')
-def list_tasks_by_tag(tag_id):
+# Report of the health of every task, filtered with ?assignee=, ?sched= and ?open= (1: yes, 0: no, empty: all)
+@app.route('/task_health')
+def task_health():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        session['tag_id'] = tag_id
-        tag = db_tag_by_id(tag_id)
-        tasks = AppUser.query.join(Assignment, AppUser.user_id == Assignment.user_id)\
-            .join(Task, Assignment.task_id == Task.task_id)\
-            .join(TaskTag, Task.task_id == TaskTag.task_id)\
-            .join(TaskSched, Task.task_id == TaskSched.task_id)\
-            .join(TaskOccurence, TaskSched.sched_id == TaskOccurence.sched_id)\
-            .filter(TaskTag.tag_id == tag_id, TaskOccurence.status == 'T')\
-            .add_columns(AppUser.first_name,
-                         Task.task_id, Task.task_name,
-                         TaskSched.sched_type, TaskSched.sched_int, TaskSched.sched_dow, TaskSched.sched_dom,
-                         TaskOccurence.sched_dt, TaskOccurence.occur_id)\
-            .order_by(TaskOccurence.sched_dt, Task.task_name, TaskSched.sched_id, AppUser.first_name)
-        return render_template('list_tasks_by_tag.html', tasks=tasks, tag=tag, sched_types=sched_types, dow=dow)
-    except Exception as e:
+    filters = {}
+    for arg, name in (('assignee', 'has_assignee'), ('sched', 'has_sched'), ('open', 'has_open_occur')):
+        value = request.args.get(arg, '')
+        if value in ('0', '1'):
+            filters[name] = value == '1'
+    tasks = db_task_health(**filters)
+    if tasks is None:
         flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
         abort(500)
+    return render_template('task_health.html', tasks=tasks, args=request.args)
+
+
+@app.route('/list_tasks_by_tag/<int:tag_id>')
+def list_tasks_by_tag(tag_id):
+    if not logged_in():
+        return redirect(url_for('login'))
+    session['tag_id'] = tag_id
+
+    def page():
+        try:
+            tag = db_tag_by_id(tag_id)
+            tasks = open_work_query(tag_id=tag_id)
+            if OCCUR_VIRTUAL:
+                scheds = assigned_sched_query(tag_id=tag_id)
+                tasks = merge_virtual_occurs(tasks, scheds)
+            ical_url = url_for('ical_tag', tag_id=tag_id, key=ical_key('t', tag_id), _external=True)
+            return render_template('list_tasks_by_tag.html', tasks=tasks, tag=tag, sched_types=sched_types, dow=dow,
+                                   ical_url=ical_url)
+        except Exception as e:
+            flash("Quelque chose n'a pas fonctionné.")
+            app.logger.error('Error: ' + str(e))
+            abort(500)
+
+    return cached_page(('occur', 'ttag', 'tag'), page)
+
 
 @app.route('/add_task', methods=['GET', 'POST'])
 def add_task():
@@ -932,7 +1101,7 @@ def upd_task(task_id):
         return redirect(url_for('login'))
     list_id = session['list_id']
     session['task_id'] = task_id
-    task = db_task_by_id(task_id)
+    task = db_task_for_editor(task_id)
     if task is None:
         flash("L'information n'a pas pu être retrouvée.")
         return redirect(url_for('upd_tasklist', list_id=list_id))
@@ -940,27 +1109,24 @@ def upd_task(task_id):
         app.logger.debug('getting assignees')
         list_id = task.list_id
         session['list_id'] = list_id
-        count_assignees = 0
         assignees = []
         for a in task.assignees:
             asgn = {}
             asgn['asgn_id'] = a.asgn_id
-            u = AppUser.query.filter_by(user_id=a.user_id).first()
-            asgn['user_name'] = u.first_name + ' ' + u.last_name
+            if a.tapp_user:
+                asgn['user_name'] = a.tapp_user.first_name + ' ' + a.tapp_user.last_name
+            else:
+                asgn['user_name'] = 'N/A'
             assignees.append(asgn)
-            count_assignees += 1
-        count_tags = 0
+        count_assignees = len(assignees)
         tags = []
         for t_tag in task.tags:
             tag = {}
             tag['tag_id'] = t_tag.tag_id
-            qtag = Tag.query.filter_by(tag_id=t_tag.tag_id).first()
-            tag['tag_name'] = qtag.tag_name
+            tag['tag_name'] = t_tag.ttag.tag_name if t_tag.ttag else 'N/A'
             tags.append(tag)
-            count_tags += 1
-        count_scheds = 0
-        for _ in task.schedules:
-            count_scheds += 1
+        count_tags = len(tags)
+        count_scheds = len(task.schedules)
 
     form = UpdTaskForm()
     if form.validate_on_submit():
@@ -971,7 +1137,8 @@ def upd_task(task_id):
         if (task_name != save_task_name) and db_task_exists(task_name):
             flash('Ce nom de tâche existe déjà. Veuillez en choisir un autre.')
             return render_template("upd_task.html", form=form, list_id=list_id, task=task, dow=dow,
-                                   count_assignees=count_assignees, count_tags=count_tags, count_scheds=count_scheds)
+                                   assignees=assignees, count_assignees=count_assignees,
+                                   tags=tags, count_tags=count_tags, count_scheds=count_scheds)
         if db_upd_task(task_id, task_name, task_desc):
             flash("La tâche a été modifiée.")
         else:
@@ -1007,6 +1174,33 @@ def del_task(task_id):
             return redirect(url_for('upd_tasklist', list_id=list_id))
 
 
+# Import of the lists, tasks, tags, assignments and schedules of a CSV or JSON file (see task_import)
+@app.route('/import_tasks', methods=['GET', 'POST'])
+def import_tasks():
+    if not logged_in():
+        return redirect(url_for('login'))
+    app.logger.debug('Entering import_tasks')
+    form = ImportTasksForm()
+    errors = []
+    if form.validate_on_submit():
+        import_file = form.import_file.data
+        file_format = import_file.filename.rsplit('.', 1)[-1].lower()
+        try:
+            text = import_file.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            errors = ['Le fichier doit être en UTF-8.']
+        else:
+            result, errors = import_tasks_file(text, file_format, session.get('user_id', None))
+            if result is None:
+                flash('Une erreur de base de données est survenue.')
+                abort(500)
+            if not errors:
+                flash('{} tâche(s), {} cédule(s), {} assignation(s) et {} étiquette(s) de tâche importées.'
+                      .format(result['tasks'], result['schedules'], result['assignments'], result['task_tags']))
+                return redirect(url_for('list_tasklists'))
+    return render_template('import_tasks.html', form=form, errors=errors, columns=task_import.CSV_COLUMNS)
+
+
 # Views for Assignments
 # Ordre des vues: list, show, add, upd, del
 @app.route('/sel_asgn/<int:task_id>')
@@ -1014,17 +1208,29 @@ def sel_asgn(task_id):
     if not logged_in():
         return redirect(url_for('login'))
 
-    assignments = Assignment.query.filter_by(task_id=task_id).all()
-    for a in assignments:
-        u = AppUser.query.filter_by(user_id=a.user_id).first()
-        a.user_name = u.first_name + ' ' + u.last_name
+    search = request.args.get('q', '').strip()
+    assignments = db_task_assignments(task_id)
+    users = db_asgn_candidates(task_id, search, PICKER_SIZE + 1)
+    if assignments is None or users is None:
+        flash('Une erreur de base de données est survenue.')
+        abort(500)
+    return render_template('sel_asgn.html', task_id=task_id, users=users[:PICKER_SIZE], assignments=assignments,
+                           search=search, more=len(users) > PICKER_SIZE)
 
-    tmp_users = AppUser.query.order_by(AppUser.first_name).all()
-    users = []
-    for u in tmp_users:
-        if not db_asgn_exists(task_id, u.user_id):
-            users.append(u)
-    return render_template('sel_asgn.html', task_id=task_id, users=users, assignments=assignments)
+
+# Typeahead of sel_asgn: the first PICKER_SIZE users not assigned to the task whose name starts with ?q=
+@app.route('/sel_asgn/<int:task_id>/candidates')
+def asgn_candidates(task_id):
+    if not logged_in():
+        abort(401)
+    users = db_asgn_candidates(task_id, request.args.get('q', '').strip(), PICKER_SIZE + 1)
+    if users is None:
+        abort(500)
+    return jsonify(more=len(users) > PICKER_SIZE,
+                   candidates=[{'id': u.user_id,
+                                'name': u.first_name + ' ' + u.last_name,
+                                'add_url': url_for('add_asgn', task_id=task_id, user_id=u.user_id)}
+                               for u in users[:PICKER_SIZE]])
 
 
 @app.route('/add_asgn/<int:task_id>/<int:user_id>')
@@ -1063,16 +1269,20 @@ def del_asgn(asgn_id, redir_to):
 def list_tags():
     if not logged_in():
         return redirect(url_for('login'))
-    try:
-        tags = Tag.query.order_by(Tag.tag_name).all()
-        for tag in tags:
-            u = db_user_by_id(tag.audit_crt_user)
-            tag.audit_crt_user_name = u.user_name()
-        return render_template('list_tags.html', tags=tags)
-    except Exception as e:
-        flash("Quelque chose n'a pas fonctionné.")
-        app.logger.error('Error: ' + str(e))
-        abort(500)
+
+    def page():
+        try:
+            tags = Tag.query.order_by(Tag.tag_name).all()
+            names = user_names(tag.audit_crt_user for tag in tags)
+            for tag in tags:
+                tag.audit_crt_user_name = names.get(tag.audit_crt_user, 'N/A')
+            return render_template('list_tags.html', tags=tags)
+        except Exception as e:
+            flash("Quelque chose n'a pas fonctionné.")
+            app.logger.error('Error: ' + str(e))
+            abort(500)
+
+    return cached_page(('tag', 'user'), page)
 
 
 @app.route('/show_tag/<int:tag_id>')
@@ -1082,11 +1292,10 @@ def show_tag(tag_id):
     try:
         tag = db_tag_by_id(tag_id)
         if tag:
-            u = db_user_by_id(tag.audit_crt_user)
-            tag.audit_crt_user_name = u.user_name()
+            names = user_names([tag.audit_crt_user, tag.audit_upd_user])
+            tag.audit_crt_user_name = names.get(tag.audit_crt_user, 'N/A')
             if tag.audit_upd_user:
-                u = db_user_by_id(tag.audit_upd_user)
-                tag.audit_upd_user_name = u.user_name()
+                tag.audit_upd_user_name = names.get(tag.audit_upd_user, 'N/A')
             return render_template("show_tag.html", tag=tag)
         else:
             flash("L'information n'a pas pu être retrouvée.")
@@ -1175,17 +1384,29 @@ def sel_ttag(task_id):
     if not logged_in():
         return redirect(url_for('login'))
 
-    task_tags = TaskTag.query.filter_by(task_id=task_id).all()
-    for t_tag in task_tags:
-        tag = Tag.query.filter_by(tag_id=t_tag.tag_id).first()
-        t_tag.tag_name = tag.tag_name
+    search = request.args.get('q', '').strip()
+    task_tags = db_task_tags(task_id)
+    tags = db_ttag_candidates(task_id, search, PICKER_SIZE + 1)
+    if task_tags is None or tags is None:
+        flash('Une erreur de base de données est survenue.')
+        abort(500)
+    return render_template('sel_ttag.html', task_id=task_id, tags=tags[:PICKER_SIZE], task_tags=task_tags,
+                           search=search, more=len(tags) > PICKER_SIZE)
+
 
-    tmp_tags = Tag.query.order_by(Tag.tag_name).all()
-    tags = []
-    for t in tmp_tags:
-        if not db_ttag_exists(task_id, t.tag_id):
-            tags.append(t)
-    return render_template('sel_ttag.html', task_id=task_id, tags=tags, task_tags=task_tags)
+# Typeahead of sel_ttag: the first PICKER_SIZE tags not on the task whose name starts with ?q=
+@app.route('/sel_ttag/<int:task_id>/candidates')
+def ttag_candidates(task_id):
+    if not logged_in():
+        abort(401)
+    tags = db_ttag_candidates(task_id, request.args.get('q', '').strip(), PICKER_SIZE + 1)
+    if tags is None:
+        abort(500)
+    return jsonify(more=len(tags) > PICKER_SIZE,
+                   candidates=[{'id': t.tag_id,
+                                'name': t.tag_name,
+                                'add_url': url_for('add_ttag', task_id=task_id, tag_id=t.tag_id)}
+                               for t in tags[:PICKER_SIZE]])
 
 
 @app.route('/add_ttag/<int:task_id>/<int:tag_id>')
@@ -1259,7 +1480,7 @@ def add_sched_one():
         sched_type = 'O'
         #sched_start_dt = datetime.strptime(request.form['sched_start_dt'], '%Y-%m-%d')
         sched_start_dt = form.sched_start_dt.data
-        sched_id = db_add_sched(task_id, sched_type, sched_start_dt, None, sched_start_dt, None, None, None)
+        sched_id = db_add_sched(task_id, sched_type, sched_start_dt, None, None, None, None, None)
         if sched_id:
             flash('La nouvelle cédule unique a été ajoutée.')
             if db_add_occur(sched_id):
@@ -1500,7 +1721,6 @@ def upd_sched_one(sched_id):
         sched_start_dt = form.sched_start_dt.data
         if db_upd_sched_one(sched_id, sched_start_dt):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1532,7 +1752,6 @@ def upd_sched_dly(sched_id):
             sched_end_dt = None
         if db_upd_sched_dly(sched_id, sched_start_dt, sched_end_dt):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1566,7 +1785,6 @@ def upd_sched_wly(sched_id):
             sched_end_dt = None
         if db_upd_sched_wly(sched_id, sched_start_dt, sched_end_dt, sched_dow):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1601,7 +1819,6 @@ def upd_sched_mly(sched_id):
             sched_end_dt = None
         if db_upd_sched_mly(sched_id, sched_start_dt, sched_end_dt, sched_dom):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1635,7 +1852,6 @@ def upd_sched_xdy(sched_id):
             sched_end_dt = None
         if db_upd_sched_xdy(sched_id, sched_start_dt, sched_end_dt, sched_int):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1671,7 +1887,6 @@ def upd_sched_xwk(sched_id):
             sched_end_dt = None
         if db_upd_sched_xwk(sched_id, sched_start_dt, sched_end_dt, sched_dow, sched_int):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1708,7 +1923,6 @@ def upd_sched_xmo(sched_id):
             sched_end_dt = None
         if db_upd_sched_xmo(sched_id, sched_start_dt, sched_end_dt, sched_dom, sched_int):
             flash("La cédule a été modifiée.")
-            db_add_occur(sched_id, update_mode='Y')
         else:
             flash("Quelque chose n'a pas fonctionné.")
         return redirect(url_for('upd_task', task_id=task_id))
@@ -1749,41 +1963,99 @@ def list_occurs(sched_id):
     try:
         task = db_task_by_id(task_id)
         occurs = TaskOccurence.query.filter_by(sched_id=sched_id).order_by(TaskOccurence.sched_dt).all()
+        names = user_names(occ.audit_upd_user for occ in occurs)
         for occ in occurs:
-            if occ.audit_upd_user:
-                u = db_user_by_id(occ.audit_upd_user)
-                occ.audit_upd_user_name = u.user_name()
-            else:
-                occ.audit_upd_user_name = 'N/A'
-        return render_template('list_occurs.html', occurs=occurs, task=task, task_status=task_status)
+            occ.audit_upd_user_name = names.get(occ.audit_upd_user, 'N/A')
+        return render_template('list_occurs.html', occurs=occurs, task=task, sched_id=sched_id,
+                               task_status=task_status, catch_up_policies=catch_up_policies)
     except Exception as e:
         flash("Quelque chose n'a pas fonctionné.")
         app.logger.error('Error: ' + str(e))
         abort(500)
 
 
+# Pages of OCCURS_PAGE_SIZE occurences by occur_id: ?after= is the last occur_id of the previous page (keyset, the
+# cost of a page doesn't depend on its position). Filters: ?status=, ?from_dt=, ?to_dt= (YYYY-MM-DD) and ?task_id=.
+# The task and user names come from the same query, and the page is streamed while the rows are read.
 @app.route('/list_all_occurs')
 def list_all_occurs():
     if not logged_in():
         return redirect(url_for('login'))
+    filters = occur_filters()
+    after = request.args.get('after', 0, type=int)
     try:
-        occurs = TaskOccurence.query\
-            .order_by(TaskOccurence.occur_id).all()
-        for occ in occurs:
-            if occ.audit_upd_user:
-                u = db_user_by_id(occ.audit_upd_user)
-                occ.audit_upd_user_name = u.user_name()
-            else:
-                occ.audit_upd_user_name = 'N/A'
-            t = db_task_by_id(occ.task_id)
-            occ.task_name = t.task_name
-        return render_template('list_all_occurs.html', occurs=occurs, task_status=task_status)
+        occurs = db.session.query(TaskOccurence.occur_id, TaskOccurence.task_id, Task.task_name,
+                                  TaskOccurence.sched_id, TaskOccurence.sched_dt, TaskOccurence.status,
+                                  TaskOccurence.audit_upd_ts,
+                                  (AppUser.first_name + ' ' + AppUser.last_name).label('audit_upd_user_name'))\
+            .outerjoin(Task, TaskOccurence.task_id == Task.task_id)\
+            .outerjoin(AppUser, TaskOccurence.audit_upd_user == AppUser.user_id)\
+            .filter(TaskOccurence.occur_id > after)
+        occurs = filter_occurs(occurs, filters)
+        occurs = occurs.order_by(TaskOccurence.occur_id).limit(OCCURS_PAGE_SIZE).yield_per(100)
+        tasks = db.session.query(Task.task_id, Task.task_name).order_by(Task.task_name).all()
+        return stream_template('list_all_occurs.html', occurs=occurs, task_status=task_status, tasks=tasks,
+                               filters=filters, after=after, page_size=OCCURS_PAGE_SIZE)
     except Exception as e:
         flash("Quelque chose n'a pas fonctionné.")
         app.logger.error('Error: ' + str(e))
         abort(500)
 
 
+# Export of the occurences with the filters of list_all_occurs, ?format=csv (default) or parquet. The body is
+# generated while it is sent (see occur_export): the memory used doesn't depend on the number of occurences.
+@app.route('/export_occurs')
+def export_occurs():
+    if not logged_in():
+        return redirect(url_for('login'))
+    app.logger.debug('Entering export_occurs')
+    file_format = request.args.get('format', 'csv')
+    filters = occur_filters()
+    if file_format == 'csv':
+        chunks = occur_export.csv_chunks(export_occurs_rows(filters), EXPORT_CHUNK)
+        mimetype = 'text/csv'
+    elif file_format == 'parquet':
+        if not occur_export.parquet_available():
+            flash("L'export en Parquet demande le module pyarrow.")
+            return redirect(url_for('list_all_occurs', **filters))
+        chunks = occur_export.parquet_chunks(export_occurs_rows(filters), EXPORT_ROW_GROUP)
+        mimetype = 'application/vnd.apache.parquet'
+    else:
+        abort(400)
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename="occurences.{}"'.format(file_format)
+    return response
+
+
+# Filters of the occurences in the query string: status, from_dt, to_dt and task_id. The invalid ones are ignored.
+def occur_filters():
+    filters = {}
+    status = request.args.get('status', '')
+    if status in task_status:
+        filters['status'] = status
+    for arg in ('from_dt', 'to_dt'):
+        try:
+            filters[arg] = datetime.strptime(request.args.get(arg, ''), '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    task_id = request.args.get('task_id', None, type=int)
+    if task_id:
+        filters['task_id'] = task_id
+    return filters
+
+
+def filter_occurs(occurs, filters):
+    if 'status' in filters:
+        occurs = occurs.filter(TaskOccurence.status == filters['status'])
+    if 'from_dt' in filters:
+        occurs = occurs.filter(TaskOccurence.sched_dt >= filters['from_dt'])
+    if 'to_dt' in filters:
+        occurs = occurs.filter(TaskOccurence.sched_dt <= filters['to_dt'])
+    if 'task_id' in filters:
+        occurs = occurs.filter(TaskOccurence.task_id == filters['task_id'])
+    return occurs
+
+
 @app.route('/set_occur_status/<int:occur_id>/<string:status>/<int:redir_to>')
 def set_occur_status(occur_id, status, redir_to):
     if not logged_in():
@@ -1797,7 +2069,8 @@ def set_occur_status(occur_id, status, redir_to):
             if sched:
                 if db_set_occ_status(occur_id, status):
                     flash("Le status a été changé.")
-                    if sched.sched_type != 'O':
+                    # The next occurence may already be there when the horizon has been filled
+                    if sched.sched_type != 'O' and not OCCUR_VIRTUAL and not db_sched_has_open_occur(occ.sched_id):
                         if db_add_occur(occ.sched_id, update_mode='N'):
                             flash("L'occurence suivante a été ajoutée.")
                         else:
@@ -1847,8 +2120,701 @@ def set_occur_status(occur_id, status, redir_to):
         abort(500)
 
 
+# Catch-up of the occurences missed before today, for one schedule or for every schedule of the current user
+@app.route('/catch_up_occurs/<int:sched_id>/<string:policy>')
+def catch_up_occurs(sched_id, policy):
+    if not logged_in():
+        return redirect(url_for('login'))
+    app.logger.debug('Entering catch_up_occurs')
+    if policy not in catch_up_policies:
+        abort(404)
+    nb_occurs = db_catch_up_occurs([sched_id], policy)
+    if nb_occurs is None:
+        flash('Une erreur de base de données est survenue.')
+        abort(500)
+    flash('{} occurence(s) en retard ont été traitées.'.format(nb_occurs))
+    return redirect(url_for('list_occurs', sched_id=sched_id))
+
+
+@app.route('/catch_up_for_me/<string:policy>')
+def catch_up_for_me(policy):
+    if not logged_in():
+        return redirect(url_for('login'))
+    app.logger.debug('Entering catch_up_for_me')
+    if policy not in catch_up_policies:
+        abort(404)
+    user_id = session.get('user_id', None)
+    sched_ids = [row.sched_id for row in db.session.query(TaskSched.sched_id)
+                 .join(Assignment, TaskSched.task_id == Assignment.task_id)
+                 .filter(Assignment.user_id == user_id)]
+    nb_occurs = db_catch_up_occurs(sched_ids, policy)
+    if nb_occurs is None:
+        flash('Une erreur de base de données est survenue.')
+        abort(500)
+    flash('{} occurence(s) en retard ont été traitées.'.format(nb_occurs))
+    return redirect(url_for('list_tasks_for_me'))
+
+
+# Status change of an occurence computed from its schedule (OCCUR_VIRTUAL), which is stored only at that moment
+@app.route('/set_vocc_status/<int:sched_id>/<string:sched_dt>/<string:status>/<int:redir_to>')
+def set_vocc_status(sched_id, sched_dt, status, redir_to):
+    if not logged_in():
+        return redirect(url_for('login'))
+    app.logger.debug('Entering set_vocc_status')
+    try:
+        sched_dt = datetime.strptime(sched_dt, '%Y-%m-%d').date()
+    except ValueError:
+        abort(404)
+    if status not in task_status:
+        abort(404)
+    if db_add_occur_status(sched_id, sched_dt, status):
+        flash("Le status a été changé.")
+    else:
+        flash("L'info n'a pas pu être retrouvée.")
+    if redir_to == 1:
+        return redirect(url_for('list_tasks_for_me'))
+    elif redir_to == 2:
+        return redirect(url_for('list_tasks_for_all'))
+    elif redir_to == 3:
+        tag_id = session['tag_id']
+        return redirect(url_for('list_tasks_by_tag', tag_id=tag_id))
+    else:
+        flash("Je ne sais pas ou retourner.")
+        abort(500)
+
+
+# Status change of the occurences checked in the lists of tasks, in one transaction (see db_set_occ_statuses()).
+# Each value of "occur" is an occur_id, or sched_id:YYYY-MM-DD for an occurence computed from its schedule.
+# Answers with JSON to a client that asks for it, else with a redirect to the list (redir_to, like set_occur_status).
+# With "fragment", sent by the script of the lists, answers with only the rows of the schedules changed, as they are
+# now in the list (the next occurence, or nothing), so the page replaces them without being reloaded.
+# CSRFProtect checks the csrf_token of the form, or the X-CSRFToken header sent by the script from the csrf-token meta.
+@app.route('/set_occur_statuses', methods=['POST'])
+def set_occur_statuses():
+    json_answer = wants_json()
+    if not logged_in():
+        return api_error(401, 'Connexion requise.') if json_answer else redirect(url_for('login'))
+    app.logger.debug('Entering set_occur_statuses')
+    status = request.form.get('status', None)
+    redir_to = request.form.get('redir_to', 1, type=int)
+    tag_id = request.form.get('tag_id', None, type=int)
+    occur_ids = set()
+    computed = set()
+    try:
+        if status not in task_status:
+            raise ValueError(status)
+        for value in request.form.getlist('occur'):
+            if ':' in value:
+                sched_id, sched_dt = value.split(':')
+                computed.add((int(sched_id), datetime.strptime(sched_dt, '%Y-%m-%d').date()))
+            else:
+                occur_ids.add(int(value))
+    except ValueError:
+        if json_answer:
+            return api_error(400, 'Paramètre invalide.')
+        abort(400)
+    result = db_set_occ_statuses(occur_ids, computed, status)
+    if request.form.get('fragment'):
+        if result is None:
+            abort(500)
+        return task_rows_fragment(result['sched_ids'], redir_to, tag_id)
+    if json_answer:
+        if result is None:
+            return api_error(500, 'Une erreur de base de données est survenue.')
+        return jsonify(status=status, **result)
+    if result is None:
+        flash('Une erreur de base de données est survenue.')
+    elif not occur_ids and not computed:
+        flash("Aucune occurence n'a été choisie.")
+    else:
+        flash("Le status de {} occurence(s) a été changé.".format(result['changed']))
+        if result['added']:
+            flash("{} occurence(s) suivante(s) ajoutée(s).".format(result['added']))
+    return redirect_to_list(redir_to, tag_id)
+
+
+# Rows of the list redir_to (1: mine, 2: everybody, 3: the tag tag_id, posted by the page) for some schedules, in the
+# order of the list. The script of the lists puts each one at its place with its data-sort-key.
+def task_rows_fragment(sched_ids, redir_to, tag_id=None):
+    user_id = session.get('user_id', None) if redir_to == 1 else None
+    if redir_to != 3:
+        tag_id = None
+    elif tag_id is None:
+        tag_id = session.get('tag_id', None)
+    try:
+        tasks = open_work_query(user_id=user_id, tag_id=tag_id).filter(OpenWork.sched_id.in_(sched_ids))
+        if OCCUR_VIRTUAL:
+            scheds = assigned_sched_query(user_id=user_id, tag_id=tag_id).filter(TaskSched.sched_id.in_(sched_ids))
+            tasks = merge_virtual_occurs(tasks, scheds)
+        return render_template('task_rows_fragment.html', tasks=tasks, redir_to=redir_to,
+                               sched_types=sched_types, dow=dow)
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        abort(500)
+
+
+# Views for the iCalendar feeds
+# The calendar applications can't log in, so the feeds are also open with the key in their URL (see ical_key()).
+# They poll often: the ETag and Last-Modified are computed first from a few aggregates, and a 304 is returned
+# without reading the occurences when nothing has changed.
+@app.route('/ical/<int:user_id>')
+def ical_user(user_id):
+    if not ical_allowed('u', user_id):
+        abort(403)
+    user = db_user_by_id(user_id)
+    if user is None:
+        abort(404)
+    task_ids = db.session.query(Assignment.task_id).filter(Assignment.user_id == user_id)
+    scheds = assigned_sched_query(user_id=user_id)
+    return ical_response('Tâches de ' + user.first_name, task_ids, scheds, with_names=False)
+
+
+@app.route('/ical/tag/<int:tag_id>')
+def ical_tag(tag_id):
+    if not ical_allowed('t', tag_id):
+        abort(403)
+    tag = db_tag_by_id(tag_id)
+    if tag is None:
+        abort(404)
+    task_ids = db.session.query(TaskTag.task_id).filter(TaskTag.tag_id == tag_id)
+    scheds = assigned_sched_query(tag_id=tag_id)
+    return ical_response('Tâches ' + tag.tag_name, task_ids, scheds, with_names=True)
+
+
+# JSON API for the tablets and the scripts: /api/v1/occurrences, /api/v1/tasks and /api/v1/schedules.
+#   ?fields=a,b   only these fields (default: all)
+#   ?limit=n      rows per page, the URL of the next page is in "next" (keyset: ?after= is the key of the last row)
+# The strong ETag comes from the versions of tdata_version and the arguments: a client polling with If-None-Match gets
+# a 304 after one small query, without the query of the rows.
+@app.route('/api/v1/occurrences')
+def api_occurrences():
+    # Open occurences, by date, from the same queries as list_tasks_for_me (?user_id=), list_tasks_by_tag (?tag_id=)
+    # and list_tasks_for_all
+    if not logged_in():
+        return api_error(401, 'Connexion requise.')
+    try:
+        user_id = request.args.get('user_id', None, type=int)
+        tag_id = request.args.get('tag_id', None, type=int)
+        fields, limit = api_page_args(api_occur_fields)
+        after = request.args.get('after', None)
+        if after is not None:
+            after_dt, after_sched_id, after_user_id = after.split('.')
+            after = (date.fromisoformat(after_dt), int(after_sched_id), int(after_user_id))
+    except ValueError:
+        return api_error(400, 'Paramètre invalide.')
+    entities = ('occur', 'sched', 'task') if OCCUR_VIRTUAL else ('occur',)
+
+    def page():
+        occurs = open_work_query(user_id=user_id, tag_id=tag_id)
+        if OCCUR_VIRTUAL:
+            occurs = merge_virtual_occurs(occurs.add_columns(OpenWork.user_id),
+                                          assigned_sched_query(user_id=user_id, tag_id=tag_id))
+            occurs.sort(key=api_occur_key)
+            if after is not None:
+                occurs = [occ for occ in occurs if api_occur_key(occ) > after]
+            occurs = occurs[:limit + 1]
+        else:
+            key_columns = [OpenWork.sched_dt, OpenWork.sched_id, OpenWork.user_id]
+            occurs = occurs.with_entities(*(api_occur_fields[field] for field in fields), *key_columns)\
+                .order_by(None).order_by(*key_columns)
+            if after is not None:
+                occurs = occurs.filter(tuple_(*key_columns) > tuple_(*after))
+            occurs = [row._asdict() for row in occurs.limit(limit + 1)]
+        return occurs, lambda occ: '{}.{}.{}'.format(*api_occur_key(occ))
+
+    return api_response(entities, fields, limit, page)
+
+
+@app.route('/api/v1/tasks')
+def api_tasks():
+    if not logged_in():
+        return api_error(401, 'Connexion requise.')
+    try:
+        list_id = request.args.get('list_id', None, type=int)
+        fields, limit = api_page_args(api_task_fields)
+        after = request.args.get('after', None, type=int)
+    except ValueError:
+        return api_error(400, 'Paramètre invalide.')
+
+    def page():
+        tasks = db.session.query(*(api_task_fields[field] for field in fields), Task.task_id.label('key_id'))
+        if list_id is not None:
+            tasks = tasks.filter(Task.list_id == list_id)
+        if after is not None:
+            tasks = tasks.filter(Task.task_id > after)
+        tasks = tasks.order_by(Task.task_id).limit(limit + 1)
+        return [row._asdict() for row in tasks], lambda task: task['key_id']
+
+    return api_response(('task',), fields, limit, page)
+
+
+@app.route('/api/v1/schedules')
+def api_schedules():
+    if not logged_in():
+        return api_error(401, 'Connexion requise.')
+    try:
+        task_id = request.args.get('task_id', None, type=int)
+        fields, limit = api_page_args(api_sched_fields)
+        after = request.args.get('after', None, type=int)
+    except ValueError:
+        return api_error(400, 'Paramètre invalide.')
+
+    def page():
+        scheds = db.session.query(*(api_sched_fields[field] for field in fields), TaskSched.sched_id.label('key_id'))
+        if task_id is not None:
+            scheds = scheds.filter(TaskSched.task_id == task_id)
+        if after is not None:
+            scheds = scheds.filter(TaskSched.sched_id > after)
+        scheds = scheds.order_by(TaskSched.sched_id).limit(limit + 1)
+        return [row._asdict() for row in scheds], lambda sched: sched['key_id']
+
+    return api_response(('sched',), fields, limit, page)
+
+
 # Application functions
 # ----------------------------------------------------------------------------------------------------------------------
+# Schedules of the tasks assigned to a user (user_id), of a tag (tag_id) or of everybody, one row per assignee: the
+# sched_query of merge_virtual_occurs() and ical_response().
+def assigned_sched_query(user_id=None, tag_id=None):
+    scheds = AppUser.query.join(Assignment, AppUser.user_id == Assignment.user_id)\
+        .join(Task, Assignment.task_id == Task.task_id)\
+        .join(TaskSched, Task.task_id == TaskSched.task_id)
+    if user_id is not None:
+        scheds = scheds.filter(AppUser.user_id == user_id)
+    if tag_id is not None:
+        scheds = scheds.join(TaskTag, Task.task_id == TaskTag.task_id).filter(TaskTag.tag_id == tag_id)
+    return scheds
+
+
+# Adds the pending occurences computed from the schedules of sched_query to the stored ones of occ_query.
+# For each schedule, the occurences after sched_last_occ_dt up to OCCUR_VIRTUAL_DAYS from today are listed, or at
+# least the next one. The rows are dicts with the same keys as the rows of occ_query, occur_id being None.
+def merge_virtual_occurs(occ_query, sched_query):
+    until_dt = date.today() + timedelta(days=OCCUR_VIRTUAL_DAYS)
+    occurs = [row._asdict() for row in occ_query]
+    stored = set((occ['sched_id'], occ['sched_dt']) for occ in occurs)
+    scheds = sched_query.add_columns(AppUser.user_id, AppUser.first_name, Task.task_id, Task.task_name,
+                                     *sched_rule_columns())
+    for sched in scheds:
+        rule = sched_rule(sched)
+        dates = rule.dates(sched.sched_start_dt, until_dt, sched.sched_last_occ_dt)
+        if not dates:
+            next_dt = rule.next_date(sched.sched_last_occ_dt)
+            if next_dt:
+                dates = [next_dt]
+        for sched_dt in dates:
+            if (sched.sched_id, sched_dt) not in stored:
+                occurs.append({'user_id': sched.user_id, 'first_name': sched.first_name,
+                               'task_id': sched.task_id, 'task_name': sched.task_name,
+                               'sched_id': sched.sched_id, 'sched_type': sched.sched_type,
+                               'sched_int': sched.sched_int, 'sched_dow': sched.sched_dow,
+                               'sched_dom': sched.sched_dom, 'sched_dt': sched_dt, 'occur_id': None})
+    occurs.sort(key=lambda occ: (occ['sched_dt'], occ['task_name'], occ['sched_id'], occ.get('first_name', '')))
+    return occurs
+
+
+# Compiled rule of a schedule, shared through rule_cache. sched is a TaskSched or a row with sched_rule_columns().
+def sched_rule(sched):
+    return rule_cache.get((sched.sched_id, sched.audit_crt_ts, sched.audit_upd_ts), sched)
+
+
+def sched_rule_columns():
+    return [TaskSched.sched_id, TaskSched.task_id, TaskSched.sched_type, TaskSched.sched_start_dt,
+            TaskSched.sched_end_dt, TaskSched.sched_last_occ_dt, TaskSched.sched_dow, TaskSched.sched_dom,
+            TaskSched.sched_int, TaskSched.audit_crt_ts, TaskSched.audit_upd_ts]
+
+
+# LIKE pattern of the values starting with text, the wildcards of text escaped with a backslash
+def like_prefix(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# Names ('first_name last_name') of the users of user_ids, by user_id. The names are kept in flask.g for the rest of
+# the request: the users not seen yet are read with one IN query, instead of one query per row to display.
+def user_names(user_ids):
+    names = g.setdefault('user_names', {})
+    missing = set(user_id for user_id in user_ids if user_id is not None and user_id not in names)
+    if missing:
+        for u in db.session.query(AppUser.user_id, AppUser.first_name, AppUser.last_name)\
+                .filter(AppUser.user_id.in_(missing)):
+            names[u.user_id] = '{} {}'.format(u.first_name, u.last_name)
+    return names
+
+
+# Key of the URL of an iCalendar feed: kind is 'u' (user) or 't' (tag). It's signed with the SECRET_KEY.
+def ical_key(kind, entity_id):
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='ical').dumps([kind, entity_id])
+
+
+def ical_allowed(kind, entity_id):
+    key = request.args.get('key', None)
+    if key is None:
+        return logged_in()
+    try:
+        return URLSafeSerializer(app.config['SECRET_KEY'], salt='ical').loads(key) == [kind, entity_id]
+    except BadSignature:
+        return False
+
+
+# Response of a feed: the open occurences of the schedules of sched_query (joined like in the lists of tasks), one
+# VEVENT per occurence, or with ?rrule=1 one recurring VEVENT per schedule from its next open occurence.
+# task_ids is a query of the task_id in the feed, used for the ETag and Last-Modified.
+def ical_response(cal_name, task_ids, sched_query, with_names):
+    with_rrule = request.args.get('rrule', None) == '1'
+    version = db_ical_version(task_ids)
+    if version is None:
+        abort(500)
+    if OCCUR_VIRTUAL:
+        version = version + (date.today(),)   # The computed occurences move with the date
+    etag = hashlib.sha1(repr((version, with_rrule)).encode('utf-8')).hexdigest()
+    timestamps = [v for v in version if isinstance(v, datetime)]
+    last_modified = max(timestamps).astimezone(timezone.utc).replace(microsecond=0) if timestamps else None
+
+    # Only the ETag validates: the assignments have no timestamp, so Last-Modified doesn't see all the changes
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        occurs = sched_query.join(TaskOccurence, TaskSched.sched_id == TaskOccurence.sched_id)\
+            .filter(TaskOccurence.status == 'T')\
+            .add_columns(AppUser.first_name,
+                         Task.task_id, Task.task_name, TaskSched.sched_id,
+                         TaskSched.sched_type, TaskSched.sched_int, TaskSched.sched_dow, TaskSched.sched_dom,
+                         TaskOccurence.sched_dt, TaskOccurence.occur_id)\
+            .order_by(TaskOccurence.sched_dt, Task.task_name, TaskSched.sched_id, AppUser.first_name)
+        if OCCUR_VIRTUAL:
+            occurs = merge_virtual_occurs(occurs, sched_query)
+        else:
+            occurs = (row._asdict() for row in occurs.yield_per(500))
+        rules = None
+        if with_rrule:
+            rules = {sched.sched_id: sched_rule(sched) for sched in sched_query.add_columns(*sched_rule_columns())}
+        dtstamp = last_modified or datetime.now(timezone.utc)
+        lines = ical_lines(cal_name, occurs, rules, with_names, request.host, dtstamp.strftime('%Y%m%dT%H%M%SZ'))
+        response = Response(stream_with_context(lines), mimetype='text/calendar')
+        response.headers['Content-Disposition'] = 'inline; filename="todo.ics"'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Generates the lines of the feed, one VEVENT at a time. The rows of the same occurence (one per assignee) are merged.
+def ical_lines(cal_name, occurs, rules, with_names, host, dtstamp):
+    yield ical_fold('BEGIN:VCALENDAR')
+    yield ical_fold('VERSION:2.0')
+    yield ical_fold('PRODID:-//todo//ical//FR')
+    yield ical_fold('CALSCALE:GREGORIAN')
+    yield ical_fold('X-WR-CALNAME:' + ical_text(cal_name))
+    done_scheds = set()
+    for (sched_id, sched_dt), rows in groupby(occurs, key=lambda occ: (occ['sched_id'], occ['sched_dt'])):
+        rows = list(rows)
+        summary = rows[0]['task_name']
+        if with_names:
+            summary += ' (' + ', '.join(row['first_name'] for row in rows) + ')'
+        rule = rules.get(sched_id) if rules is not None else None
+        if rule is not None and rule.sched_type != 'O':
+            if sched_id in done_scheds:
+                continue
+            done_scheds.add(sched_id)
+            uid = 'todo-{}@{}'.format(sched_id, host)
+        else:
+            rule = None
+            uid = 'todo-{}-{:%Y%m%d}@{}'.format(sched_id, sched_dt, host)
+        event = ['BEGIN:VEVENT',
+                 'UID:' + uid,
+                 'DTSTAMP:' + dtstamp,
+                 'DTSTART;VALUE=DATE:{:%Y%m%d}'.format(sched_dt),
+                 'SUMMARY:' + ical_text(summary),
+                 'TRANSP:TRANSPARENT']
+        if rule is not None:
+            event.append('RRULE:' + ical_rrule(rule))
+        event.append('END:VEVENT')
+        yield ''.join(ical_fold(line) for line in event)
+    yield ical_fold('END:VCALENDAR')
+
+
+# RRULE of a compiled schedule rule (other than 'O'). The day of month is clamped to the last day of shorter months
+# like the schedules do: BYMONTHDAY=28,29,30;BYSETPOS=-1 is the 30th, or the last day of a shorter month.
+def ical_rrule(rule):
+    if rule.day_stride is not None and rule.sched_type in ('d', 'D'):
+        parts = ['FREQ=DAILY', 'INTERVAL={}'.format(rule.day_stride)]
+    elif rule.day_stride is not None:
+        parts = ['FREQ=WEEKLY', 'INTERVAL={}'.format(rule.day_stride // 7),
+                 'BYDAY=' + ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU'][rule.dow]]
+    else:
+        parts = ['FREQ=MONTHLY', 'INTERVAL={}'.format(rule.month_stride)]
+        if rule.dom > 28:
+            parts.append('BYMONTHDAY=' + ','.join(str(d) for d in range(28, rule.dom + 1)))
+            parts.append('BYSETPOS=-1')
+        else:
+            parts.append('BYMONTHDAY={}'.format(rule.dom))
+    if rule.end_dt is not None:
+        parts.append('UNTIL={:%Y%m%d}'.format(rule.end_dt))
+    return ';'.join(parts)
+
+
+def ical_text(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+# A line of the feed, ended by CRLF. Lines of more than 75 octets are continued on lines starting with a space,
+# without cutting a UTF-8 character.
+def ical_fold(line):
+    data = line.encode('utf-8')
+    parts = []
+    start = 0
+    limit = 75
+    while len(data) - start > limit:
+        end = start + limit
+        while (data[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode('utf-8'))
+        start = end
+        limit = 74
+    parts.append(data[start:].decode('utf-8'))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+# Fields of the API, by name
+api_occur_fields = {'occur_id': OpenWork.occur_id, 'user_id': OpenWork.user_id, 'first_name': OpenWork.first_name,
+                    'task_id': OpenWork.task_id, 'task_name': OpenWork.task_name, 'sched_id': OpenWork.sched_id,
+                    'sched_type': OpenWork.sched_type, 'sched_int': OpenWork.sched_int,
+                    'sched_dow': OpenWork.sched_dow, 'sched_dom': OpenWork.sched_dom, 'sched_dt': OpenWork.sched_dt}
+api_task_fields = {'task_id': Task.task_id, 'list_id': Task.list_id, 'task_name': Task.task_name,
+                   'task_desc': Task.task_desc}
+api_sched_fields = {'sched_id': TaskSched.sched_id, 'task_id': TaskSched.task_id, 'sched_type': TaskSched.sched_type,
+                    'sched_start_dt': TaskSched.sched_start_dt, 'sched_end_dt': TaskSched.sched_end_dt,
+                    'sched_dow': TaskSched.sched_dow, 'sched_dom': TaskSched.sched_dom,
+                    'sched_int': TaskSched.sched_int}
+
+
+# Key of the pages of occurences (date, schedule, assignee)
+def api_occur_key(occ):
+    return occ['sched_dt'], occ['sched_id'], occ['user_id']
+
+
+# ?fields= and ?limit= checked against the fields of the endpoint, ValueError when they are not valid
+def api_page_args(available_fields):
+    fields = request.args.get('fields', None)
+    fields = fields.split(',') if fields else list(available_fields)
+    if any(field not in available_fields for field in fields):
+        raise ValueError('fields')
+    limit = request.args.get('limit', API_PAGE_SIZE, type=int)
+    if not 1 <= limit <= API_PAGE_SIZE * 10:
+        raise ValueError('limit')
+    return fields, limit
+
+
+# Page of an endpoint of the API. page() returns up to limit + 1 rows (dicts) and the function giving the ?after= of a
+# row; it is only called when the ETag from the versions of entities does not match If-None-Match.
+def api_response(entities, fields, limit, page):
+    versions = db_data_versions(*entities)
+    if versions is None:
+        return api_error(500, 'Une erreur de base de données est survenue.')
+    if OCCUR_VIRTUAL and 'occur' in entities:
+        versions = versions + (date.today(),)   # The computed occurences move with the date
+    etag = hashlib.sha1(repr((request.path, versions, sorted(request.args.items(multi=True))))
+                        .encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        rows, row_key = page()
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            args = request.args.to_dict()
+            args['after'] = row_key(rows[-1])
+            next_url = url_for(request.endpoint, _external=True, **args)
+        data = [{field: api_value(row[field]) for field in fields} for row in rows]
+        response = jsonify(data=data, next=next_url)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def api_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def api_error(status, message):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+# True when the client asked for JSON (Accept: application/json) rather than a page
+def wants_json():
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+# Redirect to the list of tasks of redir_to: 1 for me, 2 for everybody, 3 for the tag tag_id (the one of the session
+# when None)
+def redirect_to_list(redir_to, tag_id=None):
+    if redir_to == 1:
+        return redirect(url_for('list_tasks_for_me'))
+    elif redir_to == 2:
+        return redirect(url_for('list_tasks_for_all'))
+    elif redir_to == 3:
+        if tag_id is None:
+            tag_id = session['tag_id']
+        return redirect(url_for('list_tasks_by_tag', tag_id=tag_id))
+    else:
+        flash("Je ne sais pas ou retourner.")
+        abort(500)
+
+
+def task_health_query(has_assignee=None, has_sched=None, has_open_occur=None):
+    assignee_expr = db.session.query(Assignment.asgn_id).filter(Assignment.task_id == Task.task_id).exists()
+    sched_expr = db.session.query(TaskSched.sched_id).filter(TaskSched.task_id == Task.task_id).exists()
+    open_expr = db.session.query(TaskOccurence.occur_id)\
+        .filter(TaskOccurence.task_id == Task.task_id, TaskOccurence.status == 'T').exists()
+    if OCCUR_VIRTUAL:
+        open_expr = or_(open_expr, db.session.query(TaskSched.sched_id).filter(
+            TaskSched.task_id == Task.task_id,
+            or_(TaskSched.sched_last_occ_dt.is_(None),
+                and_(TaskSched.sched_type != 'O',
+                     or_(TaskSched.sched_end_dt.is_(None), TaskSched.sched_end_dt > TaskSched.sched_last_occ_dt))))
+            .exists())
+    tasks = db.session.query(TaskList.list_name, Task.task_id, Task.task_name,
+                             assignee_expr.label('has_assignee'), sched_expr.label('has_sched'),
+                             open_expr.label('has_open_occur'))\
+        .select_from(Task)\
+        .join(TaskList, Task.list_id == TaskList.list_id)
+    for expr, wanted in ((assignee_expr, has_assignee), (sched_expr, has_sched), (open_expr, has_open_occur)):
+        if wanted is not None:
+            tasks = tasks.filter(expr if wanted else ~expr)
+    return tasks.order_by(TaskList.list_name, Task.task_name)
+
+
+# Rows of the export of the occurences (see occur_export.COLUMNS), in the order of occur_id. They are fetched by chunks
+# of EXPORT_CHUNK with yield_per (a server-side cursor on PostgreSQL). The tags of all the tasks are read first, in one
+# query, and added to the rows from a dict.
+def export_occurs_rows(filters):
+    tags = {}
+    for task_id, tag_name in db.session.query(TaskTag.task_id, Tag.tag_name)\
+            .join(Tag, TaskTag.tag_id == Tag.tag_id).order_by(TaskTag.task_id, Tag.tag_name):
+        tags[task_id] = tags[task_id] + ';' + tag_name if task_id in tags else tag_name
+    occurs = db.session.query(TaskOccurence.occur_id, TaskOccurence.sched_dt, TaskOccurence.status,
+                              Task.task_id, Task.task_name, TaskList.list_name, TaskSched.sched_id,
+                              TaskSched.sched_type, TaskSched.sched_int, TaskSched.sched_dow, TaskSched.sched_dom,
+                              TaskOccurence.audit_upd_user.label('upd_user_id'),
+                              (AppUser.first_name + ' ' + AppUser.last_name).label('upd_user_name'),
+                              TaskOccurence.audit_upd_ts)\
+        .select_from(TaskOccurence)\
+        .join(Task, TaskOccurence.task_id == Task.task_id)\
+        .outerjoin(TaskList, Task.list_id == TaskList.list_id)\
+        .outerjoin(TaskSched, TaskOccurence.sched_id == TaskSched.sched_id)\
+        .outerjoin(AppUser, TaskOccurence.audit_upd_user == AppUser.user_id)
+    occurs = filter_occurs(occurs, filters).order_by(TaskOccurence.occur_id)
+    for row in occurs.yield_per(EXPORT_CHUNK):
+        occ = row._asdict()
+        occ['tags'] = tags.get(occ['task_id'], '')
+        yield occ
+
+
+# Open work of a user (user_id), of a tag (tag_id) or of everybody, in the order of the lists of tasks
+def open_work_query(user_id=None, tag_id=None):
+    tasks = db.session.query(*open_work_columns())
+    if user_id is not None:
+        tasks = tasks.filter(OpenWork.user_id == user_id)
+    if tag_id is not None:
+        tasks = tasks.join(TaskTag, OpenWork.task_id == TaskTag.task_id).filter(TaskTag.tag_id == tag_id)
+    return tasks.order_by(OpenWork.sched_dt, OpenWork.task_name, OpenWork.sched_id, OpenWork.first_name)
+
+
+# Rows of topen_work computed from the tables
+def open_work_source():
+    return db.session.query(TaskOccurence.occur_id, Assignment.user_id, AppUser.first_name,
+                            Task.task_id, Task.task_name, TaskSched.sched_id, TaskSched.sched_type,
+                            TaskSched.sched_int, TaskSched.sched_dow, TaskSched.sched_dom,
+                            TaskOccurence.sched_dt)\
+        .select_from(TaskOccurence)\
+        .join(TaskSched, TaskOccurence.sched_id == TaskSched.sched_id)\
+        .join(Task, TaskSched.task_id == Task.task_id)\
+        .join(Assignment, Task.task_id == Assignment.task_id)\
+        .join(AppUser, Assignment.user_id == AppUser.user_id)\
+        .filter(TaskOccurence.status == 'T')
+
+
+def open_work_columns():
+    return [OpenWork.first_name, OpenWork.task_id, OpenWork.task_name, OpenWork.sched_id, OpenWork.sched_type,
+            OpenWork.sched_int, OpenWork.sched_dow, OpenWork.sched_dom, OpenWork.sched_dt, OpenWork.occur_id]
+
+
+# Rebuilds the rows of topen_work of the schedules of sched_ids and/or of the tasks of task_ids (all of them when
+# both are None) from the tables, in the current transaction: one DELETE and one INSERT ... SELECT. The db_* functions
+# call it before their commit, after the changes of the occurences, assignments, tasks or schedules.
+def sync_open_work(sched_ids=None, task_ids=None):
+    db.session.flush()
+    work_table = OpenWork.__table__
+    open_work = open_work_source()
+    del_work = work_table.delete()
+    if sched_ids is not None:
+        open_work = open_work.filter(TaskSched.sched_id.in_(sched_ids))
+        del_work = del_work.where(work_table.c.sched_id.in_(sched_ids))
+    if task_ids is not None:
+        open_work = open_work.filter(Task.task_id.in_(task_ids))
+        del_work = del_work.where(work_table.c.task_id.in_(task_ids))
+    db.session.execute(del_work)
+    db.session.execute(work_table.insert().from_select(
+        ['occur_id', 'user_id', 'first_name', 'task_id', 'task_name', 'sched_id', 'sched_type', 'sched_int',
+         'sched_dow', 'sched_dom', 'sched_dt'], open_work.statement))
+    bump_versions('occur')
+
+
+# Increments the versions of entities in the current transaction. The UPDATE locks the row of each entity until the
+# commit, so the writers of the same kind of data are serialized: fine for the size of a household.
+def bump_versions(*entities):
+    version_table = DataVersion.__table__
+    for entity in entities:
+        result = db.session.execute(version_table.update().where(version_table.c.entity == entity)
+                                    .values(version=version_table.c.version + 1))
+        if result.rowcount == 0:
+            db.session.execute(version_table.insert().values(entity=entity, version=1))
+
+
+# Versions of entities, in one query. An entity never changed is at version 0.
+def db_data_versions(*entities):
+    try:
+        versions = dict(db.session.query(DataVersion.entity, DataVersion.version)
+                        .filter(DataVersion.entity.in_(entities)))
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+    return tuple(versions.get(entity, 0) for entity in entities)
+
+
+# Page rendered by page() (a view without its login check), from page_cache when the versions of entities, the route,
+# its arguments and the user are the same. Not cached: the pages with a flashed message, the errors and the pages
+# rendered while messages are waiting to be shown. The pages of the occurences also depend on the schedules, the tasks
+# and the date with OCCUR_VIRTUAL. The CSRF token of the session is stored as CSRF_MARK and put back on each hit.
+def cached_page(entities, page):
+    if page_cache is None or session.get('_flashes'):
+        return page()
+    if OCCUR_VIRTUAL and 'occur' in entities:
+        entities = entities + ('sched', 'task')
+    versions = db_data_versions(*entities)
+    if versions is None:
+        return page()
+    key = hashlib.sha1(repr((request.endpoint, sorted(request.view_args.items()),
+                             sorted(request.args.items(multi=True)), session.get('user_id'),
+                             entities, versions, date.today() if OCCUR_VIRTUAL else None))
+                       .encode('utf-8')).hexdigest()
+    csrf_token = generate_csrf().encode('utf-8')
+    body = page_cache.get(key)
+    if body is not None:
+        response = Response(body.replace(CSRF_MARK, csrf_token), mimetype='text/html')
+        response.headers['X-Page-Cache'] = 'hit'
+        return response
+    response = app.make_response(page())
+    if response.status_code == 200 and not response.is_streamed and not get_flashed_messages():
+        page_cache.set(key, response.get_data().replace(csrf_token, CSRF_MARK))
+    response.headers['X-Page-Cache'] = 'miss'
+    return response
+
+
 def logged_in():
     user_email = session.get('user_email', None)
     if user_email:
@@ -1880,6 +2846,7 @@ def db_add_user(first_name, last_name, user_email, user_pass):
         else:
             user.user_role = 'Régulier'
         db.session.add(user)
+        bump_versions('user')
         db.session.commit()
         return True
     except Exception as e:
@@ -2004,6 +2971,7 @@ def db_del_user(user_id):
         for secret in user.secrets:
             db.session.delete(secret)
         db.session.delete(user)
+        bump_versions('user')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2040,6 +3008,7 @@ def db_add_tasklist(list_name, list_desc):
     tasklist = TaskList(list_name, list_desc, audit_crt_user, audit_crt_ts)
     try:
         db.session.add(tasklist)
+        bump_versions('tasklist')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2056,6 +3025,7 @@ def db_upd_tasklist(list_id, list_name, list_desc):
         tasklist.list_desc = list_desc
         tasklist.audit_upd_user = audit_upd_user
         tasklist.audit_upd_ts = audit_upd_ts
+        bump_versions('tasklist')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2067,6 +3037,7 @@ def db_del_tasklist(list_id):
     try:
         tasklist = TaskList.query.get(list_id)
         db.session.delete(tasklist)
+        bump_versions('tasklist')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2109,12 +3080,26 @@ def db_task_by_id(task_id):
         return None
 
 
+# The task with its assignees (and their user), its tags (and their name) and its schedules, in four queries whatever
+# their number: one for the task and one per collection.
+def db_task_for_editor(task_id):
+    try:
+        return Task.query.options(selectinload(Task.assignees).joinedload(Assignment.tapp_user),
+                                  selectinload(Task.tags).joinedload(TaskTag.ttag),
+                                  selectinload(Task.schedules))\
+            .filter(Task.task_id == task_id).first()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+
+
 def db_add_task(list_id, task_name, task_desc):
     audit_crt_user = session.get('user_id', None)
     audit_crt_ts = datetime.now()
     task = Task(list_id, task_name, task_desc, audit_crt_user, audit_crt_ts)
     try:
         db.session.add(task)
+        bump_versions('task')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2131,6 +3116,8 @@ def db_upd_task(task_id, task_name, task_desc):
         task.task_desc = task_desc
         task.audit_upd_user = audit_upd_user
         task.audit_upd_ts = audit_upd_ts
+        sync_open_work(task_ids=[task_id])
+        bump_versions('task')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2154,6 +3141,8 @@ def db_del_task(task_id):
                 db.session.delete(o)
             db.session.delete(s)
         db.session.delete(task)
+        sync_open_work(task_ids=[task_id])
+        bump_versions('task', 'sched')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2161,6 +3150,18 @@ def db_del_task(task_id):
     return True
 
 
+# Health of the tasks in one statement: has_assignee, has_sched and has_open_occur are EXISTS subqueries correlated
+# to the task, instead of one query per task. Each argument set to True or False keeps only the tasks with (or
+# without) it. With OCCUR_VIRTUAL the pending occurences aren't stored, so a schedule that isn't over counts as an
+# open occurence: one never acted on, or one after its last occurence acted on that is before its end date.
+def db_task_health(has_assignee=None, has_sched=None, has_open_occur=None):
+    try:
+        return task_health_query(has_assignee, has_sched, has_open_occur).all()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+
+
 # DB functions for Task: exists, by_id, add, upd, del, others
 def db_sched_by_id(sched_id):
     try:
@@ -2179,6 +3180,7 @@ def db_add_sched(task_id, sched_type, sched_start_dt, sched_end_dt, sched_last_o
                       sched_dow, sched_dom, sched_int, audit_crt_user, audit_crt_ts)
     try:
         db.session.add(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2194,8 +3196,11 @@ def db_upd_sched_one(sched_id, sched_start_dt):
         sched.sched_start_dt = sched_start_dt
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2210,8 +3215,11 @@ def db_upd_sched_dly(sched_id, sched_start_dt, sched_end_dt):
         sched.sched_end_dt = sched_end_dt
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2227,8 +3235,11 @@ def db_upd_sched_wly(sched_id, sched_start_dt, sched_end_dt, sched_dow):
         sched.sched_dow = sched_dow
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2244,8 +3255,11 @@ def db_upd_sched_mly(sched_id, sched_start_dt, sched_end_dt, sched_dom):
         sched.sched_dom = sched_dom
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2261,8 +3275,11 @@ def db_upd_sched_xdy(sched_id, sched_start_dt, sched_end_dt, sched_int):
         sched.sched_int = sched_int
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2279,8 +3296,11 @@ def db_upd_sched_xwk(sched_id, sched_start_dt, sched_end_dt, sched_dow, sched_in
         sched.sched_int = sched_int
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2297,8 +3317,11 @@ def db_upd_sched_xmo(sched_id, sched_start_dt, sched_end_dt, sched_dom, sched_in
         sched.sched_int = sched_int
         sched.audit_upd_user = audit_upd_user
         sched.audit_upd_ts = audit_upd_ts
+        remat_occurs(sched)
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2310,6 +3333,8 @@ def db_del_sched(sched_id):
         for occ in sched.occurences:
             db.session.delete(occ)
         db.session.delete(sched)
+        sync_open_work(sched_ids=[sched_id])
+        bump_versions('sched')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2337,152 +3362,88 @@ def db_add_occur(sched_id, update_mode='N'):
         else:
             app.logger.debug('sched is NOT found')
 
-        # In update_mode, delete the occurences with a status To_Do
+        # In update_mode, replace the occurences with a status To_Do by the ones of the new rule
         if update_mode == 'Y':
-            for occ in sched.occurences:
-                if occ.status == 'T':
-                    db.session.delete(occ)
-            occ_max = TaskOccurence.query.filter_by(sched_id=sched_id).order_by(desc(TaskOccurence.sched_dt)).first()
-            if occ_max:
-                app.logger.debug('Last occurence date:' + str(occ_max.sched_dt))
-                sched.sched_last_occ_dt = occ_max.sched_dt
-            else:
-                app.logger.debug('Last occurence date is set to null.')
-                sched.sched_last_occ_dt = None
+            return db_remat_occurs(sched)
+
+        # The pending occurences are computed when the lists are displayed
+        if OCCUR_VIRTUAL:
+            return True
 
         if sched.sched_type == 'O':
             sched.sched_last_occ_dt = sched.sched_start_dt
             occur = TaskOccurence(sched.task_id, sched_id, sched.sched_start_dt)
             db.session.add(occur)
+            sync_open_work(sched_ids=[sched_id])
             db.session.commit()
 
-        elif sched.sched_type == 'd':
-            if sched.sched_last_occ_dt is None:
-                sched_dt = sched.sched_start_dt
-            else:
-                sched_dt = sched.sched_last_occ_dt + timedelta(days=1)
-            if (sched.sched_end_dt is None) or (sched_dt <= sched.sched_end_dt):
-                sched.sched_last_occ_dt = sched_dt
-                occur = TaskOccurence(sched.task_id, sched_id, sched_dt)
-                db.session.add(occur)
-            db.session.commit()
-
-        elif sched.sched_type == 'w':
-            app.logger.debug('weekly')
-            if sched.sched_last_occ_dt is None:
-                app.logger.debug('last occ dt is none')
-                sched_dt = sched.sched_start_dt
-                sched_dow = sched.sched_dow
-                dow_start_dt = sched_dt.weekday()
-                if sched_dow > dow_start_dt:
-                    sched_dt = sched_dt + timedelta(days=sched_dow - dow_start_dt)
-                elif sched_dow < dow_start_dt:
-                    delta_days = 7 - (dow_start_dt - sched_dow)
-                    sched_dt = sched_dt + timedelta(days=delta_days)
-            else:
-                if update_mode == 'Y':
-                    app.logger.debug('Update mode')
-                    sched_dt = sched.sched_last_occ_dt
-                    app.logger.debug('sched_dt: ' + str(sched_dt))
-                    sched_dow = sched.sched_dow
-                    app.logger.debug('sched_dow: ' + str(sched_dow))
-                    dow_start_dt = sched_dt.weekday()
-                    if sched_dow > dow_start_dt:
-                        sched_dt = sched_dt + timedelta(days=sched_dow - dow_start_dt)
-                    elif sched_dow < dow_start_dt:
-                        delta_days = 7 - (dow_start_dt - sched_dow)
-                        sched_dt = sched_dt + timedelta(days=delta_days)
-                else:
-                    sched_dt = sched.sched_last_occ_dt + timedelta(days=7)
-            if (sched.sched_end_dt is None) or (sched_dt <= sched.sched_end_dt):
+        elif sched.sched_type in sched_types:
+            # The next date comes from the compiled rule of the schedule
+            sched_dt = sched_rule(sched).next_date(sched.sched_last_occ_dt)
+            if sched_dt:
                 occur = TaskOccurence(sched.task_id, sched_id, sched_dt)
                 sched.sched_last_occ_dt = sched_dt
                 db.session.add(occur)
+                sync_open_work(sched_ids=[sched_id])
             db.session.commit()
+        else:
+            return False
 
-        elif sched.sched_type == 'm':
-            if sched.sched_last_occ_dt is None:
-                sched_dt = sched.sched_start_dt
-            else:
-                temp_dt = sched.sched_last_occ_dt
-                days_in_month = monthrange(temp_dt.year, temp_dt.month)[1]
-                temp_dt = temp_dt + timedelta(days=(days_in_month - temp_dt.day + 1))  # First day of next month
-                days_in_next_month = monthrange(temp_dt.year, temp_dt.month)[1]
-                if sched.sched_dom > days_in_next_month:
-                    sched_dt = temp_dt + timedelta(days=(days_in_next_month - 1))
-                else:
-                    sched_dt = temp_dt + timedelta(days=(sched.sched_dom - 1))
-            if (sched.sched_end_dt is None) or (sched_dt <= sched.sched_end_dt):
-                occur = TaskOccurence(sched.task_id, sched_id, sched_dt)
-                sched.sched_last_occ_dt = sched_dt
-                db.session.add(occur)
-            db.session.commit()
+    except Exception as e:
+        app.logger.error('DB Error: ' + str(e))
+        return False
+    return True
 
-        elif sched.sched_type == 'D':
-            if sched.sched_last_occ_dt is None:
-                sched_dt = sched.sched_start_dt
-            else:
-                sched_dt = sched.sched_last_occ_dt + timedelta(days=sched.sched_int)
-            if (sched.sched_end_dt is None) or (sched_dt <= sched.sched_end_dt):
-                occur = TaskOccurence(sched.task_id, sched_id, sched_dt)
-                sched.sched_last_occ_dt = sched_dt
-                db.session.add(occur)
-            db.session.commit()
 
-        elif sched.sched_type == 'W':
-            if sched.sched_last_occ_dt is None:
-                sched_dt = sched.sched_start_dt
-                sched_dow = sched.sched_dow
-                dow_start_dt = sched_dt.weekday()
-                if sched_dow > dow_start_dt:
-                    sched_dt = sched_dt + timedelta(days=sched_dow - dow_start_dt)
-                elif sched_dow < dow_start_dt:
-                    delta_days = 7 - (dow_start_dt - sched_dow)
-                    sched_dt = sched_dt + timedelta(days=delta_days)
-            else:
-                if update_mode == 'Y':
-                    app.logger.debug('Update mode')
-                    sched_dt = sched.sched_last_occ_dt
-                    app.logger.debug('sched_dt: ' + str(sched_dt))
-                    sched_dow = sched.sched_dow
-                    app.logger.debug('sched_dow: ' + str(sched_dow))
-                    dow_start_dt = sched_dt.weekday()
-                    if sched_dow > dow_start_dt:
-                        sched_dt = sched_dt + timedelta(days=sched_dow - dow_start_dt)
-                    elif sched_dow < dow_start_dt:
-                        delta_days = 7 - (dow_start_dt - sched_dow)
-                        sched_dt = sched_dt + timedelta(days=delta_days)
-                else:
-                    sched_dt = sched.sched_last_occ_dt + timedelta(days=(7 * sched.sched_int))
-            if (sched.sched_end_dt is None) or (sched_dt <= sched.sched_end_dt):
-                occur = TaskOccurence(sched.task_id, sched_id, sched_dt)
-                sched.sched_last_occ_dt = sched_dt
-                db.session.add(occur)
-            db.session.commit()
+# Applies a change of rule to the occurences with a status To_Do, in the current transaction: the db_upd_sched_*
+# functions call it before their commit. The expected dates are computed from the last occurence acted on, with the
+# same coverage as before: a single pending occurence stays a single one, a filled horizon stays filled up to the same
+# date. Only the difference is written: one DELETE of the dates that disappear and one INSERT of the new ones, the
+# rows that stay keep their occur_id. The rows of topen_work of the schedule are rebuilt.
+def remat_occurs(sched):
+    sched_id = sched.sched_id
+    last_dt = db.session.query(func.max(TaskOccurence.sched_dt))\
+        .filter(TaskOccurence.sched_id == sched_id, TaskOccurence.status != 'T').scalar()
+    todo_dts = set(row.sched_dt for row in db.session.query(TaskOccurence.sched_dt)
+                   .filter(TaskOccurence.sched_id == sched_id, TaskOccurence.status == 'T'))
+    app.logger.debug('Last occurence date: ' + str(last_dt))
+
+    new_dts = []
+    if not OCCUR_VIRTUAL:
+        rule, after_dt = sched_rule(sched).resume(last_dt)
+        if len(todo_dts) > 1:
+            new_dts = rule.dates(rule.start_dt, max(todo_dts), after_dt)
+        if not new_dts:
+            next_dt = rule.next_date(after_dt)
+            if next_dt:
+                new_dts = [next_dt]
+
+    occur_table = TaskOccurence.__table__
+    del_occurs = occur_table.delete()\
+        .where(occur_table.c.sched_id == sched_id)\
+        .where(occur_table.c.status == 'T')
+    if new_dts:
+        del_occurs = del_occurs.where(occur_table.c.sched_dt.notin_(new_dts))
+    if todo_dts.difference(new_dts):
+        db.session.execute(del_occurs)
+    add_dts = sorted(set(new_dts).difference(todo_dts))
+    if add_dts:
+        db.session.execute(occur_table.insert().values([
+            {'task_id': sched.task_id, 'sched_id': sched_id, 'sched_dt': d, 'status': 'T'} for d in add_dts]))
+    if new_dts:
+        sched.sched_last_occ_dt = new_dts[-1]
+    else:
+        sched.sched_last_occ_dt = last_dt
+    sync_open_work(sched_ids=[sched_id])
 
-        elif sched.sched_type == 'M':
-            if sched.sched_last_occ_dt is None:
-                sched_dt = sched.sched_start_dt
-            else:
-                temp_dt = sched.sched_last_occ_dt
-                temp_dt = temp_dt - timedelta(days=(sched.sched_last_occ_dt.day - 1))  # Go to first of month
-                for _ in range(sched.sched_int):  # Repeat for the number of times in the interval
-                    days_in_month = monthrange(temp_dt.year, temp_dt.month)[1]
-                    temp_dt = temp_dt + timedelta(days=days_in_month)  # Go to the First day of next month
-                days_in_month = monthrange(temp_dt.year, temp_dt.month)[1]
-                if sched.sched_dom > days_in_month:
-                    sched_dt = temp_dt + timedelta(days=(days_in_month - 1))
-                else:
-                    sched_dt = temp_dt + timedelta(days=(sched.sched_dom - 1))
-            if (sched.sched_end_dt is None) or (sched_dt <= sched.sched_end_dt):
-                occur = TaskOccurence(sched.task_id, sched_id, sched_dt)
-                sched.sched_last_occ_dt = sched_dt
-                db.session.add(occur)
-            db.session.commit()
-        else:
-            return False
 
+# remat_occurs() in a transaction of its own
+def db_remat_occurs(sched):
+    try:
+        remat_occurs(sched)
+        db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('DB Error: ' + str(e))
         return False
     return True
@@ -2499,6 +3460,7 @@ def db_set_occ_status(occur_id, status):
             occ.status = status
             occ.audit_upd_user = audit_upd_user
             occ.audit_upd_ts = audit_upd_ts
+            sync_open_work(sched_ids=[occ.sched_id])
             db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2506,6 +3468,490 @@ def db_set_occ_status(occur_id, status):
     return True
 
 
+# Status change of many occurences in one transaction: the stored ones (occur_ids) with one UPDATE, the computed ones
+# (OCCUR_VIRTUAL, computed is a set of (sched_id, sched_dt)) are stored like db_add_occur_status() does, then the next
+# occurence of the schedules left without an open one is added with one INSERT, like set_occur_status does one by one.
+# Returns {'changed': occurences changed, 'added': next occurences added, 'sched_ids': schedules of the occurences
+# changed, sorted}, None on error.
+def db_set_occ_statuses(occur_ids, computed, status):
+    audit_upd_user = session.get('user_id', None)
+    audit_upd_ts = datetime.now()
+    occur_table = TaskOccurence.__table__
+    sched_table = TaskSched.__table__
+    try:
+        occurs = []
+        if occur_ids:
+            occurs = db.session.query(TaskOccurence.occur_id, TaskOccurence.sched_id)\
+                .filter(TaskOccurence.occur_id.in_(occur_ids)).all()
+        sched_ids = set(occ.sched_id for occ in occurs).union(sched_id for sched_id, sched_dt in computed)
+        if not sched_ids:
+            return {'changed': 0, 'added': 0, 'sched_ids': []}
+        scheds = {sched.sched_id: sched for sched in TaskSched.query.filter(TaskSched.sched_id.in_(sched_ids))}
+        if occurs:
+            db.session.execute(occur_table.update()
+                               .where(occur_table.c.occur_id.in_([occ.occur_id for occ in occurs]))
+                               .values(status=status, audit_upd_user=audit_upd_user, audit_upd_ts=audit_upd_ts))
+
+        upd_occurs = []
+        add_occurs = []
+        pending_occurs = []
+        last_occs = {}
+        if computed:
+            stored = set((row.sched_id, row.sched_dt) for row in
+                         db.session.query(TaskOccurence.sched_id, TaskOccurence.sched_dt)
+                         .filter(TaskOccurence.sched_id.in_([sched_id for sched_id, sched_dt in computed]),
+                                 TaskOccurence.sched_dt.in_([sched_dt for sched_id, sched_dt in computed])))
+            for sched_id, sched_dt in computed:
+                sched = scheds.get(sched_id)
+                if sched is None:
+                    continue
+                if (sched_id, sched_dt) in stored:
+                    upd_occurs.append({'b_sched_id': sched_id, 'b_sched_dt': sched_dt})
+                elif sched_dt in sched_rule(sched).dates(sched_dt, sched_dt, sched.sched_last_occ_dt):
+                    add_occurs.append({'task_id': sched.task_id, 'sched_id': sched_id, 'sched_dt': sched_dt,
+                                       'status': status, 'audit_upd_user': audit_upd_user,
+                                       'audit_upd_ts': audit_upd_ts})
+                else:
+                    continue
+                last_dt = last_occs.get(sched_id, sched.sched_last_occ_dt)
+                if last_dt is None or last_dt < sched_dt:
+                    last_occs[sched_id] = sched_dt
+            # The earlier pending dates stay To_Do, like in db_add_occur_status()
+            pending_occurs = [{'task_id': scheds[sched_id].task_id, 'sched_id': sched_id, 'sched_dt': sched_dt,
+                               'status': 'T', 'audit_upd_user': None, 'audit_upd_ts': None}
+                              for sched_id, sched_dt in unstored_pending_dates(
+                                  [(scheds[sched_id], last_dt) for sched_id, last_dt in last_occs.items()],
+                                  exclude=computed)]
+        if upd_occurs:
+            db.session.execute(occur_table.update()
+                               .where(occur_table.c.sched_id == bindparam('b_sched_id'))
+                               .where(occur_table.c.sched_dt == bindparam('b_sched_dt'))
+                               .values(status=status, audit_upd_user=audit_upd_user, audit_upd_ts=audit_upd_ts),
+                               upd_occurs)
+        nb_changed = len(occurs) + len(upd_occurs) + len(add_occurs)
+        add_occurs.extend(pending_occurs)
+
+        nb_added = 0
+        if not OCCUR_VIRTUAL:
+            # The next occurence may already be there when the horizon has been filled
+            open_ids = set(row.sched_id for row in db.session.query(TaskOccurence.sched_id).distinct()
+                           .filter(TaskOccurence.sched_id.in_(sched_ids), TaskOccurence.status == 'T'))
+            for sched in scheds.values():
+                if sched.sched_type == 'O' or sched.sched_id in open_ids:
+                    continue
+                next_dt = sched_rule(sched).next_date(last_occs.get(sched.sched_id, sched.sched_last_occ_dt))
+                if next_dt:
+                    add_occurs.append({'task_id': sched.task_id, 'sched_id': sched.sched_id, 'sched_dt': next_dt,
+                                       'status': 'T', 'audit_upd_user': None, 'audit_upd_ts': None})
+                    last_occs[sched.sched_id] = next_dt
+                    nb_added += 1
+        if add_occurs:
+            db.session.execute(occur_table.insert().values(add_occurs))
+        if last_occs:
+            db.session.execute(sched_table.update()
+                               .where(sched_table.c.sched_id == bindparam('b_sched_id'))
+                               .values(sched_last_occ_dt=bindparam('b_last_occ_dt')),
+                               [{'b_sched_id': sched_id, 'b_last_occ_dt': last_dt}
+                                for sched_id, last_dt in last_occs.items()])
+        sync_open_work(sched_ids=sched_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('DB Error: ' + str(e))
+        return None
+    return {'changed': nb_changed, 'added': nb_added, 'sched_ids': sorted(sched_ids)}
+
+
+# Occurences due on day_dt or overdue of the activated users (all of them, or user_ids), grouped by user:
+# [(user, [occurences])]. Two queries (three with OCCUR_VIRTUAL) whatever the number of users. The occurences are
+# dicts with the keys of open_work_columns() and user_id, in the order of the lists of tasks.
+def db_digests(day_dt, user_ids=None):
+    try:
+        users = db.session.query(AppUser.user_id, AppUser.first_name, AppUser.last_name, AppUser.user_email)\
+            .filter(AppUser.activated_ts.isnot(None))
+        occurs = db.session.query(OpenWork.user_id, *open_work_columns()).filter(OpenWork.sched_dt <= day_dt)
+        if user_ids:
+            users = users.filter(AppUser.user_id.in_(user_ids))
+            occurs = occurs.filter(OpenWork.user_id.in_(user_ids))
+        if OCCUR_VIRTUAL:
+            scheds = assigned_sched_query().filter(AppUser.activated_ts.isnot(None))
+            if user_ids:
+                scheds = scheds.filter(AppUser.user_id.in_(user_ids))
+            occurs = [occ for occ in merge_virtual_occurs(occurs, scheds) if occ['sched_dt'] <= day_dt]
+            occurs.sort(key=lambda occ: occ['user_id'])
+        else:
+            occurs = [row._asdict() for row in occurs.order_by(OpenWork.user_id, OpenWork.sched_dt,
+                                                                OpenWork.task_name, OpenWork.sched_id)]
+        users = {user.user_id: user for user in users}
+        return [(users[user_id], list(user_occurs))
+                for user_id, user_occurs in groupby(occurs, key=lambda occ: occ['user_id']) if user_id in users]
+    except Exception as e:
+        app.logger.error('DB Error: ' + str(e))
+        return None
+
+
+def db_sched_has_open_occur(sched_id):
+    try:
+        occ = TaskOccurence.query.filter_by(sched_id=sched_id, status='T').first()
+        if occ is None:
+            return False
+        else:
+            return True
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return False
+
+
+# Version of the occurences of the tasks of task_ids (a query of task_id), for the ETag of the iCalendar feeds:
+# the last changes (audit_upd_ts, or audit_crt_ts when never updated), the last ids and the counts of the
+# occurences, schedules and tasks. The counts change when rows are deleted or when tasks leave the feed.
+# The assignments (last id and count) and the version of the users cover the assignees shown in the events.
+def db_ical_version(task_ids):
+    try:
+        asgns = db.session.query(func.max(Assignment.asgn_id), func.count(Assignment.asgn_id))\
+            .filter(Assignment.task_id.in_(task_ids)).one()
+        user_version = db_data_versions('user')
+        if user_version is None:
+            return None
+        occurs = db.session.query(func.max(TaskOccurence.audit_upd_ts), func.max(TaskOccurence.occur_id),
+                                  func.count(TaskOccurence.occur_id))\
+            .filter(TaskOccurence.task_id.in_(task_ids)).one()
+        scheds = db.session.query(func.max(func.coalesce(TaskSched.audit_upd_ts, TaskSched.audit_crt_ts)),
+                                  func.max(TaskSched.sched_id), func.count(TaskSched.sched_id))\
+            .filter(TaskSched.task_id.in_(task_ids)).one()
+        tasks = db.session.query(func.max(func.coalesce(Task.audit_upd_ts, Task.audit_crt_ts)),
+                                 func.count(Task.task_id))\
+            .filter(Task.task_id.in_(task_ids)).one()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+    return tuple(occurs) + tuple(scheds) + tuple(tasks) + tuple(asgns) + user_version
+
+
+# Stores the status of an occurence computed from its schedule (OCCUR_VIRTUAL)
+def db_add_occur_status(sched_id, sched_dt, status):
+    audit_upd_user = session.get('user_id', None)
+    audit_upd_ts = datetime.now()
+    try:
+        sched = TaskSched.query.get(sched_id)
+        if sched is None:
+            return False
+        occ = TaskOccurence.query.filter_by(sched_id=sched_id, sched_dt=sched_dt).first()
+        if occ is None:
+            if sched_dt not in sched_rule(sched).dates(sched_dt, sched_dt, sched.sched_last_occ_dt):
+                return False
+            occ = TaskOccurence(sched.task_id, sched_id, sched_dt)
+            db.session.add(occ)
+            for earlier_id, earlier_dt in unstored_pending_dates([(sched, sched_dt)]):
+                db.session.add(TaskOccurence(sched.task_id, earlier_id, earlier_dt))
+        occ.status = status
+        occ.audit_upd_user = audit_upd_user
+        occ.audit_upd_ts = audit_upd_ts
+        if sched.sched_last_occ_dt is None or sched.sched_last_occ_dt < sched_dt:
+            sched.sched_last_occ_dt = sched_dt
+        sync_open_work(sched_ids=[sched_id])
+        db.session.commit()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return False
+    return True
+
+
+# Pending dates computed before until_dt for each (sched, until_dt), after the sched_last_occ_dt of sched, that are not
+# stored, as (sched_id, sched_dt), except the ones of exclude (OCCUR_VIRTUAL). Storing a later date moves
+# sched_last_occ_dt past them: they are stored To_Do first, so they stay in the lists like in the stored mode.
+def unstored_pending_dates(scheds_until, exclude=()):
+    pending = [(sched.sched_id, pending_dt) for sched, until_dt in scheds_until
+               for pending_dt in sched_rule(sched).dates(sched.sched_start_dt, until_dt - timedelta(days=1),
+                                                         sched.sched_last_occ_dt)
+               if (sched.sched_id, pending_dt) not in exclude]
+    if not pending:
+        return []
+    stored = set((row.sched_id, row.sched_dt) for row in
+                 db.session.query(TaskOccurence.sched_id, TaskOccurence.sched_dt)
+                 .filter(TaskOccurence.sched_id.in_(set(sched_id for sched_id, pending_dt in pending)),
+                         TaskOccurence.sched_dt.in_(set(pending_dt for sched_id, pending_dt in pending))))
+    return [occ for occ in pending if occ not in stored]
+
+
+# Catch-up of the occurences due before today for the schedules of sched_ids, in one transaction. The missed
+# occurences are the stored ones with a status To_Do and the ones computed after sched_last_occ_dt. The policy is
+# S: all skipped, C: all cancelled, L: only the latest one stays To_Do and the others are skipped.
+# The stored ones are changed with one UPDATE, the computed ones are added with one INSERT with their status, and the
+# next occurence is added when a schedule has none left. Returns the number of occurences missed.
+def db_catch_up_occurs(sched_ids, policy):
+    if not sched_ids:
+        return 0
+    audit_upd_user = session.get('user_id', None)
+    audit_upd_ts = datetime.now()
+    today = date.today()
+    status = 'C' if policy == 'C' else 'S'
+    occur_table = TaskOccurence.__table__
+    sched_table = TaskSched.__table__
+    try:
+        scheds = TaskSched.query.filter(TaskSched.sched_id.in_(sched_ids)).all()
+        stored = {}
+        for row in db.session.query(TaskOccurence.sched_id, TaskOccurence.sched_dt)\
+                .filter(TaskOccurence.sched_id.in_(sched_ids), TaskOccurence.status == 'T'):
+            stored.setdefault(row.sched_id, []).append(row.sched_dt)
+
+        nb_occurs = 0
+        upd_occurs = []
+        add_occurs = []
+        last_occs = []
+        for sched in scheds:
+            rule = sched_rule(sched)
+            stored_dts = stored.get(sched.sched_id, [])
+            new_dts = set(rule.dates(sched.sched_start_dt, today - timedelta(days=1), sched.sched_last_occ_dt))
+            new_dts.difference_update(stored_dts)
+            missed_dts = new_dts.union(d for d in stored_dts if d < today)
+            if not missed_dts:
+                continue
+            nb_occurs += len(missed_dts)
+            last_dt = max(missed_dts)
+            keep_dt = last_dt if policy == 'L' else None
+            upd_occurs.append({'b_sched_id': sched.sched_id, 'b_until_dt': keep_dt or today})
+            for d in new_dts:
+                if d != keep_dt:
+                    add_occurs.append({'task_id': sched.task_id, 'sched_id': sched.sched_id, 'sched_dt': d,
+                                       'status': status, 'audit_upd_user': audit_upd_user,
+                                       'audit_upd_ts': audit_upd_ts})
+                elif OCCUR_VIRTUAL:
+                    # The latest one stays a computed occurence, right after sched_last_occ_dt
+                    last_dt = max([d for d in new_dts if d != keep_dt], default=sched.sched_last_occ_dt)
+                else:
+                    add_occurs.append({'task_id': sched.task_id, 'sched_id': sched.sched_id, 'sched_dt': d,
+                                       'status': 'T', 'audit_upd_user': None, 'audit_upd_ts': None})
+            if sched.sched_last_occ_dt and (last_dt is None or sched.sched_last_occ_dt > last_dt):
+                last_dt = sched.sched_last_occ_dt
+            if keep_dt is None and not OCCUR_VIRTUAL and not any(d >= today for d in stored_dts):
+                # Nothing left to do for this schedule, the next occurence is added
+                next_dt = rule.next_date(last_dt)
+                if next_dt:
+                    add_occurs.append({'task_id': sched.task_id, 'sched_id': sched.sched_id, 'sched_dt': next_dt,
+                                       'status': 'T', 'audit_upd_user': None, 'audit_upd_ts': None})
+                    last_dt = next_dt
+            last_occs.append({'b_sched_id': sched.sched_id, 'b_last_occ_dt': last_dt})
+
+        if upd_occurs:
+            db.session.execute(occur_table.update()
+                               .where(occur_table.c.sched_id == bindparam('b_sched_id'))
+                               .where(occur_table.c.status == 'T')
+                               .where(occur_table.c.sched_dt < bindparam('b_until_dt'))
+                               .values(status=status, audit_upd_user=audit_upd_user, audit_upd_ts=audit_upd_ts),
+                               upd_occurs)
+        if add_occurs:
+            db.session.execute(occur_table.insert().values(add_occurs))
+        if last_occs:
+            db.session.execute(sched_table.update()
+                               .where(sched_table.c.sched_id == bindparam('b_sched_id'))
+                               .values(sched_last_occ_dt=bindparam('b_last_occ_dt')),
+                               last_occs)
+        sync_open_work(sched_ids=sched_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('DB Error: ' + str(e))
+        return None
+    return nb_occurs
+
+
+# Materialize the occurences of every schedule up to until_dt, resuming after sched_last_occ_dt.
+# Schedules are read by ranges of sched_id and each batch is written with one multi-row INSERT and one
+# executemany UPDATE of sched_last_occ_dt, then committed. Returns (number of rows, number of schedules).
+def db_fill_occurs(until_dt, batch_size=1000):
+    app.logger.debug('Entering db_fill_occurs up to ' + str(until_dt))
+    occur_table = TaskOccurence.__table__
+    sched_table = TaskSched.__table__
+    upd_last_occ = sched_table.update()\
+        .where(sched_table.c.sched_id == bindparam('b_sched_id'))\
+        .values(sched_last_occ_dt=bindparam('b_last_occ_dt'))
+    nb_rows = 0
+    nb_scheds = 0
+    last_sched_id = 0
+    try:
+        while True:
+            scheds = db.session.query(*sched_rule_columns())\
+                .filter(TaskSched.sched_id > last_sched_id)\
+                .filter(or_(TaskSched.sched_last_occ_dt.is_(None), TaskSched.sched_last_occ_dt < until_dt))\
+                .filter(or_(TaskSched.sched_end_dt.is_(None), TaskSched.sched_last_occ_dt.is_(None),
+                            TaskSched.sched_last_occ_dt < TaskSched.sched_end_dt))\
+                .order_by(TaskSched.sched_id)\
+                .limit(batch_size).all()
+            if not scheds:
+                break
+            rows = []
+            last_occs = []
+            for sched in scheds:
+                dates = sched_rule(sched).dates(sched.sched_start_dt, until_dt, sched.sched_last_occ_dt)
+                if dates:
+                    rows.extend({'task_id': sched.task_id, 'sched_id': sched.sched_id, 'sched_dt': d, 'status': 'T'}
+                                for d in dates)
+                    last_occs.append({'b_sched_id': sched.sched_id, 'b_last_occ_dt': dates[-1]})
+            for i in range(0, len(rows), batch_size):
+                db.session.execute(occur_table.insert().values(rows[i:i + batch_size]))
+            if last_occs:
+                db.session.execute(upd_last_occ, last_occs)
+                sync_open_work(sched_ids=[last_occ['b_sched_id'] for last_occ in last_occs])
+            db.session.commit()
+            nb_rows += len(rows)
+            nb_scheds += len(last_occs)
+            last_sched_id = scheds[-1].sched_id
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('DB Error: ' + str(e))
+        return None
+    return nb_rows, nb_scheds
+
+
+# Rebuilds the whole read model topen_work, after its creation or to repair it. Returns its number of rows.
+def db_rebuild_open_work():
+    try:
+        sync_open_work()
+        db.session.commit()
+        return db.session.query(func.count(OpenWork.work_id)).scalar()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('DB Error: ' + str(e))
+        return None
+
+
+# Reads, checks and loads an import file (see task_import). Returns (rows added per table, errors): nothing is added
+# when there are errors, nor with dry_run (then only the number of tasks is returned). The rows are None after a
+# database error.
+def import_tasks_file(text, file_format, user_id, dry_run=False):
+    tasklists, tasks, errors = task_import.read_tasks(text, file_format)
+    if not errors:
+        errors = db_import_errors(tasks)
+        if errors is None:
+            return None, []
+    if errors or dry_run:
+        return {'tasks': len(tasks)}, errors
+    return db_import_tasks(tasklists, tasks, user_id), []
+
+
+# Errors of the tasks read by task_import.read_tasks() against the database: the tasks must be new and their assignees
+# must be users. Returns None on a database error.
+def db_import_errors(tasks):
+    try:
+        emails = set(email for (email,) in db.session.query(AppUser.user_email))
+        existing = name_ids(Task.task_name, Task.task_id, [task['task_name'] for task in tasks])
+    except Exception as e:
+        app.logger.error('DB Error: ' + str(e))
+        return None
+    errors = []
+    for task in tasks:
+        if task['task_name'] in existing:
+            errors.append('{}: la tâche "{}" existe déjà.'.format(task['where'], task['task_name']))
+        for email in task['assignees']:
+            if email not in emails:
+                errors.append('{}: l\'usager "{}" n\'existe pas.'.format(task['where'], email))
+    return errors
+
+
+# Loads the tasks read by task_import.read_tasks() and checked by db_import_errors(), in one transaction: the lists and
+# tags that don't exist yet, the tasks, their assignments, tags and schedules, then the first occurence of each
+# schedule (like db_add_occur()). The names are resolved to ids with dicts: one query per chunk of new names, no query
+# per row. Returns the number of rows added per table, or None on error (nothing is added).
+def db_import_tasks(tasklists, tasks, user_id):
+    audit_crt_ts = datetime.now()
+    occur_table = TaskOccurence.__table__
+    sched_table = TaskSched.__table__
+    try:
+        list_ids = name_ids(TaskList.list_name, TaskList.list_id, list(tasklists))
+        new_lists = [{'list_name': list_name, 'list_desc': list_desc, 'audit_crt_user': user_id,
+                      'audit_crt_ts': audit_crt_ts}
+                     for list_name, list_desc in tasklists.items() if list_name not in list_ids]
+        bulk_insert(TaskList.__table__, new_lists)
+        list_ids.update(name_ids(TaskList.list_name, TaskList.list_id, [row['list_name'] for row in new_lists]))
+
+        tag_names = list(dict.fromkeys(tag_name for task in tasks for tag_name in task['tags']))
+        tag_ids = name_ids(Tag.tag_name, Tag.tag_id, tag_names)
+        new_tags = [{'tag_name': tag_name, 'audit_crt_user': user_id, 'audit_crt_ts': audit_crt_ts}
+                    for tag_name in tag_names if tag_name not in tag_ids]
+        bulk_insert(Tag.__table__, new_tags)
+        tag_ids.update(name_ids(Tag.tag_name, Tag.tag_id, [row['tag_name'] for row in new_tags]))
+
+        bulk_insert(Task.__table__, [{'list_id': list_ids[task['list_name']], 'task_name': task['task_name'],
+                                      'task_desc': task['task_desc'], 'audit_crt_user': user_id,
+                                      'audit_crt_ts': audit_crt_ts} for task in tasks])
+        task_ids = name_ids(Task.task_name, Task.task_id, [task['task_name'] for task in tasks])
+        user_ids = dict(db.session.query(AppUser.user_email, AppUser.user_id))
+        assignments = [{'task_id': task_ids[task['task_name']], 'user_id': user_ids[email]}
+                       for task in tasks for email in task['assignees']]
+        bulk_insert(Assignment.__table__, assignments)
+        task_tags = [{'task_id': task_ids[task['task_name']], 'tag_id': tag_ids[tag_name]}
+                     for task in tasks for tag_name in task['tags']]
+        bulk_insert(TaskTag.__table__, task_tags)
+
+        scheds = []
+        for task in tasks:
+            for sched in task['schedules']:
+                sched_last_occ_dt = None
+                if not OCCUR_VIRTUAL:
+                    sched_last_occ_dt = next_occurrence_date(sched['sched_type'], sched['sched_start_dt'],
+                                                             sched['sched_end_dt'], sched['sched_dow'],
+                                                             sched['sched_dom'], sched['sched_int'])
+                scheds.append(dict(sched, task_id=task_ids[task['task_name']], sched_last_occ_dt=sched_last_occ_dt,
+                                   audit_crt_user=user_id, audit_crt_ts=audit_crt_ts))
+        bulk_insert(sched_table, scheds)
+
+        # The first occurence of each schedule is its sched_last_occ_dt: copied by the database, without the sched_ids
+        nb_occurs = 0
+        for chunk in chunked(list(task_ids.values())):
+            if not OCCUR_VIRTUAL:
+                nb_occurs += db.session.execute(occur_table.insert().from_select(
+                    ['task_id', 'sched_id', 'sched_dt', 'status'],
+                    select(sched_table.c.task_id, sched_table.c.sched_id, sched_table.c.sched_last_occ_dt,
+                           literal('T'))
+                    .where(sched_table.c.task_id.in_(chunk), sched_table.c.sched_last_occ_dt.isnot(None)))).rowcount
+            sync_open_work(task_ids=chunk)
+        bump_versions('tasklist', 'tag', 'task', 'ttag', 'sched')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('DB Error: ' + str(e))
+        return None
+    return {'tasklists': len(new_lists), 'tags': len(new_tags), 'tasks': len(tasks), 'assignments': len(assignments),
+            'task_tags': len(task_tags), 'schedules': len(scheds), 'occurences': nb_occurs}
+
+
+# Ids of the rows of the names given, {name: id}, read by chunks of names
+def name_ids(name_column, id_column, names):
+    ids = {}
+    for chunk in chunked(names):
+        ids.update(db.session.query(name_column, id_column).filter(name_column.in_(chunk)))
+    return ids
+
+
+def chunked(values, size=500):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+# Inserts rows (dicts with the same keys) into table in the transaction of the session: with COPY on PostgreSQL
+# (psycopg2), else with an executemany INSERT. Every value is quoted in the CSV sent to COPY, so only None, left
+# empty, is read as NULL.
+def bulk_insert(table, rows):
+    if not rows:
+        return
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql' and conn.dialect.driver == 'psycopg2':
+        columns = list(rows[0])
+        data = io.StringIO()
+        for row in rows:
+            data.write(','.join('' if row[column] is None else '"' + str(row[column]).replace('"', '""') + '"'
+                                for column in columns) + '\n')
+        data.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table.name, ', '.join(columns)),
+                               data)
+        finally:
+            cursor.close()
+    else:
+        db.session.execute(table.insert(), rows)
+
+
 # DB functions for Assignment: exists, by_id, add, upd, del, others
 def db_asgn_exists(task_id, user_id):
     app.logger.debug('Entering asgn_exists with: ' + str(task_id) + ',' + str(user_id))
@@ -2520,12 +3966,45 @@ def db_asgn_exists(task_id, user_id):
         return False
 
 
+# Assignments of the task with the name of the user, in one query
+def db_task_assignments(task_id):
+    try:
+        return db.session.query(Assignment.asgn_id, Assignment.user_id,
+                                (AppUser.first_name + ' ' + AppUser.last_name).label('user_name'))\
+            .outerjoin(AppUser, Assignment.user_id == AppUser.user_id)\
+            .filter(Assignment.task_id == task_id)\
+            .order_by(AppUser.first_name, AppUser.last_name).all()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+
+
+# Users not assigned to the task, with one anti-join (NOT EXISTS) instead of one query per user. search keeps the users
+# whose first or last name starts with it, limit is the number of users returned.
+def db_asgn_candidates(task_id, search='', limit=None):
+    try:
+        assigned = db.session.query(Assignment.asgn_id)\
+            .filter(Assignment.task_id == task_id, Assignment.user_id == AppUser.user_id).exists()
+        users = db.session.query(AppUser.user_id, AppUser.first_name, AppUser.last_name).filter(~assigned)
+        if search:
+            users = users.filter(or_(AppUser.first_name.ilike(like_prefix(search), escape='\\'),
+                                     AppUser.last_name.ilike(like_prefix(search), escape='\\')))
+        return users.order_by(AppUser.first_name, AppUser.last_name, AppUser.user_id).limit(limit).all()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+
+
 def db_add_asgn(task_id, user_id):
+    if db_asgn_exists(task_id, user_id):
+        return True
     asgn = Assignment(task_id, user_id)
     try:
         db.session.add(asgn)
+        sync_open_work(task_ids=[task_id])
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         app.logger.error('Error: ' + str(e))
         return False
     return True
@@ -2535,6 +4014,7 @@ def db_del_asgn(asgn_id):
     try:
         asgn = Assignment.query.get(asgn_id)
         db.session.delete(asgn)
+        sync_open_work(task_ids=[asgn.task_id])
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2571,6 +4051,7 @@ def db_add_tag(tag_name):
     tag = Tag(tag_name, audit_crt_user, audit_crt_ts)
     try:
         db.session.add(tag)
+        bump_versions('tag')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2586,6 +4067,7 @@ def db_upd_tag(tag_id, tag_name):
         tag.tag_name = tag_name
         tag.audit_upd_user = audit_upd_user
         tag.audit_upd_ts = audit_upd_ts
+        bump_versions('tag')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2597,6 +4079,7 @@ def db_del_tag(tag_id):
     try:
         tag = Tag.query.get(tag_id)
         db.session.delete(tag)
+        bump_versions('tag', 'ttag')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2618,10 +4101,38 @@ def db_ttag_exists(task_id, tag_id):
         return False
 
 
+# Tags of the task with their name, in one query
+def db_task_tags(task_id):
+    try:
+        return db.session.query(TaskTag.tag_id, Tag.tag_name)\
+            .join(Tag, TaskTag.tag_id == Tag.tag_id)\
+            .filter(TaskTag.task_id == task_id)\
+            .order_by(Tag.tag_name).all()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+
+
+# Tags not on the task, with one anti-join (NOT EXISTS). search keeps the tags whose name starts with it, limit is the
+# number of tags returned.
+def db_ttag_candidates(task_id, search='', limit=None):
+    try:
+        tagged = db.session.query(TaskTag.tag_id)\
+            .filter(TaskTag.task_id == task_id, TaskTag.tag_id == Tag.tag_id).exists()
+        tags = db.session.query(Tag.tag_id, Tag.tag_name).filter(~tagged)
+        if search:
+            tags = tags.filter(Tag.tag_name.ilike(like_prefix(search), escape='\\'))
+        return tags.order_by(Tag.tag_name).limit(limit).all()
+    except Exception as e:
+        app.logger.error('Error: ' + str(e))
+        return None
+
+
 def db_add_ttag(task_id, tag_id):
     t_tag = TaskTag(task_id, tag_id)
     try:
         db.session.add(t_tag)
+        bump_versions('ttag')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2633,6 +4144,7 @@ def db_del_ttag(task_id, tag_id):
     try:
         t_tag = TaskTag.query.filter_by(task_id=task_id, tag_id=tag_id).first()
         db.session.delete(t_tag)
+        bump_versions('ttag')
         db.session.commit()
     except Exception as e:
         app.logger.error('Error: ' + str(e))
@@ -2640,5 +4152,499 @@ def db_del_ttag(task_id, tag_id):
     return True
 
 
+# Schema migrations
+# ----------------------------------------------------------------------------------------------------------------------
+# Each migration is applied once, in order, in its own transaction, and recorded in tschema_version. They only create
+# what is missing, so a database created by db.create_all() before the migrations is upgraded the same way.
+# A migration that was released is never changed: add a new one at the end of schema_migrations.
+# The migrations create, read and write the tables and indexes of migration_schema and migration_indexes, frozen as
+# each migration introduced them, never the models: a model changed later needs its own migration.
+migration_schema = MetaData()
+Table('tapp_user', migration_schema,
+      Column('user_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('first_name', db.String(30), nullable=False),
+      Column('last_name', db.String(30), nullable=False),
+      Column('user_email', db.String(80), nullable=False, unique=True),
+      Column('user_pass', db.String(200), nullable=False),
+      Column('activated_ts', db.DateTime(), nullable=True),
+      Column('audit_crt_ts', db.DateTime(), nullable=False),
+      Column('audit_upd_ts', db.DateTime(), nullable=True),
+      Column('user_role', db.String(10), nullable=False))
+Table('ttask_list', migration_schema,
+      Column('list_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('list_name', db.String(50), nullable=False, unique=True),
+      Column('list_desc', db.Text(), nullable=False),
+      Column('audit_crt_user', db.Integer(), nullable=False),
+      Column('audit_crt_ts', db.DateTime(), nullable=False),
+      Column('audit_upd_user', db.Integer(), nullable=True),
+      Column('audit_upd_ts', db.DateTime(), nullable=True))
+Table('ttask', migration_schema,
+      Column('task_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('list_id', db.Integer(), db.ForeignKey('ttask_list.list_id')),
+      Column('task_name', db.String(50), nullable=False, unique=True),
+      Column('task_desc', db.Text(), nullable=False),
+      Column('audit_crt_user', db.Integer(), nullable=False),
+      Column('audit_crt_ts', db.DateTime(), nullable=False),
+      Column('audit_upd_user', db.Integer(), nullable=True),
+      Column('audit_upd_ts', db.DateTime(), nullable=True))
+Table('ttask_sched', migration_schema,
+      Column('sched_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('task_id', db.Integer(), db.ForeignKey('ttask.task_id')),
+      Column('sched_type', db.String(1), nullable=False),
+      Column('sched_start_dt', db.Date(), nullable=False),
+      Column('sched_end_dt', db.Date(), nullable=True),
+      Column('sched_last_occ_dt', db.Date(), nullable=True),
+      Column('sched_dow', db.SmallInteger(), nullable=True),
+      Column('sched_dom', db.SmallInteger(), nullable=True),
+      Column('sched_int', db.SmallInteger(), nullable=True),
+      Column('audit_crt_user', db.Integer(), nullable=False),
+      Column('audit_crt_ts', db.DateTime(), nullable=False),
+      Column('audit_upd_user', db.Integer(), nullable=True),
+      Column('audit_upd_ts', db.DateTime(), nullable=True))
+Table('ttask_occur', migration_schema,
+      Column('occur_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('task_id', db.Integer(), db.ForeignKey('ttask.task_id')),
+      Column('sched_id', db.Integer(), db.ForeignKey('ttask_sched.sched_id')),
+      Column('sched_dt', db.Date(), nullable=False),
+      Column('status', db.String(1), nullable=False),
+      Column('audit_upd_user', db.Integer(), nullable=True),
+      Column('audit_upd_ts', db.DateTime(), nullable=True))
+Table('tassignment', migration_schema,
+      Column('asgn_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('user_id', db.Integer(), db.ForeignKey('tapp_user.user_id')),
+      Column('task_id', db.Integer(), db.ForeignKey('ttask.task_id')))
+Table('ttag', migration_schema,
+      Column('tag_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('tag_name', db.String(50), nullable=False, unique=True),
+      Column('audit_crt_user', db.Integer(), nullable=False),
+      Column('audit_crt_ts', db.DateTime(), nullable=False),
+      Column('audit_upd_user', db.Integer(), nullable=True),
+      Column('audit_upd_ts', db.DateTime(), nullable=True))
+Table('ttask_tag', migration_schema,
+      Column('task_id', db.Integer(), db.ForeignKey('ttask.task_id'), primary_key=True),
+      Column('tag_id', db.Integer(), db.ForeignKey('ttag.tag_id'), primary_key=True))
+Table('topen_work', migration_schema,
+      Column('work_id', db.Integer(), primary_key=True, autoincrement=True),
+      Column('occur_id', db.Integer(), nullable=False),
+      Column('user_id', db.Integer(), nullable=False),
+      Column('first_name', db.String(30), nullable=False),
+      Column('task_id', db.Integer(), nullable=False),
+      Column('task_name', db.String(50), nullable=False),
+      Column('sched_id', db.Integer(), nullable=False),
+      Column('sched_type', db.String(1), nullable=False),
+      Column('sched_int', db.SmallInteger(), nullable=True),
+      Column('sched_dow', db.SmallInteger(), nullable=True),
+      Column('sched_dom', db.SmallInteger(), nullable=True),
+      Column('sched_dt', db.Date(), nullable=False))
+Table('tschema_version', migration_schema,
+      Column('version', db.Integer(), primary_key=True, autoincrement=False),
+      Column('description', db.String(200), nullable=False),
+      Column('applied_ts', db.DateTime(), nullable=False))
+Table('tdata_version', migration_schema,
+      Column('entity', db.String(20), primary_key=True),
+      Column('version', db.Integer(), nullable=False))
+
+# name: (table, columns, unique). They are kept out of migration_schema so that creating a table does not create them.
+migration_indexes = {'ttask_x1': ('ttask', ('list_id',), False),
+                     'ttask_sched_x1': ('ttask_sched', ('task_id',), False),
+                     'ttask_occur_x1': ('ttask_occur', ('status', 'sched_dt'), False),
+                     'ttask_occur_x2': ('ttask_occur', ('sched_id', 'sched_dt'), False),
+                     'ttask_occur_x3': ('ttask_occur', ('task_id',), False),
+                     'tassignment_x1': ('tassignment', ('task_id',), False),
+                     'tassignment_u1': ('tassignment', ('user_id', 'task_id'), True),
+                     'ttask_tag_x1': ('ttask_tag', ('tag_id',), False),
+                     'topen_work_x1': ('topen_work', ('user_id', 'sched_dt'), False),
+                     'topen_work_x2': ('topen_work', ('sched_dt',), False),
+                     'topen_work_x3': ('topen_work', ('task_id',), False),
+                     'topen_work_x4': ('topen_work', ('sched_id',), False)}
+
+
+def migrate_create_tables():
+    create_tables('tapp_user', 'ttask_list', 'ttask', 'ttask_sched', 'ttask_occur', 'tassignment', 'ttag', 'ttask_tag')
+
+
+def migrate_fill_open_work():
+    create_tables('topen_work')
+    create_indexes('topen_work_x1', 'topen_work_x2', 'topen_work_x3', 'topen_work_x4')
+    migrate_open_work()
+
+
+def migrate_add_indexes():
+    create_indexes('ttask_x1', 'ttask_sched_x1', 'ttask_occur_x1', 'ttask_occur_x2', 'ttask_occur_x3',
+                   'tassignment_x1', 'ttask_tag_x1')
+
+
+def migrate_unique_assignment():
+    # The duplicates are deleted first, the first assignment of each (user_id, task_id) is kept
+    asgn_table = migration_schema.tables['tassignment']
+    keep_ids = select(func.min(asgn_table.c.asgn_id)).group_by(asgn_table.c.user_id, asgn_table.c.task_id)
+    db.session.execute(asgn_table.delete().where(asgn_table.c.asgn_id.notin_(keep_ids)))
+    create_indexes('tassignment_u1')
+    migrate_open_work()
+
+
+def migrate_data_versions():
+    create_tables('tdata_version')
+
+
+# Rebuilds all of topen_work from the tables of migration_schema, like sync_open_work() did when migrations 2 and 4
+# were released, without the data versions: tdata_version comes with migration 5.
+def migrate_open_work():
+    tables = migration_schema.tables
+    occur, sched, task = tables['ttask_occur'], tables['ttask_sched'], tables['ttask']
+    asgn, user, work = tables['tassignment'], tables['tapp_user'], tables['topen_work']
+    open_work = select(occur.c.occur_id, asgn.c.user_id, user.c.first_name, task.c.task_id, task.c.task_name,
+                       sched.c.sched_id, sched.c.sched_type, sched.c.sched_int, sched.c.sched_dow, sched.c.sched_dom,
+                       occur.c.sched_dt)\
+        .select_from(occur.join(sched, occur.c.sched_id == sched.c.sched_id)
+                     .join(task, sched.c.task_id == task.c.task_id)
+                     .join(asgn, task.c.task_id == asgn.c.task_id)
+                     .join(user, asgn.c.user_id == user.c.user_id))\
+        .where(occur.c.status == 'T')
+    db.session.execute(work.delete())
+    db.session.execute(work.insert().from_select(
+        ['occur_id', 'user_id', 'first_name', 'task_id', 'task_name', 'sched_id', 'sched_type', 'sched_int',
+         'sched_dow', 'sched_dom', 'sched_dt'], open_work))
+
+
+schema_migrations = [(1, 'Tables du modèle', migrate_create_tables),
+                     (2, 'Remplissage de topen_work', migrate_fill_open_work),
+                     (3, 'Index des occurences et des clés étrangères', migrate_add_indexes),
+                     (4, 'Assignation unique par usager et tâche', migrate_unique_assignment),
+                     (5, 'Versions des données pour les ETag', migrate_data_versions)]
+
+
+# Creates the tables of migration_schema named in names, unless they exist
+def create_tables(*names):
+    migration_schema.create_all(db.session.connection(), tables=[migration_schema.tables[name] for name in names])
+
+
+# Creates the indexes of migration_indexes named in names, unless they exist. Each index is built on a copy of its
+# table, so that it is not added to the tables of migration_schema.
+def create_indexes(*names):
+    conn = db.session.connection()
+    for name in names:
+        table_name, columns, unique = migration_indexes[name]
+        table = migration_schema.tables[table_name].to_metadata(MetaData())
+        Index(name, *[table.c[column] for column in columns], unique=unique).create(conn, checkfirst=True)
+
+
+def db_schema_version():
+    create_tables('tschema_version')
+    db.session.commit()
+    return db.session.query(func.max(SchemaVersion.version)).scalar() or 0
+
+
+# Applies the migrations after the current version, up to target_version (all when None).
+# Returns the list of (version, description) applied, None when a migration failed.
+def db_upgrade(target_version=None):
+    applied = []
+    try:
+        current_version = db_schema_version()
+        for version, description, migrate in schema_migrations:
+            if version <= current_version or (target_version is not None and version > target_version):
+                continue
+            app.logger.info('Migration {}: {}'.format(version, description))
+            migrate()
+            db.session.add(SchemaVersion(version, description, datetime.now()))
+            db.session.commit()
+            applied.append((version, description))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('DB Error: ' + str(e))
+        return None
+    return applied
+
+
+# Queries run on every page of the lists and by the db_* functions, for check-plans:
+# (name, statement, tables that the query may read entirely).
+def hot_queries():
+    return [
+        ('list_tasks_for_me', open_work_query(user_id=1).statement, ()),
+        ('list_tasks_by_tag', open_work_query(tag_id=1).statement, ()),
+        ('list_occurs', select(TaskOccurence).where(TaskOccurence.sched_id == 1).order_by(TaskOccurence.sched_dt),
+         ()),
+        ('list_all_occurs', select(TaskOccurence.occur_id).where(TaskOccurence.occur_id > 1)
+         .order_by(TaskOccurence.occur_id).limit(OCCURS_PAGE_SIZE), ()),
+        ('db_sched_has_open_occur', select(TaskOccurence.occur_id)
+         .where(TaskOccurence.sched_id == 1, TaskOccurence.status == 'T').limit(1), ()),
+        ('db_catch_up_occurs', select(TaskOccurence.sched_id, TaskOccurence.sched_dt)
+         .where(TaskOccurence.sched_id.in_([1, 2]), TaskOccurence.status == 'T'), ()),
+        ('sync_open_work', open_work_source().filter(TaskSched.sched_id.in_([1])).statement, ()),
+        ('sel_asgn', select(Assignment).where(Assignment.task_id == 1), ()),
+        ('db_asgn_exists', select(Assignment).where(Assignment.task_id == 1, Assignment.user_id == 1), ()),
+        ('task_health', task_health_query().statement, ('ttask', 'ttask_list')),
+    ]
+
+
+# Tables read entirely (sequential scan) by the plan of statement, from EXPLAIN. PostgreSQL and SQLite only.
+def db_seq_scans(statement):
+    conn = db.session.connection()
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    tables = []
+    if conn.dialect.name == 'postgresql':
+        plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + str(compiled), params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get('Plans', []))
+            if node['Node Type'] == 'Seq Scan':
+                tables.append(node['Relation Name'])
+    elif conn.dialect.name == 'sqlite':
+        for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params):
+            words = row[-1].split()   # SCAN topen_work, SCAN TABLE topen_work before SQLite 3.36
+            if words[0] == 'SCAN' and 'USING' not in words:
+                tables.append(words[2] if words[1] == 'TABLE' else words[1])
+    else:
+        raise ValueError('EXPLAIN is not supported for ' + conn.dialect.name)
+    return tables
+
+
+# Number of rows of a table, estimated by the statistics on PostgreSQL
+def db_table_rows(table_name):
+    if db.session.connection().dialect.name == 'postgresql':
+        return db.session.execute(db.text('SELECT reltuples FROM pg_class WHERE relname = :relname'),
+                                  {'relname': table_name}).scalar() or 0
+    return db.session.execute(select(func.count()).select_from(db.metadata.tables[table_name])).scalar()
+
+
+# Email of the digest of a user (see db_digests()), in text and HTML
+def digest_message(user, occurs, day_dt):
+    site_url = app.config.get('SITE_URL')
+    context = {'user': user, 'day_dt': day_dt, 'sched_types': sched_types, 'dow': dow,
+               'overdue': [occ for occ in occurs if occ['sched_dt'] < day_dt],
+               'due': [occ for occ in occurs if occ['sched_dt'] == day_dt],
+               'list_url': site_url.rstrip('/') + '/list_tasks_for_me' if site_url else None}
+    message = EmailMessage()
+    message['Subject'] = 'Tâches à faire le {}'.format(day_dt)
+    message['From'] = app.config.get('MAIL_SENDER', 'todo@localhost')
+    message['To'] = user.user_email
+    message.set_content(render_template('digest.txt', **context))
+    message.add_alternative(render_template('digest.html', **context), subtype='html')
+    return message
+
+
+# Command line functions and background jobs
+# ----------------------------------------------------------------------------------------------------------------------
+@app.cli.command('fill-occurs')
+@click.option('--days', type=int, default=OCCUR_HORIZON_DAYS, show_default=True,
+              help="Nombre de jours d'occurences à créer à partir d'aujourd'hui.")
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='Nombre de cédules traitées par transaction.')
+def fill_occurs_command(days, batch_size):
+    """Crée les occurences de toutes les cédules jusqu'à l'horizon."""
+    if OCCUR_VIRTUAL:
+        raise click.ClickException("Les occurences à faire ne sont pas conservées (OCCUR_VIRTUAL).")
+    until_dt = date.today() + timedelta(days=days)
+    start_time = time.perf_counter()
+    result = db_fill_occurs(until_dt, batch_size)
+    elapsed = time.perf_counter() - start_time
+    if result is None:
+        raise click.ClickException('Une erreur de base de données est survenue.')
+    nb_rows, nb_scheds = result
+    click.echo('{} occurences ajoutées pour {} cédules jusqu\'au {} en {:.2f}s ({:.0f} rangées/s).'
+               .format(nb_rows, nb_scheds, until_dt, elapsed, nb_rows / elapsed if elapsed else 0))
+
+
+@app.cli.command('rebuild-open-work')
+def rebuild_open_work_command():
+    """Reconstruit la table topen_work à partir des occurences à faire."""
+    nb_rows = db_rebuild_open_work()
+    if nb_rows is None:
+        raise click.ClickException('Une erreur de base de données est survenue.')
+    click.echo('{} rangées dans topen_work.'.format(nb_rows))
+
+
+@app.cli.command('db-upgrade')
+@click.option('--version', 'target_version', type=int, default=None,
+              help='Version à atteindre (défaut: la dernière).')
+def db_upgrade_command(target_version):
+    """Applique les migrations du schéma qui ne sont pas encore appliquées."""
+    applied = db_upgrade(target_version)
+    if applied is None:
+        raise click.ClickException('Une erreur de base de données est survenue.')
+    for version, description in applied:
+        click.echo('Migration {}: {}'.format(version, description))
+    click.echo('Version du schéma: {}'.format(db_schema_version()))
+
+
+@app.cli.command('db-version')
+def db_version_command():
+    """Affiche la version du schéma et les migrations à appliquer."""
+    current_version = db_schema_version()
+    click.echo('Version du schéma: {}'.format(current_version))
+    for version, description, migrate in schema_migrations:
+        if version > current_version:
+            click.echo('À appliquer: {} {}'.format(version, description))
+
+
+@app.cli.command('check-plans')
+@click.option('--min-rows', type=int, default=1000, show_default=True,
+              help='Nombre de rangées à partir duquel la lecture complète d\'une table est une erreur.')
+def check_plans_command(min_rows):
+    """Vérifie avec EXPLAIN que les requêtes fréquentes ne lisent pas des grosses tables au complet."""
+    table_rows = {}
+    failures = 0
+    for name, statement, allowed_tables in hot_queries():
+        for table_name in db_seq_scans(statement):
+            if table_name not in table_rows:
+                table_rows[table_name] = db_table_rows(table_name)
+            if table_name in allowed_tables or table_rows[table_name] < min_rows:
+                continue
+            failures += 1
+            click.echo('{}: lecture complète de {} ({} rangées)'.format(name, table_name, table_rows[table_name]))
+    db.session.rollback()
+    if failures:
+        raise click.ClickException('{} lecture(s) complète(s) de grosses tables.'.format(failures))
+    click.echo('{} requêtes vérifiées.'.format(len(hot_queries())))
+
+
+@app.cli.command('import-tasks')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'json']), default=None,
+              help='Format du fichier (défaut: selon son extension).')
+@click.option('--user', 'user_email', default=None,
+              help="Courriel de l'usager qui crée les tâches (défaut: ADMIN_EMAILID).")
+@click.option('--dry-run', is_flag=True, help='Vérifie le fichier sans rien ajouter.')
+def import_tasks_command(path, file_format, user_email, dry_run):
+    """Importe des listes, tâches, étiquettes, assignations et cédules d'un fichier CSV ou JSON."""
+    user_email = user_email or app.config.get('ADMIN_EMAILID')
+    user = AppUser.query.filter_by(user_email=user_email).first() if user_email else None
+    if user is None:
+        raise click.ClickException("L'usager {} n'existe pas (--user).".format(user_email))
+    file_format = file_format or path.rsplit('.', 1)[-1].lower()
+    if file_format not in ('csv', 'json'):
+        raise click.ClickException('Le format du fichier doit être csv ou json (--format).')
+    with open(path, encoding='utf-8-sig') as import_file:
+        text = import_file.read()
+    start_time = time.perf_counter()
+    result, errors = import_tasks_file(text, file_format, user.user_id, dry_run)
+    elapsed = time.perf_counter() - start_time
+    if result is None:
+        raise click.ClickException('Une erreur de base de données est survenue.')
+    for error in errors:
+        click.echo(error)
+    if errors:
+        raise click.ClickException('{} erreur(s), rien n\'a été importé.'.format(len(errors)))
+    if dry_run:
+        click.echo('{} tâches vérifiées en {:.2f}s, aucune erreur.'.format(result['tasks'], elapsed))
+        return
+    click.echo(', '.join('{} {}'.format(count, table) for table, count in result.items()))
+    click.echo('{} tâches importées en {:.2f}s ({:.0f} tâches/s).'
+               .format(result['tasks'], elapsed, result['tasks'] / elapsed if elapsed else 0))
+
+
+@app.cli.command('export-occurs')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'parquet']), default=None,
+              help='Format du fichier (défaut: selon son extension, csv pour -).')
+@click.option('--from', 'from_dt', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Première date cédulée.')
+@click.option('--to', 'to_dt', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Dernière date cédulée.')
+@click.option('--status', type=click.Choice(list(task_status)), default=None, help='Status des occurences.')
+def export_occurs_command(output, file_format, from_dt, to_dt, status):
+    """Exporte l'historique des occurences en CSV ou en Parquet (OUTPUT: fichier, ou - pour la sortie)."""
+    file_format = file_format or ('parquet' if output.endswith('.parquet') else 'csv')
+    if file_format == 'parquet' and not occur_export.parquet_available():
+        raise click.ClickException("L'export en Parquet demande le module pyarrow (pip install pyarrow).")
+    filters = {'status': status, 'from_dt': from_dt.date() if from_dt else None,
+               'to_dt': to_dt.date() if to_dt else None}
+    filters = {key: value for key, value in filters.items() if value is not None}
+    nb_rows = [0]
+
+    def rows():
+        for row in export_occurs_rows(filters):
+            nb_rows[0] += 1
+            yield row
+
+    start_time = time.perf_counter()
+    with click.open_file(output, 'wb') as out:
+        if file_format == 'csv':
+            for chunk in occur_export.csv_chunks(rows(), EXPORT_CHUNK):
+                out.write(chunk.encode('utf-8'))
+        else:
+            for chunk in occur_export.parquet_chunks(rows(), EXPORT_ROW_GROUP):
+                out.write(chunk)
+    elapsed = time.perf_counter() - start_time
+    click.echo('{} occurences exportées en {:.2f}s ({:.0f} rangées/s).'
+               .format(nb_rows[0], elapsed, nb_rows[0] / elapsed if elapsed else 0), err=True)
+
+
+@app.cli.group('digest')
+def digest_cli():
+    """Courriels quotidiens des tâches à faire."""
+
+
+@digest_cli.command('send')
+@click.option('--date', 'day_dt', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Jour des tâches dues (défaut: aujourd'hui).")
+@click.option('--user', 'user_ids', type=int, multiple=True,
+              help='Usager à qui envoyer le sommaire (défaut: tous les usagers activés).')
+@click.option('--connections', type=int, default=app.config.get('MAIL_CONNECTIONS', 4), show_default=True,
+              help='Nombre de connexions SMTP utilisées en même temps.')
+@click.option('--batch-size', type=int, default=100, show_default=True,
+              help='Nombre de courriels envoyés par connexion SMTP.')
+@click.option('--retries', type=int, default=3, show_default=True,
+              help="Nombre d'essais de plus après une erreur temporaire.")
+@click.option('--dry-run', is_flag=True, help='Prépare les courriels sans les envoyer.')
+def digest_send_command(day_dt, user_ids, connections, batch_size, retries, dry_run):
+    """Envoie à chaque usager le sommaire de ses tâches dues et en retard."""
+    day_dt = day_dt.date() if day_dt else date.today()
+    start_time = time.perf_counter()
+    digests = db_digests(day_dt, user_ids)
+    if digests is None:
+        raise click.ClickException('Une erreur de base de données est survenue.')
+    read_time = time.perf_counter()
+    messages = [digest_message(user, occurs, day_dt) for user, occurs in digests]
+    render_time = time.perf_counter()
+    click.echo('{} sommaires ({} occurences) lus en {:.2f}s et préparés en {:.2f}s.'
+               .format(len(messages), sum(len(occurs) for user, occurs in digests),
+                       read_time - start_time, render_time - read_time))
+    if dry_run:
+        return
+    pool = SmtpPool(app.config.get('MAIL_SERVER', 'localhost'), app.config.get('MAIL_PORT', 25),
+                    use_tls=app.config.get('MAIL_USE_TLS', False), username=app.config.get('MAIL_USERNAME'),
+                    password=app.config.get('MAIL_PASSWORD'), size=connections, batch_size=batch_size,
+                    retries=retries)
+    failures = pool.send_all(messages)
+    elapsed = time.perf_counter() - render_time
+    for message, error in failures:
+        click.echo('Échec pour {}: {}'.format(message['To'], error))
+    nb_sent = len(messages) - len(failures)
+    click.echo('{} sommaires envoyés en {:.2f}s ({:.0f} courriels/s).'
+               .format(nb_sent, elapsed, nb_sent / elapsed if elapsed else 0))
+    if failures:
+        raise click.ClickException('{} sommaire(s) non envoyé(s).'.format(len(failures)))
+
+
+# Periodic fill of the occurences inside the application process. Only enable it (OCCUR_FILL_INTERVAL) in one
+# process: the fill is idempotent but two processes running it at the same time could insert the same dates.
+def fill_occurs_job():
+    with app.app_context():
+        until_dt = date.today() + timedelta(days=OCCUR_HORIZON_DAYS)
+        start_time = time.perf_counter()
+        result = db_fill_occurs(until_dt)
+        if result:
+            elapsed = time.perf_counter() - start_time
+            app.logger.info('fill_occurs_job: {} rows for {} schedules in {:.2f}s ({:.0f} rows/s)'
+                            .format(result[0], result[1], elapsed, result[0] / elapsed if elapsed else 0))
+    start_fill_occurs_job()
+
+
+def start_fill_occurs_job():
+    if OCCUR_FILL_INTERVAL and not OCCUR_VIRTUAL:
+        timer = threading.Timer(OCCUR_FILL_INTERVAL, fill_occurs_job)
+        timer.daemon = True
+        timer.start()
+
+
 if __name__ == '__main__':
+    start_fill_occurs_job()
     app.run()
\ No newline at end of file
@@ -0,0 +1,10 @@
+import os
+
+
+# Configuration used by the benchmarks (TODO_CONFIG=benchmarks.bench_config.BenchConfig).
+# BENCH_DATABASE_URI must point to a scratch database: its tables are created and dropped by the benchmarks.
+class BenchConfig(object):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URI', 'sqlite://')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = 'benchmarks'
+    WTF_CSRF_ENABLED = False
@@ -0,0 +1,163 @@
+# Benchmarks of the occurence generation.
+#
+# Seeds a scratch database with N tasks x 7 schedule types, then times:
+#   single_step    db_add_occur(sched_id) once per schedule
+#   horizon_fill   db_fill_occurs() up to the horizon (one op = one occurence inserted)
+#   sched_edit     db_add_occur(sched_id, update_mode='Y') once per schedule, after a change of its rule
+#   set_status     GET /set_occur_status/<occur_id>/D/1 round-trips through the application
+# and writes the results as JSON, to compare them between releases.
+#
+# Usage, from the root of the project:
+#   python -m benchmarks.bench_occurs --tasks 200 --output results.json
+#   python -m benchmarks.bench_occurs --db postgresql+psycopg2://<user>:<password>@<server>:5432/<scratch_db>
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+
+SCHED_TYPES = ['O', 'd', 'w', 'm', 'D', 'W', 'M']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks of the occurence generation.')
+    parser.add_argument('--tasks', type=int, default=100, help='Number of tasks, each one gets 7 schedules.')
+    parser.add_argument('--db', default='sqlite://', help='URI of a scratch database (default: SQLite in memory).')
+    parser.add_argument('--horizon', type=int, default=60, help='Days filled by horizon_fill.')
+    parser.add_argument('--status-calls', type=int, default=200, help='Number of set_occur_status round-trips.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random schedules.')
+    parser.add_argument('--output', default='-', help='JSON file of the results (default: stdout).')
+    return parser.parse_args()
+
+
+def seed_db(todo, nb_tasks, rnd):
+    db = todo.db
+    now = datetime.now()
+    start_dt = date.today() - timedelta(days=30)
+    db.session.execute(todo.AppUser.__table__.insert().values(
+        first_name='Bench', last_name='Mark', user_email='bench@example.com', user_pass='-', activated_ts=now,
+        audit_crt_ts=now, user_role='Admin'))
+    user_id = db.session.query(todo.AppUser.user_id).filter_by(user_email='bench@example.com').scalar()
+    db.session.execute(todo.TaskList.__table__.insert().values(
+        list_name='Bench', list_desc='', audit_crt_user=user_id, audit_crt_ts=now))
+    list_id = db.session.query(todo.TaskList.list_id).filter_by(list_name='Bench').scalar()
+    db.session.execute(todo.Task.__table__.insert(), [
+        {'list_id': list_id, 'task_name': 'bench-{}'.format(i), 'task_desc': '', 'audit_crt_user': user_id,
+         'audit_crt_ts': now} for i in range(nb_tasks)])
+    task_ids = [row.task_id for row in db.session.query(todo.Task.task_id).order_by(todo.Task.task_id)]
+    db.session.execute(todo.Assignment.__table__.insert(), [
+        {'task_id': task_id, 'user_id': user_id} for task_id in task_ids])
+    scheds = []
+    for task_id in task_ids:
+        for sched_type in SCHED_TYPES:
+            sched_start_dt = start_dt + timedelta(days=rnd.randrange(28))
+            scheds.append({'task_id': task_id, 'sched_type': sched_type, 'sched_start_dt': sched_start_dt,
+                           'sched_end_dt': None, 'sched_last_occ_dt': None, 'sched_dow': rnd.randrange(7),
+                           'sched_dom': sched_start_dt.day, 'sched_int': rnd.randint(2, 4),
+                           'audit_crt_user': user_id, 'audit_crt_ts': now})
+    db.session.execute(todo.TaskSched.__table__.insert(), scheds)
+    db.session.commit()
+    sched_ids = db.session.query(todo.TaskSched.sched_id).order_by(todo.TaskSched.sched_id)
+    return user_id, [row.sched_id for row in sched_ids]
+
+
+def timed(results, name, nb_ops, fn):
+    # nb_ops=None: fn() returns the number of operations it did
+    start_time = time.perf_counter()
+    nb_done = fn()
+    elapsed = time.perf_counter() - start_time
+    if nb_ops is None:
+        nb_ops = nb_done
+    results[name] = {'ops': nb_ops,
+                     'seconds': round(elapsed, 6),
+                     'ms_per_op': round(1000 * elapsed / nb_ops, 4) if nb_ops else None,
+                     'ops_per_sec': round(nb_ops / elapsed, 1) if elapsed else None}
+
+
+def run(todo, args):
+    rnd = random.Random(args.seed)
+    db = todo.db
+    results = {}
+    user_id, sched_ids = seed_db(todo, args.tasks, rnd)
+
+    def single_step():
+        for sched_id in sched_ids:
+            todo.db_add_occur(sched_id)
+    timed(results, 'single_step', len(sched_ids), single_step)
+
+    def horizon_fill():
+        filled = todo.db_fill_occurs(date.today() + timedelta(days=args.horizon))
+        return filled[0] if filled else 0
+    timed(results, 'horizon_fill', None, horizon_fill)
+
+    # Every rule changes: another weekday, another interval, and a new audit_upd_ts
+    sched_table = todo.TaskSched.__table__
+    db.session.execute(sched_table.update().values(sched_dow=(sched_table.c.sched_dow + 1) % 7,
+                                                   sched_int=sched_table.c.sched_int + 1,
+                                                   audit_upd_ts=datetime.now()))
+    db.session.commit()
+
+    def sched_edit():
+        for sched_id in sched_ids:
+            todo.db_add_occur(sched_id, update_mode='Y')
+    timed(results, 'sched_edit', len(sched_ids), sched_edit)
+
+    occur_ids = [row.occur_id for row in db.session.query(todo.TaskOccurence.occur_id)
+                 .filter(todo.TaskOccurence.status == 'T')
+                 .order_by(todo.TaskOccurence.sched_dt, todo.TaskOccurence.occur_id)
+                 .limit(args.status_calls)]
+    db.session.remove()
+    client = todo.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['user_email'] = 'bench@example.com'
+        sess['first_name'] = 'Bench'
+        sess['active_time'] = datetime.now()
+
+    def set_status():
+        for occur_id in occur_ids:
+            response = client.get('/set_occur_status/{}/D/1'.format(occur_id))
+            if response.status_code != 302:
+                raise RuntimeError('set_occur_status returned {}'.format(response.status_code))
+    timed(results, 'set_status', len(occur_ids), set_status)
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ['BENCH_DATABASE_URI'] = args.db
+    os.environ['TODO_CONFIG'] = 'benchmarks.bench_config.BenchConfig'
+    import app as todo
+
+    with todo.app.app_context():
+        dialect = todo.db.engine.dialect.name
+        todo.db.create_all()
+        try:
+            results = run(todo, args)
+        finally:
+            todo.db.session.remove()
+            todo.db.drop_all()
+
+    report = {'meta': {'tasks': args.tasks,
+                       'schedules': args.tasks * len(SCHED_TYPES),
+                       'horizon_days': args.horizon,
+                       'dialect': dialect,
+                       'python': platform.python_version(),
+                       'date': datetime.now().isoformat(timespec='seconds')},
+              'results': results}
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
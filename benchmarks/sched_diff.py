@@ -0,0 +1,250 @@
+# Differential test of db_add_occur and the recurrence engines against the date stepping of db_add_occur before the
+# recurrence engine.
+#
+# The expected dates come from legacy_next_date(), a frozen copy of the stepping of db_add_occur() of the baseline
+# revision (e356a3c), called step by step in memory for random TaskSched rows (the seven types, random start and end
+# dates, dow, dom 1..31 and intervals). The dates of each engine are compared with them, then the first --db-cases
+# schedules are stored in a scratch database and run step by step through the db_add_occur() of the working tree, in
+# this process. The first divergence is reported with everything needed to replay it, and the exit code is 1. Run it
+# before merging any change to the scheduling:
+#   python -m benchmarks.sched_diff --cases 2000 --steps 12
+#   python -m benchmarks.sched_diff --engine rule --engine mymodule:my_dates
+#
+# Engines:
+#   rule     recurrence.occurrence_dates()
+#   next     recurrence.next_occurrence_date() called step by step, like db_add_occur()
+#   module:function  any function with the signature of recurrence.occurrence_dates()
+import argparse
+import importlib
+import os
+import random
+import sys
+import time
+from calendar import monthrange
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+
+SCHED_TYPES = ['O', 'd', 'w', 'm', 'D', 'W', 'M']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Differential test of db_add_occur and the recurrence engines against '
+                                                 'the date stepping of db_add_occur before the recurrence engine.')
+    parser.add_argument('--cases', type=int, default=2000, help='Number of random schedules.')
+    parser.add_argument('--steps', type=int, default=12, help='Calls of db_add_occur per schedule.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the random schedules (default: random).')
+    parser.add_argument('--engine', action='append', default=None,
+                        help='Engine to compare: rule, next or module:function (default: rule and next).')
+    parser.add_argument('--db-cases', type=int, default=50,
+                        help='Schedules also run through db_add_occur, about 50ms each (default: 50).')
+    parser.add_argument('--db', default='sqlite://', help='URI of a scratch database (default: SQLite in memory).')
+    return parser.parse_args(argv)
+
+
+# Date stepping of db_add_occur() of the baseline revision, with update_mode 'N': the date stored after last_occ_dt,
+# or None when there is none. Frozen as the reference of the comparisons, it must not follow the changes of the engine.
+def legacy_next_date(sched, last_occ_dt):
+    sched_type = sched['sched_type']
+    sched_dow = sched['sched_dow']
+    if sched_type == 'O':
+        return sched['sched_start_dt']
+
+    if last_occ_dt is None:
+        sched_dt = sched['sched_start_dt']
+        if sched_type in ('w', 'W'):
+            dow_start_dt = sched_dt.weekday()
+            if sched_dow > dow_start_dt:
+                sched_dt = sched_dt + timedelta(days=sched_dow - dow_start_dt)
+            elif sched_dow < dow_start_dt:
+                delta_days = 7 - (dow_start_dt - sched_dow)
+                sched_dt = sched_dt + timedelta(days=delta_days)
+    elif sched_type == 'd':
+        sched_dt = last_occ_dt + timedelta(days=1)
+    elif sched_type == 'w':
+        sched_dt = last_occ_dt + timedelta(days=7)
+    elif sched_type == 'm':
+        temp_dt = last_occ_dt
+        days_in_month = monthrange(temp_dt.year, temp_dt.month)[1]
+        temp_dt = temp_dt + timedelta(days=(days_in_month - temp_dt.day + 1))  # First day of next month
+        days_in_next_month = monthrange(temp_dt.year, temp_dt.month)[1]
+        if sched['sched_dom'] > days_in_next_month:
+            sched_dt = temp_dt + timedelta(days=(days_in_next_month - 1))
+        else:
+            sched_dt = temp_dt + timedelta(days=(sched['sched_dom'] - 1))
+    elif sched_type == 'D':
+        sched_dt = last_occ_dt + timedelta(days=sched['sched_int'])
+    elif sched_type == 'W':
+        sched_dt = last_occ_dt + timedelta(days=(7 * sched['sched_int']))
+    elif sched_type == 'M':
+        temp_dt = last_occ_dt - timedelta(days=(last_occ_dt.day - 1))  # Go to first of month
+        for _ in range(sched['sched_int']):  # Repeat for the number of times in the interval
+            days_in_month = monthrange(temp_dt.year, temp_dt.month)[1]
+            temp_dt = temp_dt + timedelta(days=days_in_month)  # Go to the First day of next month
+        days_in_month = monthrange(temp_dt.year, temp_dt.month)[1]
+        if sched['sched_dom'] > days_in_month:
+            sched_dt = temp_dt + timedelta(days=(days_in_month - 1))
+        else:
+            sched_dt = temp_dt + timedelta(days=(sched['sched_dom'] - 1))
+    else:
+        raise ValueError('Unknown sched_type: ' + sched_type)
+
+    if sched['sched_end_dt'] is not None and sched_dt > sched['sched_end_dt']:
+        return None
+    return sched_dt
+
+
+# Dates stored by nb_steps calls of the db_add_occur() of the baseline revision, one call for a one-time schedule
+def legacy_dates(sched, nb_steps):
+    dates = []
+    for i in range(1 if sched['sched_type'] == 'O' else nb_steps):
+        sched_dt = legacy_next_date(sched, dates[-1] if dates else None)
+        if sched_dt is None:
+            break
+        dates.append(sched_dt)
+    return dates
+
+
+# Adapts a function with the signature of recurrence.occurrence_dates() to the first nb_steps dates of a schedule
+def range_engine(fn):
+    def engine(sched, nb_steps):
+        if sched['sched_type'] == 'O':
+            nb_steps = 1
+        to_dt = sched['sched_start_dt'] + timedelta(days=(nb_steps + 1) * 31 * (sched['sched_int'] or 1))
+        dates = fn(sched['sched_type'], sched['sched_start_dt'], sched['sched_end_dt'], sched['sched_dow'],
+                   sched['sched_dom'], sched['sched_int'], sched['sched_start_dt'], to_dt)
+        return list(dates)[:nb_steps]
+    return engine
+
+
+def next_engine(sched, nb_steps):
+    from recurrence import next_occurrence_date
+    dates = []
+    for i in range(1 if sched['sched_type'] == 'O' else nb_steps):
+        sched_dt = next_occurrence_date(sched['sched_type'], sched['sched_start_dt'], sched['sched_end_dt'],
+                                        sched['sched_dow'], sched['sched_dom'], sched['sched_int'],
+                                        dates[-1] if dates else None)
+        if sched_dt is None:
+            break
+        dates.append(sched_dt)
+    return dates
+
+
+def load_engine(name):
+    if name == 'rule':
+        from recurrence import occurrence_dates
+        return range_engine(occurrence_dates)
+    if name == 'next':
+        return next_engine
+    module_name, sep, fn_name = name.partition(':')
+    if not sep:
+        raise SystemExit('Unknown engine: ' + name)
+    return range_engine(getattr(importlib.import_module(module_name), fn_name))
+
+
+def random_sched(rnd):
+    sched_type = rnd.choice(SCHED_TYPES)
+    sched_start_dt = date(2016, 1, 1) + timedelta(days=rnd.randrange(3650))
+    if rnd.random() < 0.5:
+        sched_end_dt = None
+    else:
+        sched_end_dt = sched_start_dt + timedelta(days=rnd.randrange(0, 730))
+    return {'sched_type': sched_type,
+            'sched_start_dt': sched_start_dt,
+            'sched_end_dt': sched_end_dt,
+            'sched_dow': rnd.randrange(7),
+            'sched_dom': rnd.randint(1, 31),
+            'sched_int': rnd.randint(1, 12)}
+
+
+def db_dates(todo, scheds, nb_steps):
+    # Stores the schedules, calls db_add_occur() step by step, and returns the stored dates of each schedule
+    db = todo.db
+    now = datetime.now()
+    db.session.execute(todo.Task.__table__.insert().values(
+        list_id=None, task_name='sched_diff', task_desc='', audit_crt_user=0, audit_crt_ts=now))
+    task_id = db.session.query(todo.Task.task_id).filter_by(task_name='sched_diff').scalar()
+    db.session.execute(todo.TaskSched.__table__.insert(), [
+        dict(sched, task_id=task_id, sched_last_occ_dt=None, audit_crt_user=0, audit_crt_ts=now) for sched in scheds])
+    db.session.commit()
+    sched_ids = [row.sched_id for row in db.session.query(todo.TaskSched.sched_id).order_by(todo.TaskSched.sched_id)]
+
+    for sched_id, sched in zip(sched_ids, scheds):
+        for i in range(1 if sched['sched_type'] == 'O' else nb_steps):
+            if not todo.db_add_occur(sched_id):
+                raise RuntimeError('db_add_occur failed for sched_id {}'.format(sched_id))
+
+    dates = {sched_id: [] for sched_id in sched_ids}
+    for row in db.session.query(todo.TaskOccurence.sched_id, todo.TaskOccurence.sched_dt)\
+            .order_by(todo.TaskOccurence.occur_id):
+        dates[row.sched_id].append(row.sched_dt)
+    return [dates[sched_id] for sched_id in sched_ids]
+
+
+# Dates stored by the db_add_occur of the working tree for each schedule, in the scratch database of --db
+def tree_dates(scheds, nb_steps):
+    import app as todo
+    if getattr(todo, 'OCCUR_VIRTUAL', False):
+        raise SystemExit('db_add_occur stores no occurence with OCCUR_VIRTUAL')
+    with todo.app.app_context():
+        todo.db.create_all()
+        try:
+            return db_dates(todo, scheds, nb_steps)
+        finally:
+            todo.db.session.remove()
+            todo.db.drop_all()
+
+
+# Index of the first case whose dates differ from the expected ones, None when they are all identical
+def first_divergence(expected, got):
+    return next((case for case, (a, b) in enumerate(zip(expected, got)) if a != b), None)
+
+
+def report(name, seed, args, case, sched, expected, got, replay_args=''):
+    step = next((i for i, (a, b) in enumerate(zip(expected, got)) if a != b), min(len(expected), len(got)))
+    print('Divergence of {} (seed {}, case {}, step {})'.format(name, seed, case, step))
+    print('  schedule:  {}'.format(sched))
+    print('  baseline: {}'.format(expected[step] if step < len(expected) else 'end of schedule'))
+    print('  {}: {}'.format(name, got[step] if step < len(got) else 'end of schedule'))
+    print('  replay with: python -m benchmarks.sched_diff --seed {} --cases {} --steps {}{}'
+          .format(seed, args.cases, args.steps, replay_args))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    engine_names = args.engine or ['rule', 'next']
+    engines = [(name, load_engine(name)) for name in engine_names]
+    rnd = random.Random(seed)
+    scheds = [random_sched(rnd) for i in range(args.cases)]
+
+    start_time = time.perf_counter()
+    expected = [legacy_dates(sched, args.steps) for sched in scheds]
+    print('baseline: {} cases x {} steps ({:.2f}s), seed {}'
+          .format(len(scheds), args.steps, time.perf_counter() - start_time, seed))
+
+    for name, engine in engines:
+        start_time = time.perf_counter()
+        got = [engine(sched, args.steps) for sched in scheds]
+        case = first_divergence(expected, got)
+        if case is not None:
+            report(name, seed, args, case, scheds[case], expected[case], got[case], ' --engine ' + name)
+            sys.exit(1)
+        print('{}: {} cases identical ({:.2f}s)'.format(name, len(scheds), time.perf_counter() - start_time))
+
+    db_scheds = scheds[:args.db_cases]
+    if db_scheds:
+        os.environ['BENCH_DATABASE_URI'] = args.db
+        os.environ['TODO_CONFIG'] = 'benchmarks.bench_config.BenchConfig'
+        start_time = time.perf_counter()
+        stored = tree_dates(db_scheds, args.steps)
+        case = first_divergence(expected, stored)
+        if case is not None:
+            report('db_add_occur', seed, args, case, scheds[case], expected[case], stored[case])
+            sys.exit(1)
+        print('db_add_occur: {} cases identical ({:.2f}s)'.format(len(db_scheds), time.perf_counter() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Sending of many emails for app.py (the digests), over a pool of SMTP connections.
+#
+# The messages are split in batches; each batch is sent on one connection, opened once for the batch and closed after
+# it (the servers limit the messages of a session). The batches are sent by `size` threads at the same time.
+# A message that fails with a temporary error (4xx, connection lost) is retried on a new connection after a growing
+# delay; a permanent error (5xx) is reported without retrying.
+from concurrent.futures import ThreadPoolExecutor
+import smtplib
+import time
+
+
+class SmtpPool(object):
+
+    def __init__(self, host='localhost', port=25, use_tls=False, username=None, password=None, size=1,
+                 batch_size=100, retries=3, retry_delay=1.0, timeout=30):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.size = max(size, 1)
+        self.batch_size = max(batch_size, 1)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+    def connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    # Sends the messages (email.message.EmailMessage). Returns the (message, error) of the ones that were not sent.
+    def send_all(self, messages):
+        batches = [messages[i:i + self.batch_size] for i in range(0, len(messages), self.batch_size)]
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            for batch_failures in executor.map(self.send_batch, batches):
+                failures.extend(batch_failures)
+        return failures
+
+    def send_batch(self, messages):
+        failures = []
+        conn = None
+        for message in messages:
+            attempt = 0
+            while True:
+                try:
+                    if conn is None:
+                        conn = self.connect()
+                    conn.send_message(message)
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    attempt += 1
+                    if not is_temporary(e) or attempt > self.retries:
+                        failures.append((message, str(e)))
+                        conn = reset(conn, e)
+                        break
+                    close(conn)
+                    conn = None
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1))
+        close(conn)
+        return failures
+
+
+# Connection lost, refused or timed out, or a 4xx answer of the server
+def is_temporary(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, text in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+# Connection usable for the next message after a failure, or None to open a new one
+def reset(conn, error):
+    if conn is None or isinstance(error, (smtplib.SMTPServerDisconnected, OSError)):
+        close(conn)
+        return None
+    try:
+        conn.rset()
+        return conn
+    except (smtplib.SMTPException, OSError):
+        close(conn)
+        return None
+
+
+def close(conn):
+    if conn is None:
+        return
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
@@ -0,0 +1,88 @@
+# Writers of the export of the occurences for app.py (flask export-occurs and the view export_occurs).
+#
+# The rows come from a generator over the database cursor and are written by chunks, so the memory used doesn't grow
+# with the number of rows:
+#   csv_chunks()       CSV text, one chunk of lines at a time
+#   parquet_chunks()   Parquet file, one row group at a time (needs pyarrow, an optional dependency)
+# The rows are dicts with the keys of COLUMNS.
+import csv
+import io
+from itertools import islice
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = ['occur_id', 'sched_dt', 'status', 'task_id', 'task_name', 'list_name', 'sched_id', 'sched_type',
+           'sched_int', 'sched_dow', 'sched_dom', 'upd_user_id', 'upd_user_name', 'audit_upd_ts', 'tags']
+PARQUET_TYPES = {'occur_id': 'int64', 'sched_dt': 'date32', 'task_id': 'int64', 'sched_id': 'int64',
+                 'sched_int': 'int16', 'sched_dow': 'int16', 'sched_dom': 'int16', 'upd_user_id': 'int64',
+                 'audit_upd_ts': 'timestamp[us]'}    # The other columns are strings
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+# CSV text of the rows, with a header line, in chunks of chunk_rows lines
+def csv_chunks(rows, chunk_rows=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches(rows, chunk_rows):
+        writer.writerows([row[column] for column in COLUMNS] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# File object that keeps what is written until it is taken, for the writer of pyarrow
+class ChunkSink(io.RawIOBase):
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# Bytes of a Parquet file of the rows, yielded after each row group of row_group_size rows and for the footer
+def parquet_chunks(rows, row_group_size=50000):
+    schema = pyarrow.schema([(column, PARQUET_TYPES.get(column, 'string')) for column in COLUMNS])
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for batch in batches(rows, row_group_size):
+            writer.write_table(pyarrow.Table.from_pydict(
+                {column: [row[column] for row in batch] for column in COLUMNS}, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
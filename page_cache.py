@@ -0,0 +1,94 @@
+# Caches of rendered pages for app.py.
+#
+# The keys are built by the application from the route, its arguments, the user and the versions of the data shown
+# (tdata_version): a change of the data gives a new key, so an entry is never stale and is never invalidated, the
+# entries of the old versions are only pushed out by the newer ones.
+#   MemoryPageCache   LRU in the process, one per worker
+#   SqlitePageCache   SQLite file shared by the workers of a host
+# make_page_cache() builds the one of the PAGE_CACHE setting.
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+
+# Bounded LRU of pages in the process
+class MemoryPageCache(object):
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+            return page
+
+    def set(self, key, page):
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            if len(self.pages) > self.maxsize:
+                self.pages.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+
+
+# Pages in a SQLite file, shared by the processes of the host. One connection per call: sqlite3 connections can't be
+# shared between threads. The oldest written pages are deleted when there are more than maxsize.
+class SqlitePageCache(object):
+
+    def __init__(self, path, maxsize=500):
+        self.path = path
+        self.maxsize = maxsize
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS tpage_cache '
+                         '(cache_key TEXT PRIMARY KEY, page BLOB NOT NULL, written_ts REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tpage_cache_x1 ON tpage_cache (written_ts)')
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT page FROM tpage_cache WHERE cache_key = ?', (key,)).fetchone()
+        finally:
+            conn.close()
+        return bytes(row[0]) if row is not None else None
+
+    def set(self, key, page):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO tpage_cache (cache_key, page, written_ts) VALUES (?, ?, ?)',
+                             (key, page, time.time()))
+                conn.execute('DELETE FROM tpage_cache WHERE written_ts < '
+                             '(SELECT written_ts FROM tpage_cache ORDER BY written_ts DESC LIMIT 1 OFFSET ?)',
+                             (self.maxsize - 1,))
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM tpage_cache')
+        finally:
+            conn.close()
+
+
+# Cache of a PAGE_CACHE setting: 'memory', 'sqlite:<path of the file>', or None (no cache)
+def make_page_cache(setting, maxsize=500):
+    if not setting:
+        return None
+    if setting == 'memory':
+        return MemoryPageCache(maxsize)
+    if setting.startswith('sqlite:'):
+        return SqlitePageCache(setting[len('sqlite:'):], maxsize)
+    raise ValueError('Unknown PAGE_CACHE: ' + setting)
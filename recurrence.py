@@ -0,0 +1,225 @@
+# Recurrence engine for TaskSched.
+#
+# Computes the due dates of a schedule from its fields only (no database access). The rules are the same as the
+# ones applied one step at a time by db_add_occur() in app.py:
+#   O: once, on sched_start_dt
+#   d: every day from sched_start_dt
+#   w: every week, on sched_dow (0=Monday..6=Sunday), from the first sched_dow on or after sched_start_dt
+#   m: sched_start_dt, then every month on sched_dom (clamped to the last day of shorter months)
+#   D: every sched_int days from sched_start_dt
+#   W: every sched_int weeks on sched_dow, from the first sched_dow on or after sched_start_dt
+#   M: sched_start_dt, then every sched_int months on sched_dom (clamped like 'm')
+# No occurrence falls after sched_end_dt, except for 'O' which never looked at the end date.
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import (date,
+                      timedelta)
+import threading
+import numpy as np
+
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+def first_occurrence(sched_type, sched_start_dt, sched_dow):
+    # Weekly schedules start on the first chosen weekday on or after the start date
+    if sched_type in ('w', 'W'):
+        return sched_start_dt + timedelta(days=(int(sched_dow) - sched_start_dt.weekday()) % 7)
+    return sched_start_dt
+
+
+def day_stride(sched_type, sched_int):
+    # Number of days between two occurrences, None when the stride is not a fixed number of days
+    if sched_type == 'd':
+        return 1
+    elif sched_type == 'w':
+        return 7
+    elif sched_type == 'D':
+        return int(sched_int)
+    elif sched_type == 'W':
+        return 7 * int(sched_int)
+    return None
+
+
+def month_stride(sched_type, sched_int):
+    if sched_type == 'm':
+        return 1
+    elif sched_type == 'M':
+        return int(sched_int)
+    return None
+
+
+# Months are counted with a month index (year * 12 + month - 1), so moving k months is one addition and one
+# divmod whatever k is. The day of month is clamped to the length of the target month (31 -> 30, 29 or 28).
+def month_index(d):
+    return d.year * 12 + d.month - 1
+
+
+def month_date(index, dom):
+    year, month = divmod(index, 12)
+    return date(year, month + 1, min(dom, monthrange(year, month + 1)[1]))
+
+
+# A schedule rule compiled once: the strides, the anchor date and the day of month are derived from the TaskSched
+# fields when the rule is built. The instances are immutable and can be shared between requests.
+class SchedRule(object):
+    __slots__ = ('sched_type', 'start_dt', 'end_dt', 'dow', 'dom', 'interval',
+                 'anchor_dt', 'day_stride', 'month_stride')
+
+    def __init__(self, sched_type, sched_start_dt, sched_end_dt, sched_dow, sched_dom, sched_int):
+        if sched_type not in ('O', 'd', 'w', 'm', 'D', 'W', 'M'):
+            raise ValueError('Unknown schedule type: ' + str(sched_type))
+        set_slot = object.__setattr__
+        set_slot(self, 'sched_type', sched_type)
+        set_slot(self, 'start_dt', sched_start_dt)
+        set_slot(self, 'end_dt', sched_end_dt)
+        set_slot(self, 'dow', None if sched_dow is None else int(sched_dow))
+        set_slot(self, 'dom', int(sched_dom or sched_start_dt.day))
+        set_slot(self, 'interval', None if sched_int is None else int(sched_int))
+        set_slot(self, 'anchor_dt', first_occurrence(sched_type, sched_start_dt, sched_dow))
+        set_slot(self, 'day_stride', day_stride(sched_type, sched_int))
+        set_slot(self, 'month_stride', month_stride(sched_type, sched_int))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SchedRule is immutable')
+
+    def __repr__(self):
+        return '<sched_rule: {} {}>'.format(self.sched_type, self.start_dt)
+
+    def dates(self, from_dt, to_dt, after_dt=None):
+        # Returns the sorted list of due dates between from_dt and to_dt (inclusive).
+        # When after_dt is given, the sequence continues from that date (like db_add_occur does from
+        # sched_last_occ_dt) instead of starting from the start date, and only dates after it are returned.
+        if self.sched_type == 'O':
+            if from_dt <= self.start_dt <= to_dt and (after_dt is None or self.start_dt > after_dt):
+                return [self.start_dt]
+            return []
+        if self.end_dt is not None and self.end_dt < to_dt:
+            to_dt = self.end_dt
+        if after_dt is not None and after_dt >= from_dt:
+            from_dt = after_dt + timedelta(days=1)
+        if from_dt > to_dt:
+            return []
+
+        stride = self.day_stride
+        if stride is not None:
+            if after_dt is None:
+                base = np.datetime64(self.anchor_dt, 'D')
+            else:
+                base = np.datetime64(after_dt, 'D') + stride
+            k_lo = max(0, -(-int((np.datetime64(from_dt, 'D') - base) // ONE_DAY) // stride))
+            k_hi = int((np.datetime64(to_dt, 'D') - base) // ONE_DAY) // stride
+            if k_hi < k_lo:
+                return []
+            return (base + np.arange(k_lo, k_hi + 1) * stride).tolist()
+
+        stride = self.month_stride
+        if after_dt is None:
+            # The start date is the first occurrence, the following ones are counted in months from it
+            base = np.datetime64(self.start_dt, 'M')
+            dates = [self.start_dt] if from_dt <= self.start_dt <= to_dt else []
+        else:
+            base = np.datetime64(after_dt, 'M')
+            dates = []
+        k_lo = max(1, int(np.datetime64(from_dt, 'M') - base) // stride)
+        k_hi = int(np.datetime64(to_dt, 'M') - base) // stride
+        if k_hi < k_lo:
+            return dates
+        months = base + np.arange(k_lo, k_hi + 1) * stride
+        first_days = months.astype('datetime64[D]')
+        month_len = ((months + 1).astype('datetime64[D]') - first_days) // ONE_DAY
+        days = first_days + (np.minimum(month_len, self.dom) - 1)
+        days = days[(days >= np.datetime64(from_dt, 'D')) & (days <= np.datetime64(to_dt, 'D'))]
+        return dates + days.tolist()
+
+    def nth_date(self, k):
+        # Occurence number k of the schedule (k=0 is the first one), None when it falls after the end date
+        if self.sched_type == 'O':
+            return self.start_dt if k == 0 else None
+        if self.day_stride is not None:
+            sched_dt = self.anchor_dt + timedelta(days=k * self.day_stride)
+        elif k == 0:
+            sched_dt = self.start_dt
+        else:
+            sched_dt = month_date(month_index(self.start_dt) + k * self.month_stride, self.dom)
+        if self.end_dt is not None and sched_dt > self.end_dt:
+            return None
+        return sched_dt
+
+    def next_date(self, after_dt=None):
+        # First due date after after_dt (or first due date of the schedule), None when the schedule is over
+        if after_dt is None:
+            return self.nth_date(0)
+        if self.sched_type == 'O':
+            return self.start_dt if self.start_dt > after_dt else None
+        if self.day_stride is not None:
+            sched_dt = after_dt + timedelta(days=self.day_stride)
+        else:
+            sched_dt = month_date(month_index(after_dt) + self.month_stride, self.dom)
+        if self.end_dt is not None and sched_dt > self.end_dt:
+            return None
+        return sched_dt
+
+    def resume(self, last_dt):
+        # Where the schedule resumes after last_dt, its last occurence that was acted on, once its rule has changed.
+        # Returns (rule, after_dt). Weekly schedules restart on the first chosen weekday after last_dt since the
+        # weekday may have changed; the others continue from last_dt like db_add_occur does. Occurences acted on
+        # before the start date are not followed anymore.
+        if last_dt is None or last_dt < self.start_dt:
+            return self, None
+        if self.sched_type in ('w', 'W'):
+            return SchedRule(self.sched_type, last_dt + timedelta(days=1), self.end_dt, self.dow, self.dom,
+                             self.interval), None
+        return self, last_dt
+
+
+def compile_sched(sched):
+    # SchedRule of a TaskSched row (or any object with the same attributes)
+    return SchedRule(sched.sched_type, sched.sched_start_dt, sched.sched_end_dt, sched.sched_dow,
+                     sched.sched_dom, sched.sched_int)
+
+
+# Bounded LRU of compiled rules. The key must change whenever the schedule changes.
+class RuleCache(object):
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.rules = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, sched):
+        with self.lock:
+            rule = self.rules.get(key)
+            if rule is not None:
+                self.rules.move_to_end(key)
+                return rule
+        rule = compile_sched(sched)
+        with self.lock:
+            self.rules[key] = rule
+            if len(self.rules) > self.maxsize:
+                self.rules.popitem(last=False)
+        return rule
+
+    def clear(self):
+        with self.lock:
+            self.rules.clear()
+
+
+def occurrence_dates(sched_type, sched_start_dt, sched_end_dt, sched_dow, sched_dom, sched_int,
+                     from_dt, to_dt, after_dt=None):
+    return SchedRule(sched_type, sched_start_dt, sched_end_dt, sched_dow, sched_dom, sched_int)\
+        .dates(from_dt, to_dt, after_dt)
+
+
+def sched_occurrence_dates(sched, from_dt, to_dt, after_dt=None):
+    # Same as occurrence_dates() for a TaskSched row (or any object with the same attributes)
+    return compile_sched(sched).dates(from_dt, to_dt, after_dt)
+
+
+def due_dates(scheds, from_dt, to_dt):
+    # Due dates for many schedules at once, keyed by sched_id
+    return {s.sched_id: sched_occurrence_dates(s, from_dt, to_dt) for s in scheds}
+
+
+def next_occurrence_date(sched_type, sched_start_dt, sched_end_dt, sched_dow, sched_dom, sched_int, after_dt=None):
+    return SchedRule(sched_type, sched_start_dt, sched_end_dt, sched_dow, sched_dom, sched_int).next_date(after_dt)
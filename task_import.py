@@ -0,0 +1,196 @@
+# Reading of the import files of app.py (flask import-tasks and the page import_tasks).
+#
+# The file describes new tasks with their list, tags, assignees (emails of users) and schedules. It is read and
+# checked entirely in memory, without the database: app.py then checks the names against the database and loads all of
+# it in one transaction.
+#   CSV   one row per schedule of a task, with the columns of CSV_COLUMNS. The rows of the same task_name are merged
+#         (a task without schedule has an empty sched_type); tags and assignees are separated by ';'.
+#   JSON  {"tasklists": [{"list_name", "list_desc"}], "tasks": [{"list_name", "task_name", "task_desc", "tags": [],
+#         "assignees": [], "schedules": [{"sched_type", "sched_start_dt", "sched_end_dt", "sched_dow", "sched_int"}]}]}
+#         or only the list of the tasks. The lists not in "tasklists" are created with an empty description.
+# The schedules have the fields of the add_sched_* forms: sched_dow (0=Monday..6=Sunday) for w and W, sched_int for
+# D, W and M; sched_dom is the day of sched_start_dt for m and M.
+from datetime import datetime
+import csv
+import io
+import json
+
+CSV_COLUMNS = ['list_name', 'task_name', 'task_desc', 'tags', 'assignees',
+               'sched_type', 'sched_start_dt', 'sched_end_dt', 'sched_dow', 'sched_int']
+SCHED_TYPES = 'OdwmDWM'
+NAME_SIZE = 50
+
+
+# Tasks of a file: (tasklists {list_name: list_desc}, tasks [dict], errors [str]). file_format is 'csv' or 'json',
+# text is the content of the file.
+def read_tasks(text, file_format):
+    errors = []
+    if file_format == 'csv':
+        tasklists, tasks = csv_tasks(text, errors)
+    elif file_format == 'json':
+        tasklists, tasks = json_tasks(text, errors)
+    else:
+        raise ValueError('Unknown import format: ' + file_format)
+    names = set()
+    for task in tasks:
+        where = task['where']
+        check_name(task['task_name'], 'le nom de la tâche', where, errors)
+        check_name(task['list_name'], 'le nom de la liste', where, errors)
+        for tag_name in task['tags']:
+            if len(tag_name) > NAME_SIZE:
+                errors.append('{}: le nom de l\'étiquette "{}" est trop long.'.format(where, tag_name))
+        if task['task_name'] in names:
+            errors.append('{}: la tâche "{}" est en double.'.format(where, task['task_name']))
+        names.add(task['task_name'])
+        tasklists.setdefault(task['list_name'], '')
+    return tasklists, tasks, errors
+
+
+def csv_tasks(text, errors):
+    tasks = {}
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [column for column in ('list_name', 'task_name') if column not in (reader.fieldnames or [])]
+    if missing:
+        errors.append('Colonne(s) manquante(s): {}.'.format(', '.join(missing)))
+        return {}, []
+    for row in reader:
+        where = 'Ligne {}'.format(reader.line_num)
+        row = {column: (row.get(column) or '').strip() for column in CSV_COLUMNS}
+        task = tasks.get(row['task_name'])
+        if task is None:
+            task = new_task(row['list_name'], row['task_name'], row['task_desc'], split_names(row['tags']),
+                            split_names(row['assignees']), where)
+            tasks[row['task_name']] = task
+        else:
+            if row['list_name'] != task['list_name']:
+                errors.append('{}: la tâche "{}" est dans une autre liste plus haut.'.format(where, row['task_name']))
+            task['task_desc'] = task['task_desc'] or row['task_desc']
+            task['tags'].extend(name for name in split_names(row['tags']) if name not in task['tags'])
+            task['assignees'].extend(name for name in split_names(row['assignees']) if name not in task['assignees'])
+        if row['sched_type']:
+            sched = read_sched(row, where, errors)
+            if sched:
+                task['schedules'].append(sched)
+    return {}, list(tasks.values())
+
+
+def json_tasks(text, errors):
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        errors.append('JSON invalide: {}.'.format(e))
+        return {}, []
+    if isinstance(data, list):
+        data = {'tasks': data}
+    if not isinstance(data, dict) or not isinstance(data.get('tasks', []), list) \
+            or not isinstance(data.get('tasklists', []), list):
+        errors.append('JSON invalide: un objet avec "tasks" est attendu.')
+        return {}, []
+    tasklists = {}
+    for i, tasklist in enumerate(data.get('tasklists', []), 1):
+        if not isinstance(tasklist, dict) or not text_value(tasklist.get('list_name')):
+            errors.append('Liste {}: le nom est requis.'.format(i))
+            continue
+        tasklists[text_value(tasklist['list_name'])] = text_value(tasklist.get('list_desc'))
+    tasks = []
+    for i, item in enumerate(data.get('tasks', []), 1):
+        where = 'Tâche {}'.format(i)
+        if not isinstance(item, dict):
+            errors.append('{}: un objet est attendu.'.format(where))
+            continue
+        task = new_task(text_value(item.get('list_name')), text_value(item.get('task_name')),
+                        text_value(item.get('task_desc')), name_list(item.get('tags')),
+                        name_list(item.get('assignees')), where)
+        for j, item_sched in enumerate(item.get('schedules') or [], 1):
+            if not isinstance(item_sched, dict):
+                errors.append('{}, cédule {}: un objet est attendu.'.format(where, j))
+                continue
+            sched = read_sched({key: text_value(value) for key, value in item_sched.items()},
+                               '{}, cédule {}'.format(where, j), errors)
+            if sched:
+                task['schedules'].append(sched)
+        tasks.append(task)
+    return tasklists, tasks
+
+
+def new_task(list_name, task_name, task_desc, tags, assignees, where):
+    return {'list_name': list_name, 'task_name': task_name, 'task_desc': task_desc, 'tags': unique(tags),
+            'assignees': unique(assignees), 'schedules': [], 'where': where}
+
+
+# Schedule of a row with the fields of CSV_COLUMNS as text, None if it has errors
+def read_sched(row, where, errors):
+    nb_errors = len(errors)
+    sched_type = row.get('sched_type', '')
+    if sched_type not in SCHED_TYPES or not sched_type:
+        errors.append('{}: le type de cédule "{}" est inconnu.'.format(where, sched_type))
+        return None
+    sched_start_dt = read_date(row.get('sched_start_dt', ''), 'la date de début', where, errors, required=True)
+    sched_end_dt = None
+    if sched_type != 'O':
+        sched_end_dt = read_date(row.get('sched_end_dt', ''), 'la date de fin', where, errors)
+        if sched_start_dt and sched_end_dt and sched_start_dt > sched_end_dt:
+            errors.append('{}: la date de fin doit être après la date de début.'.format(where))
+    sched_dow = None
+    if sched_type in ('w', 'W'):
+        sched_dow = read_int(row.get('sched_dow', ''), 'le jour de la semaine', 0, 6, where, errors)
+    sched_int = None
+    if sched_type in ('D', 'W', 'M'):
+        sched_int = read_int(row.get('sched_int', ''), "l'interval", 1, 999, where, errors)
+    if len(errors) > nb_errors:
+        return None
+    sched_dom = sched_start_dt.day if sched_type in ('m', 'M') else None
+    return {'sched_type': sched_type, 'sched_start_dt': sched_start_dt, 'sched_end_dt': sched_end_dt,
+            'sched_dow': sched_dow, 'sched_dom': sched_dom, 'sched_int': sched_int}
+
+
+def read_date(value, label, where, errors, required=False):
+    if not value:
+        if required:
+            errors.append('{}: {} est requise.'.format(where, label))
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        errors.append('{}: {} "{}" n\'est pas une date AAAA-MM-JJ.'.format(where, label, value))
+        return None
+
+
+def read_int(value, label, low, high, where, errors):
+    try:
+        number = int(value)
+    except ValueError:
+        errors.append('{}: {} est requis.'.format(where, label))
+        return None
+    if not low <= number <= high:
+        errors.append('{}: {} doit être entre {} et {}.'.format(where, label, low, high))
+        return None
+    return number
+
+
+def check_name(name, label, where, errors):
+    if not name:
+        errors.append('{}: {} est requis.'.format(where, label))
+    elif len(name) > NAME_SIZE:
+        errors.append('{}: {} "{}" est trop long.'.format(where, label, name))
+
+
+def unique(names):
+    return list(dict.fromkeys(names))
+
+
+def split_names(value):
+    return [name.strip() for name in value.split(';') if name.strip()]
+
+
+def name_list(value):
+    if isinstance(value, str):
+        return split_names(value)
+    return [text_value(name) for name in value or [] if text_value(name)]
+
+
+# JSON value as stripped text: numbers become text, null an empty string
+def text_value(value):
+    if value is None:
+        return ''
+    return str(value).strip()
@@ -0,0 +1,47 @@
+# Configuration of the tests: app.py reads its configuration when it is imported, so TODO_CONFIG is set here, before
+# the tests import it. The database is in memory and every test starts from empty tables.
+from datetime import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['TODO_CONFIG'] = 'conftest.TestConfig'
+
+
+class TestConfig(object):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = 'test'
+    WTF_CSRF_ENABLED = False
+    PAGE_CACHE = None
+
+
+# The app module with its tables, a user (user_id 1) and a task list (list_id 1)
+@pytest.fixture
+def todo():
+    import app
+    with app.app.app_context():
+        app.db.create_all()
+        user = app.AppUser('Jean', 'Test', 'jean@test.ca', 'x', datetime.now())
+        user.activated_ts = datetime.now()
+        app.db.session.add(user)
+        app.db.session.add(app.TaskList('Maison', '', 1, datetime.now()))
+        app.db.session.commit()
+        yield app
+        app.db.session.remove()
+        app.db.drop_all()
+        app.rule_cache.clear()
+
+
+# A client logged in as user 1
+@pytest.fixture
+def client(todo):
+    client = todo.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['user_email'] = 'jean@test.ca'
+        sess['first_name'] = 'Jean'
+        sess['active_time'] = datetime.now()
+    return client
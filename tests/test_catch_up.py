@@ -0,0 +1,66 @@
+# Catch-up of the occurences missed by a daily schedule three weeks behind, with each policy.
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+
+START_DT = date.today() - timedelta(days=21)
+YESTERDAY = date.today() - timedelta(days=1)
+
+
+@pytest.fixture
+def sched_id(todo):
+    now = datetime.now()
+    todo.db.session.add(todo.Task(1, 'Arrosage', '', 1, now))
+    todo.db.session.add(todo.Assignment(1, 1))
+    sched = todo.TaskSched(1, 'd', START_DT, None, None, None, None, None, 1, now)
+    todo.db.session.add(sched)
+    todo.db.session.commit()
+    assert todo.db_add_occur(sched.sched_id)
+    return sched.sched_id
+
+
+def occurs(todo, sched_id):
+    todo.db.session.expire_all()
+    return [(occur.sched_dt, occur.status) for occur in
+            todo.TaskOccurence.query.filter_by(sched_id=sched_id).order_by(todo.TaskOccurence.sched_dt)]
+
+
+def last_occ_dt(todo, sched_id):
+    return todo.db.session.get(todo.TaskSched, sched_id).sched_last_occ_dt
+
+
+def missed_dts():
+    return [START_DT + timedelta(days=n) for n in range(21)]
+
+
+def catch_up(todo, client, sched_id, policy):
+    assert occurs(todo, sched_id) == [(START_DT, 'T')]
+    response = client.get('/catch_up_occurs/{}/{}'.format(sched_id, policy))
+    assert response.status_code == 302
+    with client.session_transaction() as sess:
+        assert sess['_flashes'] == [('message', '21 occurence(s) en retard ont été traitées.')]
+
+
+def test_skip_all(todo, client, sched_id):
+    catch_up(todo, client, sched_id, 'S')
+    assert occurs(todo, sched_id) == [(d, 'S') for d in missed_dts()] + [(date.today(), 'T')]
+    assert last_occ_dt(todo, sched_id) == date.today()
+
+
+def test_cancel_all(todo, client, sched_id):
+    catch_up(todo, client, sched_id, 'C')
+    assert occurs(todo, sched_id) == [(d, 'C') for d in missed_dts()] + [(date.today(), 'T')]
+    assert last_occ_dt(todo, sched_id) == date.today()
+
+
+def test_keep_latest(todo, client, sched_id):
+    catch_up(todo, client, sched_id, 'L')
+    assert occurs(todo, sched_id) == [(d, 'S') for d in missed_dts()[:-1]] + [(YESTERDAY, 'T')]
+    assert last_occ_dt(todo, sched_id) == YESTERDAY
+
+
+def test_unknown_policy(todo, client, sched_id):
+    assert client.get('/catch_up_occurs/{}/X'.format(sched_id)).status_code == 404
+    assert occurs(todo, sched_id) == [(START_DT, 'T')]
@@ -0,0 +1,51 @@
+# Schema migrations: an empty database upgraded by db_upgrade() gets the schema of the models, and topen_work is
+# filled from the frozen tables.
+from datetime import date
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+
+def schema(todo):
+    inspector = inspect(todo.db.engine)
+    return {table: ([(column['name'], str(column['type']), column['nullable'])
+                     for column in inspector.get_columns(table)],
+                    sorted((index['name'], tuple(index['column_names']), bool(index['unique']))
+                           for index in inspector.get_indexes(table)),
+                    sorted(tuple(unique['column_names']) for unique in inspector.get_unique_constraints(table)))
+            for table in inspector.get_table_names()}
+
+
+def test_upgrade_empty_database(todo):
+    models = schema(todo)
+    todo.db.session.remove()
+    todo.db.drop_all()
+    applied = todo.db_upgrade()
+    assert [version for version, description in applied] == [version for version, description, migrate
+                                                             in todo.schema_migrations]
+    assert schema(todo) == models
+    assert todo.db_upgrade() == []
+
+
+def test_upgrade_fills_open_work(todo):
+    todo.db.session.remove()
+    todo.db.drop_all()
+    assert todo.db_upgrade(1) == [(1, 'Tables du modèle')]
+    assert 'topen_work' not in inspect(todo.db.engine).get_table_names()
+    now = datetime.now()
+    todo.db.session.add(todo.AppUser('Jean', 'Test', 'jean@test.ca', 'x', now))
+    todo.db.session.add(todo.TaskList('Maison', '', 1, now))
+    todo.db.session.add(todo.Task(1, 'Vaisselle', '', 1, now))
+    todo.db.session.add(todo.TaskSched(1, 'd', date(2024, 1, 1), None, date(2024, 1, 2), None, None, None, 1, now))
+    todo.db.session.add_all([todo.TaskOccurence(1, 1, date(2024, 1, 1)), todo.TaskOccurence(1, 1, date(2024, 1, 2))])
+    # The same assignment twice: migration 4 keeps one
+    todo.db.session.add_all([todo.Assignment(1, 1), todo.Assignment(1, 1)])
+    todo.db.session.commit()
+    todo.db.session.query(todo.TaskOccurence).filter_by(sched_dt=date(2024, 1, 1)).update({'status': 'D'})
+    todo.db.session.commit()
+
+    assert [version for version, description in todo.db_upgrade()] == [2, 3, 4, 5]
+    work = todo.db.session.query(todo.OpenWork.user_id, todo.OpenWork.first_name, todo.OpenWork.task_name,
+                                 todo.OpenWork.sched_type, todo.OpenWork.sched_dt).all()
+    assert work == [(1, 'Jean', 'Vaisselle', 'd', date(2024, 1, 2))]
+    assert todo.db.session.query(todo.Assignment).count() == 1
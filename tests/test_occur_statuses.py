@@ -0,0 +1,96 @@
+# Status change of many occurences in one POST (set_occur_statuses, db_set_occ_statuses).
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+
+TODAY = date.today()
+JSON = {'Accept': 'application/json'}
+
+
+# A daily schedule with its occurence of today stored, and an every 2 days schedule without any stored occurence
+@pytest.fixture
+def scheds(todo):
+    now = datetime.now()
+    for task_id, task_name in enumerate(['Arrosage', 'Balayage'], 1):
+        todo.db.session.add(todo.Task(1, task_name, '', 1, now))
+        todo.db.session.add(todo.Assignment(task_id, 1))
+    daily = todo.TaskSched(1, 'd', TODAY, None, TODAY, None, None, None, 1, now)
+    every_2 = todo.TaskSched(2, 'D', TODAY, None, None, None, None, 2, 1, now)
+    todo.db.session.add_all([daily, every_2])
+    todo.db.session.flush()
+    todo.db.session.add(todo.TaskOccurence(1, daily.sched_id, TODAY))
+    todo.sync_open_work()
+    todo.db.session.commit()
+    return daily.sched_id, every_2.sched_id
+
+
+def occurs(todo, sched_id):
+    todo.db.session.expire_all()
+    return [(occur.sched_dt, occur.status) for occur in
+            todo.TaskOccurence.query.filter_by(sched_id=sched_id).order_by(todo.TaskOccurence.sched_dt)]
+
+
+def last_occ_dt(todo, sched_id):
+    return todo.db.session.get(todo.TaskSched, sched_id).sched_last_occ_dt
+
+
+def test_mixed_occurences(todo, client, scheds):
+    daily, every_2 = scheds
+    occur_id = todo.TaskOccurence.query.filter_by(sched_id=daily).one().occur_id
+    response = client.post('/set_occur_statuses', data={'occur': [str(occur_id), '{}:{}'.format(every_2, TODAY)],
+                                                        'status': 'D', 'redir_to': 1}, headers=JSON)
+    assert response.status_code == 200
+    assert response.json == {'status': 'D', 'changed': 2, 'added': 2, 'sched_ids': [daily, every_2]}
+    assert occurs(todo, daily) == [(TODAY, 'D'), (TODAY + timedelta(days=1), 'T')]
+    assert occurs(todo, every_2) == [(TODAY, 'D'), (TODAY + timedelta(days=2), 'T')]
+    assert last_occ_dt(todo, daily) == TODAY + timedelta(days=1)
+    assert last_occ_dt(todo, every_2) == TODAY + timedelta(days=2)
+    work = todo.db.session.query(todo.OpenWork.sched_id, todo.OpenWork.sched_dt).order_by(todo.OpenWork.sched_id)
+    assert work.all() == [(daily, TODAY + timedelta(days=1)), (every_2, TODAY + timedelta(days=2))]
+
+
+def test_computed_occurences(todo, client, scheds, monkeypatch):
+    # With OCCUR_VIRTUAL the computed occurence is stored and no next one is added
+    monkeypatch.setattr(todo, 'OCCUR_VIRTUAL', True)
+    daily, every_2 = scheds
+    response = client.post('/set_occur_statuses', data={'occur': '{}:{}'.format(every_2, TODAY), 'status': 'S',
+                                                        'redir_to': 1}, headers=JSON)
+    assert response.json == {'status': 'S', 'changed': 1, 'added': 0, 'sched_ids': [every_2]}
+    assert occurs(todo, every_2) == [(TODAY, 'S')]
+    assert last_occ_dt(todo, every_2) == TODAY
+
+
+def test_redirect(todo, client, scheds):
+    daily, every_2 = scheds
+    response = client.post('/set_occur_statuses', data={'occur': '{}:{}'.format(every_2, TODAY), 'status': 'D',
+                                                        'redir_to': 2})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/list_tasks_for_all')
+
+
+@pytest.mark.parametrize('data', [{'occur': '1', 'status': 'Z'}, {'occur': 'x', 'status': 'D'},
+                                  {'occur': '2:2024-02-30', 'status': 'D'}])
+def test_bad_parameters(todo, client, scheds, data):
+    assert client.post('/set_occur_statuses', data=data).status_code == 400
+    response = client.post('/set_occur_statuses', data=data, headers=JSON)
+    assert response.status_code == 400
+    assert response.json == {'error': 'Paramètre invalide.'}
+    assert occurs(todo, scheds[0]) == [(TODAY, 'T')]
+
+
+def test_rollback(todo, client, scheds, monkeypatch):
+    # When the next occurences can't be computed, the statuses are not changed either
+    def sched_rule(sched):
+        raise RuntimeError('sched_rule')
+
+    daily, every_2 = scheds
+    occur_id = todo.TaskOccurence.query.filter_by(sched_id=daily).one().occur_id
+    monkeypatch.setattr(todo, 'sched_rule', sched_rule)
+    response = client.post('/set_occur_statuses', data={'occur': str(occur_id), 'status': 'D', 'redir_to': 1},
+                           headers=JSON)
+    assert response.status_code == 500
+    assert occurs(todo, daily) == [(TODAY, 'T')]
+    assert last_occ_dt(todo, daily) == TODAY
+    assert todo.db.session.query(todo.OpenWork.sched_dt).filter_by(sched_id=daily).all() == [(TODAY,)]
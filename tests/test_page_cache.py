@@ -0,0 +1,96 @@
+# Cache of the rendered list pages (cached_page, page_cache.py).
+from datetime import date
+from datetime import datetime
+import re
+
+from flask import g
+from flask import session
+import pytest
+
+from page_cache import MemoryPageCache
+
+
+@pytest.fixture
+def page_cache(todo, monkeypatch):
+    cache = MemoryPageCache(10)
+    monkeypatch.setattr(todo, 'page_cache', cache)
+    return cache
+
+
+# A daily schedule assigned to user 1 with its occurence of today, returns its occur_id
+@pytest.fixture
+def occur_id(todo):
+    now = datetime.now()
+    todo.db.session.add(todo.Task(1, 'Arrosage', '', 1, now))
+    todo.db.session.add(todo.Assignment(1, 1))
+    todo.db.session.add(todo.TaskSched(1, 'd', date.today(), None, date.today(), None, None, None, 1, now))
+    todo.db.session.flush()
+    occur = todo.TaskOccurence(1, 1, date.today())
+    todo.db.session.add(occur)
+    todo.sync_open_work()
+    todo.db.session.commit()
+    return occur.occur_id
+
+
+def csrf_token(response):
+    return re.search(r'name="csrf-token" content="([^"]+)"', response.get_data(as_text=True)).group(1)
+
+
+def test_hit(client, page_cache):
+    first = client.get('/list_tags')
+    second = client.get('/list_tags')
+    assert first.headers['X-Page-Cache'] == 'miss'
+    assert second.headers['X-Page-Cache'] == 'hit'
+    assert second.get_data() == first.get_data()
+
+
+def test_miss_after_add_tag(todo, client, page_cache):
+    client.get('/list_tags')
+    assert client.get('/list_tags').headers['X-Page-Cache'] == 'hit'
+    with todo.app.test_request_context():
+        session['user_id'] = 1
+        assert todo.db_add_tag('Jardin')
+    response = client.get('/list_tags')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert 'Jardin' in response.get_data(as_text=True)
+
+
+def test_miss_after_status_change(todo, client, page_cache, occur_id):
+    assert 'Arrosage' in client.get('/list_tasks_for_all').get_data(as_text=True)
+    assert client.get('/list_tasks_for_all').headers['X-Page-Cache'] == 'hit'
+    with todo.app.test_request_context():
+        session['user_id'] = 1
+        assert todo.db_set_occ_statuses({occur_id}, set(), 'D')['changed'] == 1
+    response = client.get('/list_tasks_for_all')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert 'value="{}"'.format(occur_id) not in response.get_data(as_text=True)
+
+
+def test_csrf_token_of_the_session(todo, client, page_cache, occur_id, monkeypatch):
+    # The page cached for another session of the user comes back with the token of this session
+    monkeypatch.setitem(todo.app.config, 'WTF_CSRF_ENABLED', True)
+    other_token = csrf_token(client.get('/list_tasks_for_all'))
+    # The requests share the app context of the fixture, flask-wtf would give back the token kept in g
+    g.pop('csrf_token', None)
+    other_client = todo.app.test_client()
+    with client.session_transaction() as sess, other_client.session_transaction() as other_sess:
+        other_sess.update({key: value for key, value in sess.items() if key != 'csrf_token'})
+    response = other_client.get('/list_tasks_for_all')
+    assert response.headers['X-Page-Cache'] == 'hit'
+    token = csrf_token(response)
+    assert token != other_token
+    assert todo.CSRF_MARK.decode() not in response.get_data(as_text=True)
+    assert 'value="{}"'.format(token) in response.get_data(as_text=True)
+    data = {'occur': str(occur_id), 'status': 'D', 'redir_to': 2}
+    assert other_client.post('/set_occur_statuses', data=data, headers={'X-CSRFToken': other_token}).status_code == 400
+    assert other_client.post('/set_occur_statuses', data=data, headers={'X-CSRFToken': token}).status_code == 302
+
+
+def test_not_cached_with_flashes(client, page_cache):
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('message', 'Bienvenue')]
+    response = client.get('/list_tags')
+    assert 'X-Page-Cache' not in response.headers
+    assert 'Bienvenue' in response.get_data(as_text=True)
+    assert client.get('/list_tags').headers['X-Page-Cache'] == 'miss'
+    assert 'Bienvenue' not in client.get('/list_tags').get_data(as_text=True)
@@ -0,0 +1,54 @@
+# Number of SQL statements of the pages: it must not grow with the rows shown.
+from datetime import date
+from datetime import datetime
+
+from sqlalchemy import event
+
+
+# Task with nb assignees, tags and schedules, returns its task_id
+def add_task(todo, task_name, nb):
+    task = todo.Task(1, task_name, '', 1, datetime.now())
+    todo.db.session.add(task)
+    todo.db.session.flush()
+    for i in range(nb):
+        user = todo.AppUser('User{}'.format(i), task_name, '{}{}@test.ca'.format(task_name, i), 'x', datetime.now())
+        tag = todo.Tag('{}{}'.format(task_name, i), 1, datetime.now())
+        todo.db.session.add_all([user, tag])
+        todo.db.session.flush()
+        todo.db.session.add(todo.Assignment(task.task_id, user.user_id))
+        todo.db.session.add(todo.TaskTag(task.task_id, tag.tag_id))
+        todo.db.session.add(todo.TaskSched(task.task_id, 'd', date.today(), None, None, None, None, None, 1,
+                                           datetime.now()))
+    todo.db.session.commit()
+    return task.task_id
+
+
+# Response of a GET and the number of SQL statements it ran
+def count_statements(todo, client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(todo.db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(todo.db.engine, 'before_cursor_execute', before_cursor_execute)
+    return response, len(statements)
+
+
+def test_upd_task(todo, client):
+    one_task_id = add_task(todo, 'Une', 1)
+    many_task_id = add_task(todo, 'Plusieurs', 20)
+    with client.session_transaction() as sess:
+        sess['list_id'] = 1
+
+    one_response, one_count = count_statements(todo, client, '/upd_task/{}'.format(one_task_id))
+    many_response, many_count = count_statements(todo, client, '/upd_task/{}'.format(many_task_id))
+    assert one_response.status_code == 200
+    assert many_response.status_code == 200
+    body = many_response.get_data(as_text=True)
+    assert 'User19' in body and 'Plusieurs19' in body
+    assert many_count == one_count
+    assert many_count <= todo.QUERY_BUDGETS['upd_task'][0]
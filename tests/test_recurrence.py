@@ -0,0 +1,85 @@
+# Monthly schedules around the ends of months: the dates of the recurrence engine and of db_add_occur().
+from datetime import date
+from datetime import datetime
+
+import pytest
+
+from recurrence import SchedRule
+
+# (sched_type, sched_start_dt, sched_dom, sched_int, due dates)
+MONTH_ENDS = [
+    # Day 31, a year without Feb 29: clamped to the 28th and to the 30-day months, back to the 31st after them
+    ('m', date(2023, 1, 31), 31, None,
+     [date(2023, 1, 31), date(2023, 2, 28), date(2023, 3, 31), date(2023, 4, 30), date(2023, 5, 31),
+      date(2023, 6, 30), date(2023, 7, 31), date(2023, 8, 31), date(2023, 9, 30)]),
+    # Day 31, a leap year: Feb 29
+    ('m', date(2024, 1, 31), 31, None,
+     [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)]),
+    # Day 30: only February is shorter
+    ('m', date(2023, 1, 30), 30, None,
+     [date(2023, 1, 30), date(2023, 2, 28), date(2023, 3, 30), date(2023, 4, 30), date(2023, 5, 30)]),
+    # Day 29: clamped in February of a year without Feb 29 only
+    ('m', date(2023, 1, 29), 29, None, [date(2023, 1, 29), date(2023, 2, 28), date(2023, 3, 29)]),
+    ('m', date(2024, 1, 29), 29, None, [date(2024, 1, 29), date(2024, 2, 29), date(2024, 3, 29)]),
+    # Every 12 months from Feb 29: Feb 28 until the next leap year
+    ('M', date(2024, 2, 29), 29, 12,
+     [date(2024, 2, 29), date(2025, 2, 28), date(2026, 2, 28), date(2027, 2, 28), date(2028, 2, 29)]),
+    # Every 2 months on the 31st, across a leap February
+    ('M', date(2023, 8, 31), 31, 2,
+     [date(2023, 8, 31), date(2023, 10, 31), date(2023, 12, 31), date(2024, 2, 29), date(2024, 4, 30),
+      date(2024, 6, 30), date(2024, 8, 31)]),
+    # Every 3 months on the 30th
+    ('M', date(2022, 11, 30), 30, 3,
+     [date(2022, 11, 30), date(2023, 2, 28), date(2023, 5, 30), date(2023, 8, 30), date(2023, 11, 30),
+      date(2024, 2, 29)]),
+    # The first occurence is on sched_start_dt as is, only the following ones are on sched_dom (clamped)
+    ('m', date(2023, 1, 10), 31, None,
+     [date(2023, 1, 10), date(2023, 2, 28), date(2023, 3, 31), date(2023, 4, 30)]),
+    ('M', date(2024, 1, 15), 30, 1,
+     [date(2024, 1, 15), date(2024, 2, 29), date(2024, 3, 30), date(2024, 4, 30)]),
+]
+
+
+@pytest.mark.parametrize('sched_type, start_dt, dom, interval, expected', MONTH_ENDS)
+def test_dates(sched_type, start_dt, dom, interval, expected):
+    rule = SchedRule(sched_type, start_dt, None, None, dom, interval)
+    assert rule.dates(start_dt, expected[-1]) == expected
+    assert [rule.nth_date(k) for k in range(len(expected))] == expected
+
+
+@pytest.mark.parametrize('sched_type, start_dt, dom, interval, expected', MONTH_ENDS)
+def test_next_date(sched_type, start_dt, dom, interval, expected):
+    rule = SchedRule(sched_type, start_dt, None, None, dom, interval)
+    dates = [rule.next_date()]
+    while len(dates) < len(expected):
+        dates.append(rule.next_date(dates[-1]))
+    assert dates == expected
+    # Continued from any of its dates, the sequence is the same
+    for k, after_dt in enumerate(expected):
+        assert rule.dates(start_dt, expected[-1], after_dt) == expected[k + 1:]
+
+
+@pytest.mark.parametrize('sched_type, start_dt, dom, interval, expected', MONTH_ENDS)
+def test_end_date(sched_type, start_dt, dom, interval, expected):
+    # The end date keeps the dates on or before it, clamped or not
+    rule = SchedRule(sched_type, start_dt, expected[2], None, dom, interval)
+    assert rule.dates(start_dt, expected[-1]) == expected[:3]
+    assert rule.next_date(expected[2]) is None
+
+
+@pytest.mark.parametrize('sched_type, start_dt, dom, interval, expected', MONTH_ENDS)
+def test_db_add_occur(todo, sched_type, start_dt, dom, interval, expected):
+    # db_add_occur() stores one occurence at a time, each one after sched_last_occ_dt
+    task = todo.Task(1, 'Loyer', '', 1, datetime.now())
+    todo.db.session.add(task)
+    todo.db.session.commit()
+    sched = todo.TaskSched(task.task_id, sched_type, start_dt, None, None, None, dom, interval, 1, datetime.now())
+    todo.db.session.add(sched)
+    todo.db.session.commit()
+    for i in range(len(expected)):
+        assert todo.db_add_occur(sched.sched_id)
+    occurs = todo.TaskOccurence.query.filter_by(sched_id=sched.sched_id).order_by(todo.TaskOccurence.sched_dt).all()
+    assert [occur.sched_dt for occur in occurs] == expected
+    assert todo.db.session.get(todo.TaskSched, sched.sched_id).sched_last_occ_dt == expected[-1]
+    rule = SchedRule(sched_type, start_dt, None, None, dom, interval)
+    assert [occur.sched_dt for occur in occurs] == rule.dates(start_dt, expected[-1])
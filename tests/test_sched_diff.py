@@ -0,0 +1,27 @@
+# The recurrence engines and db_add_occur give the dates of the stepping of db_add_occur before the engine.
+import random
+
+import pytest
+
+from benchmarks import sched_diff
+
+NB_STEPS = 12
+
+
+@pytest.fixture(scope='module')
+def scheds():
+    rnd = random.Random(20160101)
+    return [sched_diff.random_sched(rnd) for i in range(200)]
+
+
+@pytest.mark.parametrize('name', ['rule', 'next'])
+def test_engine(scheds, name):
+    engine = sched_diff.load_engine(name)
+    expected = [sched_diff.legacy_dates(sched, NB_STEPS) for sched in scheds]
+    got = [engine(sched, NB_STEPS) for sched in scheds]
+    assert sched_diff.first_divergence(expected, got) is None
+
+
+def test_db_add_occur(todo, scheds):
+    expected = [sched_diff.legacy_dates(sched, NB_STEPS) for sched in scheds[:20]]
+    assert sched_diff.first_divergence(expected, sched_diff.db_dates(todo, scheds[:20], NB_STEPS)) is None
@@ -0,0 +1,50 @@
+# A change of schedule rewrites its occurences to do and its rows of topen_work in the same transaction.
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.fixture
+def sched_id(todo):
+    now = datetime.now()
+    todo.db.session.add(todo.Task(1, 'Arrosage', '', 1, now))
+    todo.db.session.add(todo.Assignment(1, 1))
+    sched = todo.TaskSched(1, 'D', date.today() - timedelta(days=4), None, None, None, None, 2, 1, now)
+    todo.db.session.add(sched)
+    todo.db.session.commit()
+    assert todo.db_add_occur(sched.sched_id)
+    return sched.sched_id
+
+
+def open_work(todo):
+    return todo.db.session.query(todo.OpenWork.sched_int, todo.OpenWork.sched_dt).all()
+
+
+def test_upd_sched(todo, sched_id):
+    start_dt = date.today() - timedelta(days=4)
+    assert open_work(todo) == [(2, start_dt)]
+    with todo.app.test_request_context():
+        assert todo.db_upd_sched_xdy(sched_id, start_dt + timedelta(days=1), None, 5)
+    todo.db.session.expire_all()
+    assert open_work(todo) == [(5, start_dt + timedelta(days=1))]
+    occurs = todo.TaskOccurence.query.filter_by(sched_id=sched_id).all()
+    assert [(occur.sched_dt, occur.status) for occur in occurs] == [(start_dt + timedelta(days=1), 'T')]
+
+
+def test_upd_sched_rollback(todo, sched_id, monkeypatch):
+    # When the occurences can't be rewritten, the schedule is not changed either
+    def sync_open_work(sched_ids=None, task_ids=None):
+        raise RuntimeError('sync_open_work')
+
+    start_dt = date.today() - timedelta(days=4)
+    monkeypatch.setattr(todo, 'sync_open_work', sync_open_work)
+    with todo.app.test_request_context():
+        assert not todo.db_upd_sched_xdy(sched_id, start_dt + timedelta(days=1), None, 5)
+    todo.db.session.expire_all()
+    sched = todo.db.session.get(todo.TaskSched, sched_id)
+    assert (sched.sched_start_dt, sched.sched_int) == (start_dt, 2)
+    assert open_work(todo) == [(2, start_dt)]
+    occurs = todo.TaskOccurence.query.filter_by(sched_id=sched_id).all()
+    assert [occur.sched_dt for occur in occurs] == [start_dt]
@@ -0,0 +1,72 @@
+# Rows returned by set_occur_statuses to the script of the lists (fragment=1).
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+import html
+import json
+import re
+
+import pytest
+
+TODAY = date.today()
+
+
+# Tasks 'Arrosage' (tag 1) and 'Balayage' (tag 2), each with a daily schedule filled for three days
+@pytest.fixture
+def scheds(todo):
+    now = datetime.now()
+    sched_ids = []
+    for task_id, (task_name, tag_name) in enumerate([('Arrosage', 'Jardin'), ('Balayage', 'Cuisine')], 1):
+        todo.db.session.add(todo.Task(1, task_name, '', 1, now))
+        todo.db.session.add(todo.Tag(tag_name, 1, now))
+        todo.db.session.flush()
+        todo.db.session.add(todo.TaskTag(task_id, task_id))
+        todo.db.session.add(todo.Assignment(task_id, 1))
+        sched = todo.TaskSched(task_id, 'd', TODAY, None, TODAY + timedelta(days=2), None, None, None, 1, now)
+        todo.db.session.add(sched)
+        todo.db.session.flush()
+        for days in range(3):
+            todo.db.session.add(todo.TaskOccurence(task_id, sched.sched_id, TODAY + timedelta(days=days)))
+        sched_ids.append(sched.sched_id)
+    todo.sync_open_work()
+    todo.db.session.commit()
+    return sched_ids
+
+
+def occur_id(todo, sched_id, sched_dt):
+    return todo.TaskOccurence.query.filter_by(sched_id=sched_id, sched_dt=sched_dt).one().occur_id
+
+
+def sort_keys(response):
+    assert response.status_code == 200
+    return [json.loads(html.unescape(key))
+            for key in re.findall(r"data-sort-key='([^']*)'", response.get_data(as_text=True))]
+
+
+def test_fragment_rows(todo, client, scheds):
+    # Only the open rows of the schedule changed, in the order of the list, with their sort key
+    response = client.post('/set_occur_statuses', data={'occur': occur_id(todo, scheds[0], TODAY), 'status': 'D',
+                                                        'redir_to': 1, 'fragment': 1})
+    assert sort_keys(response) == [[str(TODAY + timedelta(days=days)), 'Arrosage', scheds[0], 'Jean']
+                                   for days in (1, 2)]
+
+
+def test_fragment_tag_of_the_page(todo, client, scheds):
+    # The tag of the list is the one posted by the page, not the last one shown in the session
+    with client.session_transaction() as sess:
+        sess['tag_id'] = 1
+    response = client.post('/set_occur_statuses', data={'occur': occur_id(todo, scheds[1], TODAY), 'status': 'D',
+                                                        'redir_to': 3, 'tag_id': 2, 'fragment': 1})
+    assert [key[1] for key in sort_keys(response)] == ['Balayage', 'Balayage']
+    response = client.post('/set_occur_statuses', data={'occur': occur_id(todo, scheds[1], TODAY + timedelta(days=1)),
+                                                        'status': 'D', 'redir_to': 3, 'tag_id': 1, 'fragment': 1})
+    assert sort_keys(response) == []
+
+
+def test_redirect_tag_of_the_page(todo, client, scheds):
+    with client.session_transaction() as sess:
+        sess['tag_id'] = 1
+    response = client.post('/set_occur_statuses', data={'occur': occur_id(todo, scheds[1], TODAY), 'status': 'D',
+                                                        'redir_to': 3, 'tag_id': 2})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/list_tasks_by_tag/2')